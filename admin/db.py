@@ -40,3 +40,23 @@ def row(record) -> dict:
 
 def rows(records) -> list[dict]:
     return [row(r) for r in records]
+
+
+# Как OUTBOX_CHANNEL / enqueue_panel_sync в bot/database/outbox.py
+OUTBOX_CHANNEL = "panel_outbox"
+
+
+async def enqueue_panel_sync(c: asyncpg.Connection, subscription_id: int, panel_username: str) -> None:
+    """
+    Ставит подписку в очередь синхронизации с её панелью — срок в PasarGuard выставит
+    воркер бота по данным БД. Вызывать в транзакции, которая меняет подписку.
+    """
+    await c.execute("""
+        INSERT INTO panel_outbox (subscription_id, panel_username)
+        VALUES ($1, $2)
+        ON CONFLICT (subscription_id) WHERE status = 'pending'
+        DO UPDATE SET version         = panel_outbox.version + 1,
+                      next_attempt_at = NOW(),
+                      attempts        = 0
+    """, subscription_id, panel_username)
+    await c.execute("SELECT pg_notify($1, '')", OUTBOX_CHANNEL)
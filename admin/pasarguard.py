@@ -1,19 +1,37 @@
 """
 pasarguard.py — лёгкий HTTP-клиент PasarGuard для admin-панели.
 Без состояния (stateless): каждый вызов открывает сессию и закрывает её.
+
+Сроки подписок админка в панель не пишет — она меняет БД и ставит задачу в
+panel_outbox (см. db.enqueue_panel_sync), панель синхронизирует воркер бота.
+Напрямую отсюда — только удаление пользователя, и всегда на его панели
+(subscriptions.panel_id): доступы панелей — те же переменные, что у бота.
 """
 
 import os
-from datetime import datetime, timedelta
 
 import aiohttp
 
 PASARGUARD_URL:  str = os.environ.get("PASARGUARD_URL", "")
 PASARGUARD_USER: str = os.environ.get("PASARGUARD_USERNAME", "")
 PASARGUARD_PASS: str = os.environ.get("PASARGUARD_PASSWORD", "")
-INBOUND_TAG:     str = os.environ.get("PASARGUARD_INBOUND_TAG", "vless-tcp")
-FLOW:            str = os.environ.get("PASARGUARD_FLOW", "xtls-rprx-vision")
-PLAN_DAYS:       int = int(os.environ.get("PLAN_DAYS", "30"))
+
+# Как PASARGUARD_PANELS / PASARGUARD_PANEL_SETTINGS в bot/config.py:
+# первая панель — PASARGUARD_URL/USERNAME/PASSWORD, остальные — PASARGUARD_<ID>_*.
+PANEL_IDS: list[str] = [
+    p.strip() for p in os.environ.get("PASARGUARD_PANELS", "main").split(",") if p.strip()
+]
+PANELS: dict[str, dict[str, str]] = {
+    PANEL_IDS[0]: {"url": PASARGUARD_URL, "username": PASARGUARD_USER, "password": PASARGUARD_PASS},
+    **{
+        panel_id: {
+            "url": os.environ.get(f"PASARGUARD_{panel_id.upper()}_URL", ""),
+            "username": os.environ.get(f"PASARGUARD_{panel_id.upper()}_USERNAME", ""),
+            "password": os.environ.get(f"PASARGUARD_{panel_id.upper()}_PASSWORD", ""),
+        }
+        for panel_id in PANEL_IDS[1:]
+    },
+}
 
 
 def panel_username(uid: int) -> str:
@@ -21,30 +39,17 @@ def panel_username(uid: int) -> str:
     return f"tg_{uid}"
 
 
-def _parse_expire(value) -> int:
-    """
-    PasarGuard может вернуть expire как Unix timestamp (int/float/str)
-    или как ISO-строку ('2026-03-04T19:34:50Z'). Конвертируем оба варианта.
-    """
-    if not value:
-        return int(__import__('datetime').datetime.utcnow().timestamp())
-    s = str(value).strip()
-    if any(c.isalpha() for c in s):
-        from datetime import datetime, timezone
-        for fmt in ("%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S%z"):
-            try:
-                dt = datetime.strptime(s.replace("+00:00", "Z").replace("Z", ""),
-                                       fmt.rstrip("Z").rstrip("%z"))
-                return int(dt.replace(tzinfo=timezone.utc).timestamp())
-            except ValueError:
-                continue
-    return int(float(s))
+def _panel(panel_id: str | None) -> dict[str, str]:
+    settings = PANELS.get(panel_id or PANEL_IDS[0])
+    if settings is None or not settings["url"]:
+        raise ValueError(f"PasarGuard panel '{panel_id}' is not configured")
+    return settings
 
 
-async def _token(session: aiohttp.ClientSession) -> str:
+async def _token(session: aiohttp.ClientSession, panel: dict[str, str]) -> str:
     async with session.post(
-        f"{PASARGUARD_URL}/api/admin/token",
-        data={"username": PASARGUARD_USER, "password": PASARGUARD_PASS},
+        f"{panel['url']}/api/admin/token",
+        data={"username": panel["username"], "password": panel["password"]},
     ) as r:
         r.raise_for_status()
         return (await r.json())["access_token"]
@@ -54,12 +59,13 @@ def _headers(token: str) -> dict:
     return {"Authorization": f"Bearer {token}"}
 
 
-async def get_user(username: str) -> dict | None:
-    """Возвращает данные пользователя или None если не найден."""
+async def get_user(username: str, panel_id: str | None = None) -> dict | None:
+    """Возвращает данные пользователя на панели panel_id или None если не найден."""
+    panel = _panel(panel_id)
     async with aiohttp.ClientSession() as s:
-        token = await _token(s)
+        token = await _token(s, panel)
         async with s.get(
-            f"{PASARGUARD_URL}/api/user/{username}", headers=_headers(token)
+            f"{panel['url']}/api/user/{username}", headers=_headers(token)
         ) as r:
             if r.status == 404:
                 return None
@@ -67,212 +73,13 @@ async def get_user(username: str) -> dict | None:
             return await r.json()
 
 
-async def create_user(uid: int) -> dict:
-    """Создаёт пользователя в PasarGuard с именем tg_{uid}. Возвращает данные пользователя."""
-    expire_ts = int((datetime.utcnow() + timedelta(days=PLAN_DAYS)).timestamp())
-    username = panel_username(uid)
-    payload = {
-        "username": username,
-        "proxies": {"vless": {"flow": FLOW}},
-        "inbounds": {"vless": [INBOUND_TAG]},
-        "expire": expire_ts,
-        "data_limit": 0,
-        "data_limit_reset_strategy": "no_reset",
-        "status": "active",
-        "group_ids": [1],
-    }
-    async with aiohttp.ClientSession() as s:
-        token = await _token(s)
-        async with s.post(
-            f"{PASARGUARD_URL}/api/user", json=payload, headers=_headers(token)
-        ) as r:
-            r.raise_for_status()
-            return await r.json()
-
-
-async def ensure_user(uid: int) -> dict:
-    """
-    Создаёт пользователя если не существует, продлевает если уже есть.
-    Всегда возвращает актуальные данные пользователя из PasarGuard.
-    """
-    username = panel_username(uid)
-    existing = await get_user(username)
-    if existing is not None:
-        await extend_user(username, PLAN_DAYS)
-        # После продления запрашиваем свежие данные (обновился expire и subscription_url)
-        return await get_user(username)
-    return await create_user(uid)
-
-
-async def extend_user(username: str, extra_days: int = PLAN_DAYS) -> None:
-    """Продлевает срок пользователя в PasarGuard."""
-    async with aiohttp.ClientSession() as s:
-        token = await _token(s)
-        h = _headers(token)
-        async with s.get(f"{PASARGUARD_URL}/api/user/{username}", headers=h) as r:
-            r.raise_for_status()
-            user = await r.json()
-        current = _parse_expire(user.get("expire"))
-        new_exp = max(current, int(datetime.utcnow().timestamp())) + extra_days * 86400
-        payload = {
-            "proxies": user.get("proxies") or {"vless": {"flow": FLOW}},
-            "inbounds": user.get("inbounds") or {"vless": [INBOUND_TAG]},
-            "expire": new_exp,
-            "data_limit": user.get("data_limit", 0),
-            "data_limit_reset_strategy": user.get("data_limit_reset_strategy", "no_reset"),
-            "status": "active",
-            "group_ids": [1],
-        }
-        async with s.put(
-            f"{PASARGUARD_URL}/api/user/{username}", json=payload, headers=h
-        ) as r:
-            r.raise_for_status()
-
-
-async def set_expire_user(username: str, new_expire_ts: int) -> None:
-    """Устанавливает точную дату истечения подписки в PasarGuard."""
-    async with aiohttp.ClientSession() as s:
-        token = await _token(s)
-        h = _headers(token)
-        async with s.get(f"{PASARGUARD_URL}/api/user/{username}", headers=h) as r:
-            r.raise_for_status()
-            user = await r.json()
-        payload = {
-            "proxies": user.get("proxies") or {"vless": {"flow": FLOW}},
-            "inbounds": user.get("inbounds") or {"vless": [INBOUND_TAG]},
-            "expire": new_expire_ts,
-            "data_limit": user.get("data_limit", 0),
-            "data_limit_reset_strategy": user.get("data_limit_reset_strategy", "no_reset"),
-            "status": "active",
-            "group_ids": [1],
-        }
-        async with s.put(
-            f"{PASARGUARD_URL}/api/user/{username}", json=payload, headers=h
-        ) as r:
-            r.raise_for_status()
-
-
-async def delete_user(username: str) -> None:
-    """Удаляет пользователя из PasarGuard."""
-    async with aiohttp.ClientSession() as s:
-        token = await _token(s)
-        async with s.delete(
-            f"{PASARGUARD_URL}/api/user/{username}", headers=_headers(token)
-        ) as r:
-            if r.status not in (200, 404):
-                r.raise_for_status()
-
-
-
-
-def _parse_expire(value) -> int:
-    """
-    PasarGuard может вернуть expire как Unix timestamp (int/float/str)
-    или как ISO-строку ('2026-03-04T19:34:50Z'). Конвертируем оба варианта.
-    """
-    if not value:
-        return int(__import__('datetime').datetime.utcnow().timestamp())
-    s = str(value).strip()
-    # Если строка содержит буквы — скорее всего ISO-формат
-    if any(c.isalpha() for c in s):
-        from datetime import datetime, timezone
-        for fmt in ("%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S%z"):
-            try:
-                dt = datetime.strptime(s.replace("+00:00", "Z").replace("Z", ""), 
-                                       fmt.rstrip("Z").rstrip("%z"))
-                return int(dt.replace(tzinfo=timezone.utc).timestamp())
-            except ValueError:
-                continue
-    return int(float(s))
-
-
-async def _token(session: aiohttp.ClientSession) -> str:
-    async with session.post(
-        f"{PASARGUARD_URL}/api/admin/token",
-        data={"username": PASARGUARD_USER, "password": PASARGUARD_PASS},
-    ) as r:
-        r.raise_for_status()
-        return (await r.json())["access_token"]
-
-
-def _headers(token: str) -> dict:
-    return {"Authorization": f"Bearer {token}"}
-
-
-async def create_user(uid: int) -> dict:
-    """Создаёт пользователя в PasarGuard. Возвращает {username, links, subscription_url}."""
-    expire_ts = int((datetime.utcnow() + timedelta(days=PLAN_DAYS)).timestamp())
-    payload = {
-        "username": _gen_username(uid),
-        "proxies": {"vless": {"flow": FLOW}},
-        "inbounds": {"vless": [INBOUND_TAG]},
-        "expire": expire_ts,
-        "data_limit": 0,
-        "data_limit_reset_strategy": "no_reset",
-        "group_ids": [1],  # Группа "ALL" — даёт доступ ко всем серверам
-    }
-    async with aiohttp.ClientSession() as s:
-        token = await _token(s)
-        async with s.post(
-            f"{PASARGUARD_URL}/api/user", json=payload, headers=_headers(token)
-        ) as r:
-            r.raise_for_status()
-            return await r.json()
-
-
-async def extend_user(username: str, extra_days: int = PLAN_DAYS) -> None:
-    """Продлевает срок пользователя в PasarGuard."""
-    async with aiohttp.ClientSession() as s:
-        token = await _token(s)
-        h = _headers(token)
-        async with s.get(f"{PASARGUARD_URL}/api/user/{username}", headers=h) as r:
-            r.raise_for_status()
-            user = await r.json()
-        current = _parse_expire(user.get("expire"))
-        new_exp = max(current, int(datetime.utcnow().timestamp())) + extra_days * 86400
-        # Передаём все поля пользователя чтобы PasarGuard не сбросил proxies/inbounds
-        payload = {
-            "proxies": user.get("proxies") or {"vless": {"flow": FLOW}},
-            "inbounds": user.get("inbounds") or {"vless": [INBOUND_TAG]},
-            "expire": new_exp,
-            "data_limit": user.get("data_limit", 0),
-            "data_limit_reset_strategy": user.get("data_limit_reset_strategy", "no_reset"),
-            "status": "active",
-        }
-        async with s.put(
-            f"{PASARGUARD_URL}/api/user/{username}", json=payload, headers=h
-        ) as r:
-            r.raise_for_status()
-
-
-async def set_expire_user(username: str, new_expire_ts: int) -> None:
-    """Устанавливает точную дату истечения подписки в PasarGuard."""
-    async with aiohttp.ClientSession() as s:
-        token = await _token(s)
-        h = _headers(token)
-        async with s.get(f"{PASARGUARD_URL}/api/user/{username}", headers=h) as r:
-            r.raise_for_status()
-            user = await r.json()
-        payload = {
-            "proxies": user.get("proxies") or {"vless": {"flow": FLOW}},
-            "inbounds": user.get("inbounds") or {"vless": [INBOUND_TAG]},
-            "expire": new_expire_ts,
-            "data_limit": user.get("data_limit", 0),
-            "data_limit_reset_strategy": user.get("data_limit_reset_strategy", "no_reset"),
-            "status": "active",
-        }
-        async with s.put(
-            f"{PASARGUARD_URL}/api/user/{username}", json=payload, headers=h
-        ) as r:
-            r.raise_for_status()
-
-
-async def delete_user(username: str) -> None:
-    """Удаляет пользователя из PasarGuard."""
+async def delete_user(username: str, panel_id: str | None = None) -> None:
+    """Удаляет пользователя с панели panel_id."""
+    panel = _panel(panel_id)
     async with aiohttp.ClientSession() as s:
-        token = await _token(s)
+        token = await _token(s, panel)
         async with s.delete(
-            f"{PASARGUARD_URL}/api/user/{username}", headers=_headers(token)
+            f"{panel['url']}/api/user/{username}", headers=_headers(token)
         ) as r:
             if r.status not in (200, 404):
                 r.raise_for_status()
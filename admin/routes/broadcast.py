@@ -1,6 +1,10 @@
 """
 routes/broadcast.py — /api/broadcast
 
+Админка только ставит задачу в broadcast_jobs и сразу отвечает её id — отправляет
+воркер бота (bot/services/broadcasts.py) с общим лимитом Telegram и повторами после 429.
+Прогресс — GET /api/broadcast/<id>.
+
 Аудитории:
   all           — все незабаненные
   active        — есть активная подписка
@@ -11,14 +15,15 @@ routes/broadcast.py — /api/broadcast
   paid_once     — ровно 1 успешный платёж
 """
 
-import os
-import aiohttp
 from flask import Blueprint, jsonify, request
-from db import run, conn
+from db import run, conn, row
 
 bp = Blueprint("broadcast", __name__)
-BOT_TOKEN = os.environ.get("BOT_TOKEN", "")
 
+# Как BROADCASTS_CHANNEL в bot/database/broadcasts.py
+BROADCASTS_CHANNEL = "broadcast_jobs"
+
+# Должны совпадать с _AUDIENCES в bot/database/broadcasts.py (по ним отправляет бот)
 _AUDIENCE_QUERIES = {
     "all": """
         SELECT user_id FROM users WHERE NOT is_banned
@@ -81,29 +86,38 @@ def broadcast():
     async def _():
         c = await conn()
         try:
-            targets = await c.fetch(_AUDIENCE_QUERIES[audience])
+            async with c.transaction():
+                job = await c.fetchrow(f"""
+                    INSERT INTO broadcast_jobs (text, audience, total)
+                    SELECT $1, $2, COUNT(*) FROM ({_AUDIENCE_QUERIES[audience]}) t
+                    RETURNING id, status, total
+                """, text, audience)
+                await c.execute("SELECT pg_notify($1, '')", BROADCASTS_CHANNEL)
         finally:
             await c.close()
+        return row(job)
 
-        sent = failed = 0
-        async with aiohttp.ClientSession() as http:
-            for t in targets:
-                try:
-                    async with http.post(
-                        f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage",
-                        json={"chat_id": t["user_id"], "text": text, "parse_mode": "HTML"},
-                        timeout=aiohttp.ClientTimeout(total=5),
-                    ) as r:
-                        if r.status == 200:
-                            sent += 1
-                        else:
-                            failed += 1
-                except Exception:
-                    failed += 1
-
-        return {"sent": sent, "failed": failed, "total": len(targets)}
+    return jsonify(run(_())), 202
 
-    return jsonify(run(_()))
+
+@bp.get("/broadcast/<int:job_id>")
+def broadcast_progress(job_id: int):
+    async def _():
+        c = await conn()
+        try:
+            return await c.fetchrow("""
+                SELECT id, audience, status, total, sent, failed,
+                       GREATEST(COALESCE(total, 0) - sent - failed, 0) AS remaining,
+                       created_at, started_at, finished_at
+                FROM broadcast_jobs WHERE id = $1
+            """, job_id)
+        finally:
+            await c.close()
+
+    job = run(_())
+    if job is None:
+        return jsonify({"error": "Рассылка не найдена"}), 404
+    return jsonify(row(job))
 
 
 @bp.get("/broadcast/count")
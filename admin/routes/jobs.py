@@ -0,0 +1,42 @@
+"""routes/jobs.py — /api/jobs (история фоновых задач бота, представления job_overview / job_run_history)"""
+
+import os
+
+from flask import Blueprint, jsonify, request
+from db import run, conn, rows
+
+bp = Blueprint("jobs", __name__)
+
+# Как JOB_OVERRUN_RATIO в bot/config.py
+OVERRUN_RATIO = float(os.environ.get("JOB_OVERRUN_RATIO", "0.8"))
+
+
+@bp.get("/jobs")
+def list_jobs():
+    try:
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        return jsonify({"error": "limit должен быть числом"}), 400
+    if not 1 <= limit <= 500:
+        return jsonify({"error": "limit должен быть от 1 до 500"}), 400
+    job_id = request.args.get("job") or None
+
+    async def _():
+        c = await conn()
+        try:
+            overview = await c.fetch("SELECT * FROM job_overview ORDER BY job_id")
+            recent = await c.fetch("""
+                SELECT * FROM job_run_history
+                WHERE ($2::text IS NULL OR job_id = $2)
+                ORDER BY started_at DESC
+                LIMIT $1
+            """, limit, job_id)
+        finally:
+            await c.close()
+
+        jobs = rows(overview)
+        for job in jobs:
+            job["near_overrun"] = (job["interval_load"] or 0) >= OVERRUN_RATIO
+        return {"jobs": jobs, "runs": rows(recent)}
+
+    return jsonify(run(_()))
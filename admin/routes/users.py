@@ -3,9 +3,9 @@ routes/users.py — пользователи и управление подпи
 """
 
 import os
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, timezone, date
 from flask import Blueprint, jsonify, request
-from db import run, conn, row, rows
+from db import run, conn, row, rows, enqueue_panel_sync
 import pasarguard as pg
 
 bp = Blueprint("users", __name__)
@@ -191,72 +191,49 @@ def ban_user(uid):
 
 
 # ── Grant subscription ─────────────────────────────────────────────
+#
+# Срок меняется только в БД, в той же транзакции ставится задача panel_outbox —
+# пользователя на его панели (subscriptions.panel_id) продлит или создаст воркер бота.
+# Новая подписка из админки — на панели по умолчанию, ссылку заполнит backfill бота.
 
 @bp.post("/users/<int:uid>/sub/grant")
 def grant_sub(uid):
     async def _():
         c = await conn()
         try:
-            # Ищем любую подписку (активную или нет) — для переиспользования
-            any_sub = await c.fetchrow(
-                "SELECT id, panel_username, subscription_url, is_active "
-                "FROM subscriptions WHERE user_id=$1 ORDER BY id DESC LIMIT 1",
-                uid,
-            )
+            async with c.transaction():
+                # Ищем любую подписку (активную или нет) — для переиспользования
+                any_sub = await c.fetchrow(
+                    "SELECT id, panel_username, subscription_url "
+                    "FROM subscriptions WHERE user_id=$1 ORDER BY id DESC LIMIT 1 FOR UPDATE",
+                    uid,
+                )
+                if any_sub:
+                    # Пользователь уже существует — продлеваем / реактивируем
+                    panel_uname = any_sub["panel_username"] or pg.panel_username(uid)
+                    await c.execute("""
+                        UPDATE subscriptions
+                        SET expires_at = GREATEST(expires_at, NOW()) + $1::interval,
+                            is_active  = TRUE,
+                            panel_username = $2
+                        WHERE id = $3
+                    """, timedelta(days=PLAN_DAYS), panel_uname, any_sub["id"])
+                    sub_id, sub_url, action = any_sub["id"], any_sub["subscription_url"], "extended"
+                else:
+                    # Первое начисление — создаём с нуля
+                    panel_uname = pg.panel_username(uid)
+                    sub_id = await c.fetchval("""
+                        INSERT INTO subscriptions
+                            (user_id, panel_username, expires_at, is_active, auto_renew)
+                        VALUES ($1, $2, $3, TRUE, FALSE) RETURNING id
+                    """, uid, panel_uname, datetime.utcnow() + timedelta(days=PLAN_DAYS))
+                    sub_url, action = None, "created"
+                await enqueue_panel_sync(c, sub_id, panel_uname)
         finally:
             await c.close()
 
-        if any_sub:
-            # Пользователь уже существует — продлеваем / реактивируем
-            # panel_username берём из БД, но если там вдруг старое значение — используем tg_{uid}
-            panel_uname = any_sub["panel_username"] or pg.panel_username(uid)
-            await pg.extend_user(panel_uname, PLAN_DAYS)
-
-            # Получаем свежий subscription_url из PasarGuard (на случай если в БД пусто)
-            pg_user = await pg.get_user(panel_uname)
-            sub_url = any_sub["subscription_url"] or ""
-            if not sub_url and pg_user:
-                sub_url = pg_user.get("subscription_url") or ""
-                if sub_url.startswith("/"):
-                    sub_url = f"{pg.PASARGUARD_URL.rstrip('/')}{sub_url}"
-
-            expires_at = datetime.utcnow() + timedelta(days=PLAN_DAYS)
-            c = await conn()
-            try:
-                await c.execute("""
-                    UPDATE subscriptions
-                    SET expires_at = GREATEST(expires_at, NOW()) + $1::interval,
-                        is_active  = TRUE,
-                        subscription_url = COALESCE(NULLIF(subscription_url, ''), $2)
-                    WHERE id = $3
-                """, timedelta(days=PLAN_DAYS), sub_url or None, any_sub["id"])
-            finally:
-                await c.close()
-
-            return {"ok": True, "sub_id": any_sub["id"], "panel_username": panel_uname,
-                    "subscription_url": sub_url, "action": "extended"}
-
-        else:
-            # Первое начисление — создаём с нуля
-            pg_user = await pg.ensure_user(uid)
-            panel_uname = pg_user["username"]
-            sub_url = pg_user.get("subscription_url") or ""
-            if sub_url.startswith("/"):
-                sub_url = f"{pg.PASARGUARD_URL.rstrip('/')}{sub_url}"
-            expires_at = datetime.utcnow() + timedelta(days=PLAN_DAYS)
-
-            c = await conn()
-            try:
-                sub_id = await c.fetchval("""
-                    INSERT INTO subscriptions
-                        (user_id, panel_username, expires_at, is_active, auto_renew, subscription_url)
-                    VALUES ($1, $2, $3, TRUE, FALSE, $4) RETURNING id
-                """, uid, panel_uname, expires_at, sub_url or None)
-            finally:
-                await c.close()
-
-            return {"ok": True, "sub_id": sub_id, "panel_username": panel_uname,
-                    "subscription_url": sub_url, "action": "created"}
+        return {"ok": True, "sub_id": sub_id, "panel_username": panel_uname,
+                "subscription_url": sub_url or "", "action": action}
 
     try:
         return jsonify(run(_()))
@@ -271,20 +248,17 @@ def extend_sub(uid):
     async def _():
         c = await conn()
         try:
-            sub = await c.fetchrow(
-                "SELECT id, panel_username FROM subscriptions "
-                "WHERE user_id=$1 ORDER BY id DESC LIMIT 1",
-                uid,
-            )
-            if not sub:
-                return {"error": "Подписка не найдена"}
-            await pg.extend_user(sub["panel_username"])
-            await c.execute("""
-                UPDATE subscriptions
-                SET expires_at = GREATEST(expires_at, NOW()) + $1::interval,
-                    is_active  = TRUE
-                WHERE id = $2
-            """, timedelta(days=PLAN_DAYS), sub["id"])
+            async with c.transaction():
+                sub = await c.fetchrow("""
+                    UPDATE subscriptions
+                    SET expires_at = GREATEST(expires_at, NOW()) + $1::interval,
+                        is_active  = TRUE
+                    WHERE id = (SELECT id FROM subscriptions WHERE user_id=$2 ORDER BY id DESC LIMIT 1)
+                    RETURNING id, panel_username
+                """, timedelta(days=PLAN_DAYS), uid)
+                if not sub:
+                    return {"error": "Подписка не найдена"}
+                await enqueue_panel_sync(c, sub["id"], sub["panel_username"])
         finally:
             await c.close()
         return {"ok": True}
@@ -320,31 +294,27 @@ def adjust_sub(uid):
     async def _():
         c = await conn()
         try:
-            sub = await c.fetchrow(
-                "SELECT id, panel_username, expires_at FROM subscriptions "
-                "WHERE user_id=$1 ORDER BY id DESC LIMIT 1",
-                uid,
-            )
-            if not sub:
-                return {"error": "Подписка не найдена"}
-
-            # Вычисляем итоговый timestamp
-            if "exact_ts" in body:
-                ts = new_ts
-            else:
-                from_dt = sub["expires_at"] if sub["expires_at"] else __import__('datetime').datetime.utcnow()
-                ts = int(from_dt.timestamp()) + delta_days * 86400
-
-            # Обновляем PasarGuard
-            await pg.set_expire_user(sub["panel_username"], ts)
-
-            # Обновляем БД
-            from datetime import datetime as _dt
-            new_expires = _dt.utcfromtimestamp(ts)
-            await c.execute(
-                "UPDATE subscriptions SET expires_at=$1, is_active=TRUE WHERE id=$2",
-                new_expires, sub["id"],
-            )
+            async with c.transaction():
+                sub = await c.fetchrow(
+                    "SELECT id, panel_username, expires_at FROM subscriptions "
+                    "WHERE user_id=$1 ORDER BY id DESC LIMIT 1 FOR UPDATE",
+                    uid,
+                )
+                if not sub:
+                    return {"error": "Подписка не найдена"}
+
+                # Вычисляем итоговый timestamp (expires_at в БД — naive UTC)
+                if "exact_ts" in body:
+                    ts = new_ts
+                else:
+                    from_dt = sub["expires_at"] or datetime.utcnow()
+                    ts = int(from_dt.replace(tzinfo=timezone.utc).timestamp()) + delta_days * 86400
+
+                await c.execute(
+                    "UPDATE subscriptions SET expires_at=$1, is_active=TRUE WHERE id=$2",
+                    datetime.utcfromtimestamp(ts), sub["id"],
+                )
+                await enqueue_panel_sync(c, sub["id"], sub["panel_username"])
         finally:
             await c.close()
         return {"ok": True, "new_expires_ts": ts}
@@ -364,27 +334,30 @@ def delete_user(uid):
     async def _():
         c = await conn()
         try:
-            sub = await c.fetchrow(
-                "SELECT panel_username FROM subscriptions "
-                "WHERE user_id=$1 ORDER BY id DESC LIMIT 1",
-                uid,
-            )
-            await c.execute("DELETE FROM payments WHERE user_id=$1", uid)
-            await c.execute("DELETE FROM subscriptions WHERE user_id=$1", uid)
-            deleted = await c.fetchval(
-                "DELETE FROM users WHERE user_id=$1 RETURNING user_id", uid
-            )
+            async with c.transaction():
+                subs = await c.fetch(
+                    "SELECT DISTINCT panel_id, panel_username FROM subscriptions WHERE user_id=$1",
+                    uid,
+                )
+                await c.execute("DELETE FROM payments WHERE user_id=$1", uid)
+                await c.execute("DELETE FROM subscriptions WHERE user_id=$1", uid)
+                deleted = await c.fetchval(
+                    "DELETE FROM users WHERE user_id=$1 RETURNING user_id", uid
+                )
         finally:
             await c.close()
 
         if not deleted:
             return {"error": "Пользователь не найден"}
 
-        if delete_from_panel and sub and sub["panel_username"]:
-            try:
-                await pg.delete_user(sub["panel_username"])
-            except Exception:
-                pass
+        if delete_from_panel:
+            # С той панели, где живёт пользователь (после переноса — со всех его записей)
+            for sub in subs:
+                if sub["panel_username"]:
+                    try:
+                        await pg.delete_user(sub["panel_username"], sub["panel_id"])
+                    except Exception:
+                        pass
 
         return {"ok": True}
 
@@ -406,21 +379,28 @@ def disable_sub(uid):
     async def _():
         c = await conn()
         try:
-            sub = await c.fetchrow("""
-                SELECT id, panel_username FROM subscriptions
-                WHERE user_id=$1 AND is_active=TRUE ORDER BY id DESC LIMIT 1
-            """, uid)
-            if not sub:
-                return {"error": "Активная подписка не найдена"}
-            await c.execute("UPDATE subscriptions SET is_active=FALSE WHERE id=$1", sub["id"])
+            async with c.transaction():
+                # Срок обрезается до «сейчас» — воркер бота закроет доступ на панели пользователя
+                sub = await c.fetchrow("""
+                    UPDATE subscriptions
+                    SET is_active = FALSE, expires_at = LEAST(expires_at, NOW())
+                    WHERE id = (
+                        SELECT id FROM subscriptions
+                        WHERE user_id=$1 AND is_active=TRUE ORDER BY id DESC LIMIT 1
+                    )
+                    RETURNING id, panel_id, panel_username
+                """, uid)
+                if not sub:
+                    return {"error": "Активная подписка не найдена"}
+                await enqueue_panel_sync(c, sub["id"], sub["panel_username"])
         finally:
             await c.close()
 
         if delete_from_panel:
             try:
-                await pg.delete_user(sub["panel_username"])
+                await pg.delete_user(sub["panel_username"], sub["panel_id"])
             except Exception:
-                pass
+                pass  # доступ всё равно закроет воркер бота по panel_outbox
 
         return {"ok": True}
 
@@ -18,6 +18,10 @@ CHANNEL_LINK: str = config("CHANNEL_LINK", default="t.me/boompi_ai")
 WEBHOOK_HOST: str = config("WEBHOOK_HOST")
 WEBHOOK_PATH: str = config("WEBHOOK_PATH", default="/webhook/bot")
 YUKASSA_WEBHOOK_PATH: str = config("YUKASSA_WEBHOOK_PATH", default="/webhook/yukassa")
+# Уведомления PasarGuard: в панели WEBHOOK_ADDRESS = {WEBHOOK_HOST}{PATH}/{panel_id},
+# WEBHOOK_SECRET = PASARGUARD_WEBHOOK_SECRET. Пустой секрет — маршрут не регистрируется.
+PASARGUARD_WEBHOOK_PATH: str = config("PASARGUARD_WEBHOOK_PATH", default="/webhook/pasarguard")
+PASARGUARD_WEBHOOK_SECRET: str = config("PASARGUARD_WEBHOOK_SECRET", default="")
 
 WEBHOOK_URL: str = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
 
@@ -36,6 +40,11 @@ REDIS_URL: str = config("REDIS_URL", default="redis://redis:6379/0")
 
 YUKASSA_SHOP_ID: str = config("YUKASSA_SHOP_ID")
 YUKASSA_SECRET_KEY: str = config("YUKASSA_SECRET_KEY")
+YUKASSA_TIMEOUT_SEC: int = config("YUKASSA_TIMEOUT_SEC", cast=int, default=15)
+# Сколько «Проверить оплату» ждёт вебхук, прежде чем один раз спросить API ЮKassa
+PAYMENT_CONFIRM_WAIT_SEC: int = config("PAYMENT_CONFIRM_WAIT_SEC", cast=int, default=10)
+# Сколько повторное «Купить» отдаёт уже созданную ссылку на оплату вместо нового платежа
+PAYLINK_TTL_SEC: int = config("PAYLINK_TTL_SEC", cast=int, default=900)
 
 # ── Тариф ─────────────────────────────────────────────────────────────────────
 
@@ -52,4 +61,125 @@ PASARGUARD_URL: str = config("PASARGUARD_URL")
 PASARGUARD_USERNAME: str = config("PASARGUARD_USERNAME")
 PASARGUARD_PASSWORD: str = config("PASARGUARD_PASSWORD")
 PASARGUARD_INBOUND_TAG: str = config("PASARGUARD_INBOUND_TAG", default="vless-tcp")
-PASARGUARD_FLOW: str = config("PASARGUARD_FLOW", default="xtls-rprx-vision")
\ No newline at end of file
+PASARGUARD_FLOW: str = config("PASARGUARD_FLOW", default="xtls-rprx-vision")
+
+# Несколько панелей (шардирование пользователей). Первая в списке — панель по умолчанию,
+# её доступы — PASARGUARD_URL/USERNAME/PASSWORD выше. Для остальных панелей:
+# PASARGUARD_<ID>_URL, PASARGUARD_<ID>_USERNAME, PASARGUARD_<ID>_PASSWORD.
+PASARGUARD_PANELS: list[str] = config("PASARGUARD_PANELS", cast=Csv(), default="main")
+# Панели, на которые не назначаются новые пользователи (переполнены / выводятся из работы)
+PASARGUARD_DRAINING: list[str] = config("PASARGUARD_DRAINING", cast=Csv(), default="")
+
+PASARGUARD_PANEL_SETTINGS: dict[str, dict[str, str]] = {
+    PASARGUARD_PANELS[0]: {
+        "url": PASARGUARD_URL,
+        "username": PASARGUARD_USERNAME,
+        "password": PASARGUARD_PASSWORD,
+    },
+    **{
+        panel_id: {
+            "url": config(f"PASARGUARD_{panel_id.upper()}_URL"),
+            "username": config(f"PASARGUARD_{panel_id.upper()}_USERNAME"),
+            "password": config(f"PASARGUARD_{panel_id.upper()}_PASSWORD"),
+        }
+        for panel_id in PASARGUARD_PANELS[1:]
+    },
+}
+
+# Группы (наборы нод), между которыми распределяются новые пользователи.
+# least_loaded — группа с наименьшим total_users по данным панели; static — всегда первая.
+PASARGUARD_GROUP_IDS: list[int] = config("PASARGUARD_GROUP_IDS", cast=Csv(int), default="1")
+PLACEMENT_STRATEGY: str = config("PLACEMENT_STRATEGY", default="least_loaded")
+PLACEMENT_CACHE_SEC: int = config("PLACEMENT_CACHE_SEC", cast=int, default=300)
+
+# Сколько живёт снимок пользователя панели в Redis (обновляется вебхуком и воркером)
+PANEL_SNAPSHOT_TTL: int = config("PANEL_SNAPSHOT_TTL", cast=int, default=86400)
+# Воркер panel_outbox строит PUT из снимка вместо GET, только если включён вебхук панели
+# (иначе правки в панели и админке снимок не видит) и снимок не старше этого
+PANEL_SNAPSHOT_TRUST_SEC: int = config("PANEL_SNAPSHOT_TRUST_SEC", cast=int, default=900)
+
+# Синхронизация расхода трафика для меню (интервал, пользователей на страницу)
+USAGE_SYNC_MIN: int = config("USAGE_SYNC_MIN", cast=int, default=15)
+USAGE_PAGE_SIZE: int = config("USAGE_PAGE_SIZE", cast=int, default=500)
+
+# Заполнение пустых subscription_url (одновременных запросов к панели / размер страницы)
+BACKFILL_CONCURRENCY: int = config("BACKFILL_CONCURRENCY", cast=int, default=8)
+BACKFILL_BATCH: int = config("BACKFILL_BATCH", cast=int, default=200)
+
+# ── Прокси ссылок подписки ────────────────────────────────────────────────────
+
+# Пользователи получают ссылку {BASE_URL}{SUB_PROXY_PATH}/{panel_id}/{token}, бот кэширует
+# ответ панели (путь подписок в панели — PASARGUARD_SUB_PATH, как XRAY_SUBSCRIPTION_PATH).
+SUB_PROXY_ENABLED: bool = config("SUB_PROXY_ENABLED", cast=bool, default=False)
+SUB_PROXY_PATH: str = config("SUB_PROXY_PATH", default="/sub")
+PASARGUARD_SUB_PATH: str = config("PASARGUARD_SUB_PATH", default="/sub")
+SUB_CACHE_TTL: int = config("SUB_CACHE_TTL", cast=int, default=3600)
+
+# ── Автопродление ─────────────────────────────────────────────────────────────
+
+RENEW_CONCURRENCY: int = config("RENEW_CONCURRENCY", cast=int, default=4)      # одновременных списаний
+RENEW_RATE_PER_SEC: float = config("RENEW_RATE_PER_SEC", cast=float, default=5)  # новых списаний в секунду
+RENEW_BATCH: int = config("RENEW_BATCH", cast=int, default=50)                 # подписок за один захват
+RENEW_LEASE_SEC: int = config("RENEW_LEASE_SEC", cast=int, default=900)        # аренда подписки репликой
+
+# Досверка зависших pending-платежей (вебхук потерялся, а «Проверить оплату» не нажали)
+PAYMENT_SWEEP_MIN: int = config("PAYMENT_SWEEP_MIN", cast=int, default=5)                # период запуска
+PAYMENT_SWEEP_MIN_AGE_SEC: int = config("PAYMENT_SWEEP_MIN_AGE_SEC", cast=int, default=180)  # не трогать свежие
+PAYMENT_SWEEP_WINDOW_HOURS: int = config("PAYMENT_SWEEP_WINDOW_HOURS", cast=int, default=48)
+PAYMENT_SWEEP_LIMIT: int = config("PAYMENT_SWEEP_LIMIT", cast=int, default=200)          # запросов за прогон
+PAYMENT_SWEEP_CONCURRENCY: int = config("PAYMENT_SWEEP_CONCURRENCY", cast=int, default=4)
+
+# ── Напоминания ───────────────────────────────────────────────────────────────
+
+# Насколько назад досылаются пропущенные напоминания после простоя (журнал не даст дублей)
+NOTIFY_CATCHUP_HOURS: int = config("NOTIFY_CATCHUP_HOURS", cast=int, default=24)
+NOTIFY_BATCH: int = config("NOTIFY_BATCH", cast=int, default=200)
+
+# ── HTTP-сессия Bot API (services/tg_session.py) ─────────────────────────────
+
+# Пусто — api.telegram.org; иначе свой Bot API сервер (напр. заглушка для нагрузочных тестов)
+TG_API_BASE_URL: str = config("TG_API_BASE_URL", default="")
+TG_API_CONN_LIMIT: int = config("TG_API_CONN_LIMIT", cast=int, default=100)
+TG_API_KEEPALIVE_SEC: float = config("TG_API_KEEPALIVE_SEC", cast=float, default=60)
+TG_API_TIMEOUT_SEC: float = config("TG_API_TIMEOUT_SEC", cast=float, default=30)
+
+# ── Лимиты отправки в Telegram (services/tg_sender.py) ───────────────────────
+
+# Лимит Telegram ~30 сообщений/с на бота — общий на все реплики (bucket в Redis)
+TG_GLOBAL_RATE: float = config("TG_GLOBAL_RATE", cast=float, default=25)
+TG_CHAT_INTERVAL_SEC: float = config("TG_CHAT_INTERVAL_SEC", cast=float, default=1.0)    # личный чат
+TG_GROUP_INTERVAL_SEC: float = config("TG_GROUP_INTERVAL_SEC", cast=float, default=3.0)  # группы/каналы
+
+# ── Рассылки (services/broadcasts.py) ────────────────────────────────────────
+
+BROADCAST_PAGE: int = config("BROADCAST_PAGE", cast=int, default=200)                  # получателей на контрольную точку
+BROADCAST_CONCURRENCY: int = config("BROADCAST_CONCURRENCY", cast=int, default=8)      # темп задаёт TG_GLOBAL_RATE
+BROADCAST_LEASE_SEC: int = config("BROADCAST_LEASE_SEC", cast=int, default=300)
+BROADCAST_POLL_SEC: int = config("BROADCAST_POLL_SEC", cast=int, default=15)
+BROADCAST_PROGRESS_SEC: int = config("BROADCAST_PROGRESS_SEC", cast=int, default=5)    # как часто обновлять прогресс
+
+# ── История фоновых задач (job_runs) ─────────────────────────────────────────
+
+# Доля интервала, после которой запуск считается «почти перерасходом»
+JOB_OVERRUN_RATIO: float = config("JOB_OVERRUN_RATIO", cast=float, default=0.8)
+
+# ── Сверка DB ↔ PasarGuard ────────────────────────────────────────────────────
+
+RECONCILE_HOUR: int = config("RECONCILE_HOUR", cast=int, default=3)            # час запуска (UTC)
+RECONCILE_FIX: bool = config("RECONCILE_FIX", cast=bool, default=False)        # исправлять найденное
+RECONCILE_PAGE_SIZE: int = config("RECONCILE_PAGE_SIZE", cast=int, default=500)
+RECONCILE_TOLERANCE_SEC: int = config("RECONCILE_TOLERANCE_SEC", cast=int, default=3600)
+
+# ── Очередь синхронизации с PasarGuard (panel_outbox) ────────────────────────
+
+OUTBOX_BATCH: int = config("OUTBOX_BATCH", cast=int, default=50)
+OUTBOX_CONCURRENCY: int = config("OUTBOX_CONCURRENCY", cast=int, default=4)
+OUTBOX_POLL_SEC: int = config("OUTBOX_POLL_SEC", cast=int, default=10)          # страховочный опрос
+OUTBOX_MAX_ATTEMPTS: int = config("OUTBOX_MAX_ATTEMPTS", cast=int, default=20)  # потом — status=dead
+
+# ── Уведомления ЮKassa (yukassa_events) ──────────────────────────────────────
+
+YK_EVENTS_CONCURRENCY: int = config("YK_EVENTS_CONCURRENCY", cast=int, default=4)
+YK_EVENTS_POLL_SEC: int = config("YK_EVENTS_POLL_SEC", cast=int, default=10)          # страховочный опрос
+YK_EVENTS_MAX_ATTEMPTS: int = config("YK_EVENTS_MAX_ATTEMPTS", cast=int, default=20)  # потом — status=dead
+YK_EVENTS_DEDUPE_SEC: int = config("YK_EVENTS_DEDUPE_SEC", cast=int, default=86400)   # ключ дедупликации в Redis
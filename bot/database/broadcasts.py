@@ -0,0 +1,216 @@
+"""
+database/broadcasts.py — задачи рассылки (broadcast_jobs).
+
+Рассылку выполняет воркер services/broadcasts.py, а не хендлер, который её создал.
+Получатели не копируются в отдельную таблицу — воркер читает аудиторию страницами
+по возрастанию user_id (keyset), а в задаче хранится контрольная точка last_user_id
+и счётчики sent/failed. После рестарта рассылка продолжается с контрольной точки;
+повторно может уйти не больше одной страницы.
+
+Статусы: pending → running → done; paused / cancelled — по команде администратора.
+Аренда (locked_until) — как в panel_outbox: задачу ведёт одна реплика, после падения
+её подхватит другая. Каждый захват выдаёт новый claim_token; продление аренды,
+контрольная точка и завершение проходят только с текущим токеном — реплика,
+у которой аренду перехватили, больше ничего не запишет.
+"""
+
+import uuid
+from datetime import timedelta
+
+from bot.database.manager import get_pool
+
+BROADCASTS_CHANNEL = "broadcast_jobs"
+
+# Аудитории рассылки: запрос возвращает колонку user_id.
+# Те же аудитории (и счётчики для предпросмотра) — в admin/routes/broadcast.py
+_AUDIENCES = {
+    "all": """
+        SELECT user_id FROM users WHERE NOT is_banned
+    """,
+    "active": """
+        SELECT DISTINCT u.user_id FROM users u
+        JOIN subscriptions s ON s.user_id = u.user_id
+        WHERE NOT u.is_banned AND s.is_active AND s.expires_at > NOW()
+    """,
+    "expiring": """
+        SELECT DISTINCT u.user_id FROM users u
+        JOIN subscriptions s ON s.user_id = u.user_id
+        WHERE NOT u.is_banned AND s.is_active
+          AND s.expires_at BETWEEN NOW() AND NOW() + INTERVAL '3 days'
+    """,
+    "expired": """
+        SELECT DISTINCT u.user_id FROM users u
+        JOIN subscriptions s ON s.user_id = u.user_id
+        WHERE NOT u.is_banned
+          AND (NOT s.is_active OR s.expires_at <= NOW())
+          AND NOT EXISTS (
+              SELECT 1 FROM subscriptions s2
+              WHERE s2.user_id = u.user_id AND s2.is_active AND s2.expires_at > NOW()
+          )
+    """,
+    "no_sub": """
+        SELECT u.user_id FROM users u
+        WHERE NOT u.is_banned
+          AND NOT EXISTS (SELECT 1 FROM subscriptions s WHERE s.user_id = u.user_id)
+    """,
+    "no_payment": """
+        SELECT u.user_id FROM users u
+        WHERE NOT u.is_banned
+          AND NOT EXISTS (
+              SELECT 1 FROM payments p WHERE p.user_id = u.user_id AND p.status = 'succeeded'
+          )
+    """,
+    "paid_once": """
+        SELECT u.user_id FROM users u
+        WHERE NOT u.is_banned
+          AND (
+              SELECT COUNT(*) FROM payments p
+              WHERE p.user_id = u.user_id AND p.status = 'succeeded'
+          ) = 1
+    """,
+}
+
+# Из каких статусов допустима команда администратора и во что она переводит задачу
+_TRANSITIONS = {
+    "pause":  (("pending", "running"), "paused"),
+    "resume": (("paused",), "pending"),
+    "cancel": (("pending", "running", "paused"), "cancelled"),
+}
+
+
+def is_known_audience(audience: str) -> bool:
+    return audience in _AUDIENCES
+
+
+async def create_broadcast(
+    text: str,
+    audience: str = "all",
+    created_by: int | None = None,
+    chat_id: int | None = None,
+    message_id: int | None = None,
+) -> dict:
+    """Создаёт задачу рассылки и будит воркер. chat_id/message_id — сообщение с прогрессом."""
+    async with get_pool().acquire() as conn:
+        async with conn.transaction():
+            total = await conn.fetchval(f"SELECT COUNT(*) FROM ({_AUDIENCES[audience]}) t")
+            row = await conn.fetchrow("""
+                INSERT INTO broadcast_jobs (text, audience, total, created_by, chat_id, message_id)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                RETURNING *
+            """, text, audience, total, created_by, chat_id, message_id)
+            await conn.execute("SELECT pg_notify($1, '')", BROADCASTS_CHANNEL)
+    return dict(row)
+
+
+async def get_broadcast(job_id: int) -> dict | None:
+    async with get_pool().acquire() as conn:
+        row = await conn.fetchrow("SELECT * FROM broadcast_jobs WHERE id = $1", job_id)
+    return dict(row) if row else None
+
+
+async def claim_broadcast(lease_sec: int) -> dict | None:
+    """
+    Берёт самую старую незавершённую рассылку, которую сейчас никто не ведёт.
+    В возвращённой задаче — claim_token для всех последующих записей.
+    """
+    async with get_pool().acquire() as conn:
+        row = await conn.fetchrow("""
+            UPDATE broadcast_jobs
+            SET status       = 'running',
+                started_at   = COALESCE(started_at, NOW()),
+                locked_until = NOW() + $1,
+                claim_token  = $2
+            WHERE id = (
+                SELECT id FROM broadcast_jobs
+                WHERE status IN ('pending', 'running')
+                  AND (locked_until IS NULL OR locked_until < NOW())
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        """, timedelta(seconds=lease_sec), uuid.uuid4().hex)
+    return dict(row) if row else None
+
+
+async def renew_broadcast_lease(job_id: int, token: str, lease_sec: int) -> str | None:
+    """
+    Продлевает аренду, пока рассылка идёт. Возвращает текущий статус
+    или None, если аренду уже перехватила другая реплика.
+    """
+    async with get_pool().acquire() as conn:
+        return await conn.fetchval("""
+            UPDATE broadcast_jobs
+            SET locked_until = CASE WHEN status = 'running' THEN NOW() + $3 ELSE locked_until END
+            WHERE id = $1 AND claim_token = $2
+            RETURNING status
+        """, job_id, token, timedelta(seconds=lease_sec))
+
+
+async def get_broadcast_recipients(audience: str, after_user_id: int, limit: int) -> list[int]:
+    """Следующая страница получателей после контрольной точки."""
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch(f"""
+            SELECT user_id FROM ({_AUDIENCES[audience]}) t
+            WHERE user_id > $1
+            ORDER BY user_id
+            LIMIT $2
+        """, after_user_id, limit)
+    return [r["user_id"] for r in rows]
+
+
+async def save_broadcast_progress(
+    job_id: int, token: str, last_user_id: int, sent: int, failed: int, lease_sec: int
+) -> str | None:
+    """
+    Сохраняет контрольную точку (счётчики — приращения за страницу) и продлевает аренду.
+    Возвращает текущий статус — так воркер узнаёт о паузе или отмене;
+    None — аренду перехватили, контрольная точка не записана.
+    """
+    async with get_pool().acquire() as conn:
+        return await conn.fetchval("""
+            UPDATE broadcast_jobs
+            SET last_user_id = $3,
+                sent         = sent + $4,
+                failed       = failed + $5,
+                locked_until = CASE WHEN status = 'running' THEN NOW() + $6 END
+            WHERE id = $1 AND claim_token = $2
+            RETURNING status
+        """, job_id, token, last_user_id, sent, failed, timedelta(seconds=lease_sec))
+
+
+async def finish_broadcast(job_id: int, token: str) -> dict | None:
+    """
+    Помечает рассылку завершённой (если её не отменили и не поставили на паузу)
+    и снимает аренду. None — аренду перехватили.
+    """
+    async with get_pool().acquire() as conn:
+        row = await conn.fetchrow("""
+            UPDATE broadcast_jobs
+            SET status      = CASE WHEN status = 'running' THEN 'done' ELSE status END,
+                finished_at = CASE WHEN status = 'running' THEN NOW() ELSE finished_at END,
+                locked_until = NULL
+            WHERE id = $1 AND claim_token = $2
+            RETURNING *
+        """, job_id, token)
+    return dict(row) if row else None
+
+
+async def control_broadcast(job_id: int, action: str) -> dict | None:
+    """
+    pause / resume / cancel. Возвращает обновлённую задачу или None, если
+    из текущего статуса команда недопустима. resume будит воркер.
+    """
+    allowed, target = _TRANSITIONS[action]
+    async with get_pool().acquire() as conn:
+        async with conn.transaction():
+            row = await conn.fetchrow("""
+                UPDATE broadcast_jobs
+                SET status      = $2,
+                    finished_at = CASE WHEN $2 = 'cancelled' THEN NOW() ELSE finished_at END
+                WHERE id = $1 AND status = ANY($3::text[])
+                RETURNING *
+            """, job_id, target, list(allowed))
+            if row is not None and target == "pending":
+                await conn.execute("SELECT pg_notify($1, '')", BROADCASTS_CHANNEL)
+    return dict(row) if row else None
@@ -1,3 +1,4 @@
+from bot.config import PASARGUARD_PANELS
 from bot.database.manager import get_pool
 
 
@@ -39,6 +40,210 @@ async def create_tables() -> None:
             ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS subscription_url TEXT
         """)
 
+        # Частичный индекс для backfill ссылок подписки — маленький, т.к. таких строк мало.
+        # Только активные: у неактивных пользователь в панели может быть уже удалён.
+        await conn.execute("DROP INDEX IF EXISTS idx_subscriptions_no_url")
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_subscriptions_active_no_url
+                ON subscriptions (id)
+                WHERE is_active AND (subscription_url IS NULL OR subscription_url = '')
+        """)
+
+        # Панель PasarGuard, на которой живёт пользователь (см. services/pasarguard.py).
+        # Старые записи и записи из админки — на панели по умолчанию (первой в PASARGUARD_PANELS).
+        # id панели проверяется в PanelRegistry ([a-z0-9_]), поэтому безопасно подставлять в DDL.
+        default_panel = PASARGUARD_PANELS[0]
+        await conn.execute("""
+            ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS panel_id TEXT
+        """)
+        await conn.execute(
+            f"ALTER TABLE subscriptions ALTER COLUMN panel_id SET DEFAULT '{default_panel}'"
+        )
+        await conn.execute(
+            "UPDATE subscriptions SET panel_id = $1 WHERE panel_id IS NULL", default_panel
+        )
+        await conn.execute("""
+            ALTER TABLE subscriptions ALTER COLUMN panel_id SET NOT NULL
+        """)
+
+        # Индекс для потоковой сверки с панелью (keyset по panel_username внутри панели)
+        await conn.execute("""
+            DROP INDEX IF EXISTS idx_subscriptions_panel_username
+        """)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_subscriptions_panel_user
+                ON subscriptions (panel_id, panel_username COLLATE "C", id DESC)
+        """)
+
+        # Выборки напоминаний и автопродления идут по диапазону expires_at
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_subscriptions_expires_at
+                ON subscriptions (expires_at)
+        """)
+
+        # Журнал отправленных напоминаний (см. database/notifications.py)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS notifications_sent (
+                subscription_id INT       NOT NULL,
+                kind            TEXT      NOT NULL,
+                period          TIMESTAMP NOT NULL,
+                sent_at         TIMESTAMP NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (subscription_id, kind, period)
+            )
+        """)
+
+        # Аренда подписки репликой на время автосписания (см. claim_expiring_subscriptions)
+        await conn.execute("""
+            ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS renew_locked_until TIMESTAMP
+        """)
+
+        # Очередь синхронизации подписок с PasarGuard (см. database/outbox.py)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS panel_outbox (
+                id              BIGSERIAL PRIMARY KEY,
+                subscription_id INT       NOT NULL,
+                panel_username  TEXT      NOT NULL,
+                status          TEXT      NOT NULL DEFAULT 'pending',
+                version         INT       NOT NULL DEFAULT 0,
+                attempts        INT       NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                locked_until    TIMESTAMP,
+                last_error      TEXT,
+                created_at      TIMESTAMP NOT NULL DEFAULT NOW(),
+                done_at         TIMESTAMP
+            )
+        """)
+        # Не больше одной ожидающей задачи на подписку — новые изменения схлопываются
+        await conn.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_panel_outbox_pending
+                ON panel_outbox (subscription_id) WHERE status = 'pending'
+        """)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_panel_outbox_due
+                ON panel_outbox (next_attempt_at) WHERE status = 'pending'
+        """)
+
+        # Входящие уведомления ЮKassa (см. database/yukassa_events.py)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS yukassa_events (
+                id              BIGSERIAL PRIMARY KEY,
+                payment_id      TEXT      NOT NULL,
+                event_type      TEXT      NOT NULL,
+                payload         JSONB     NOT NULL,
+                status          TEXT      NOT NULL DEFAULT 'pending',
+                attempts        INT       NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                locked_until    TIMESTAMP,
+                last_error      TEXT,
+                created_at      TIMESTAMP NOT NULL DEFAULT NOW(),
+                done_at         TIMESTAMP,
+                UNIQUE (payment_id, event_type)
+            )
+        """)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_yukassa_events_due
+                ON yukassa_events (next_attempt_at) WHERE status = 'pending'
+        """)
+
+        # Рассылки и их контрольные точки (см. database/broadcasts.py)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                id           SERIAL    PRIMARY KEY,
+                text         TEXT      NOT NULL,
+                audience     TEXT      NOT NULL DEFAULT 'all',
+                status       TEXT      NOT NULL DEFAULT 'pending',
+                total        INT,
+                sent         INT       NOT NULL DEFAULT 0,
+                failed       INT       NOT NULL DEFAULT 0,
+                last_user_id BIGINT    NOT NULL DEFAULT 0,
+                created_by   BIGINT,
+                chat_id      BIGINT,
+                message_id   BIGINT,
+                locked_until TIMESTAMP,
+                claim_token  TEXT,
+                created_at   TIMESTAMP NOT NULL DEFAULT NOW(),
+                started_at   TIMESTAMP,
+                finished_at  TIMESTAMP
+            )
+        """)
+        await conn.execute("""
+            ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS claim_token TEXT
+        """)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_active
+                ON broadcast_jobs (id) WHERE status IN ('pending', 'running')
+        """)
+
+        # История запусков фоновых задач (см. database/job_runs.py)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_runs (
+                id           BIGSERIAL PRIMARY KEY,
+                job_id       TEXT      NOT NULL,
+                interval_sec INT       NOT NULL,
+                status       TEXT      NOT NULL,
+                started_at   TIMESTAMP NOT NULL,
+                finished_at  TIMESTAMP,
+                items        INT       NOT NULL DEFAULT 0,
+                failures     INT       NOT NULL DEFAULT 0,
+                p50_ms       REAL,
+                p95_ms       REAL,
+                error        TEXT
+            )
+        """)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_job_runs_job_started
+                ON job_runs (job_id, started_at DESC)
+        """)
+        # Запуски с длительностью и сводка по задачам — общие для бота и Flask-админки
+        await conn.execute("""
+            CREATE OR REPLACE VIEW job_run_history AS
+            SELECT *,
+                   EXTRACT(EPOCH FROM COALESCE(finished_at, NOW()) - started_at) AS duration_sec
+            FROM job_runs
+        """)
+        # Последний (не пропущенный) запуск каждой задачи за 7 дней, максимальная длительность
+        # за 10 запусков, её доля от интервала (interval_load) и число пропусков за сутки
+        await conn.execute("""
+            CREATE OR REPLACE VIEW job_overview AS
+            WITH recent AS (
+                SELECT *,
+                       ROW_NUMBER() OVER (PARTITION BY job_id ORDER BY started_at DESC) AS rn
+                FROM job_run_history
+                WHERE status <> 'skipped'
+                  AND started_at > NOW() - INTERVAL '7 days'
+            ),
+            worst AS (
+                SELECT job_id, MAX(duration_sec) AS max_duration_sec
+                FROM recent
+                WHERE rn <= 10
+                GROUP BY job_id
+            )
+            SELECT r.job_id, r.status, r.started_at, r.finished_at, r.items, r.failures,
+                   r.p50_ms, r.p95_ms, r.interval_sec, r.duration_sec, r.error,
+                   w.max_duration_sec,
+                   w.max_duration_sec / NULLIF(r.interval_sec, 0) AS interval_load,
+                   (SELECT COUNT(*) FROM job_runs s
+                     WHERE s.job_id = r.job_id AND s.status = 'skipped'
+                       AND s.started_at > NOW() - INTERVAL '24 hours') AS skipped_24h
+            FROM recent r
+            JOIN worst w ON w.job_id = r.job_id
+            WHERE r.rn = 1
+        """)
+
+        # Расход трафика из PasarGuard (см. database/usage.py) — для показа в меню
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage_snapshots (
+                panel_id       TEXT      NOT NULL,
+                panel_username TEXT      NOT NULL,
+                used_traffic   BIGINT    NOT NULL DEFAULT 0,
+                data_limit     BIGINT,
+                online_at      TIMESTAMP,
+                status         TEXT,
+                synced_at      TIMESTAMP NOT NULL,
+                PRIMARY KEY (panel_id, panel_username)
+            )
+        """)
+
         await conn.execute("""
             CREATE TABLE IF NOT EXISTS payments (
                 id                  SERIAL    PRIMARY KEY,
@@ -57,6 +262,19 @@ async def create_tables() -> None:
                 ADD COLUMN IF NOT EXISTS is_pending_check BOOLEAN NOT NULL DEFAULT FALSE
         """)
 
+        # Отметка выдачи подписки по платежу (см. services/payment.py). Ставится в одной
+        # транзакции с продлением. Для старых succeeded-платежей подписка уже выдана —
+        # отмечаем их один раз, при добавлении колонки.
+        has_granted_at = await conn.fetchval("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'payments' AND column_name = 'granted_at'
+        """)
+        if not has_granted_at:
+            await conn.execute("ALTER TABLE payments ADD COLUMN granted_at TIMESTAMP")
+            await conn.execute(
+                "UPDATE payments SET granted_at = created_at WHERE status = 'succeeded'"
+            )
+
         await conn.execute("""
 
         CREATE TABLE IF NOT EXISTS referrals (
@@ -0,0 +1,62 @@
+"""
+database/job_runs.py — история запусков фоновых задач (job_runs).
+
+Пишет services/job_runs.py: одна строка на запуск задачи планировщика —
+время, обработано/ошибок, p50/p95 на элемент. Пропуски (предыдущий запуск ещё
+идёт или запуск опоздал) записываются со status='skipped'.
+"""
+
+from bot.database.manager import get_pool
+
+
+async def start_job_run(job_id: str, interval_sec: int) -> int:
+    async with get_pool().acquire() as conn:
+        return await conn.fetchval("""
+            INSERT INTO job_runs (job_id, interval_sec, status, started_at)
+            VALUES ($1, $2, 'running', NOW())
+            RETURNING id
+        """, job_id, interval_sec)
+
+
+async def finish_job_run(
+    run_id: int,
+    status: str,
+    items: int,
+    failures: int,
+    p50_ms: float | None,
+    p95_ms: float | None,
+    error: str | None = None,
+) -> None:
+    async with get_pool().acquire() as conn:
+        await conn.execute("""
+            UPDATE job_runs
+            SET status = $2, finished_at = NOW(), items = $3, failures = $4,
+                p50_ms = $5, p95_ms = $6, error = $7
+            WHERE id = $1
+        """, run_id, status, items, failures, p50_ms, p95_ms, error)
+
+
+async def record_skipped_run(job_id: str, interval_sec: int, reason: str) -> None:
+    async with get_pool().acquire() as conn:
+        await conn.execute("""
+            INSERT INTO job_runs (job_id, interval_sec, status, started_at, finished_at, error)
+            VALUES ($1, $2, 'skipped', NOW(), NOW(), $3)
+        """, job_id, interval_sec, reason)
+
+
+async def get_job_overview() -> list[dict]:
+    """Сводка по задачам из представления job_overview (см. init_db.py)."""
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch("SELECT * FROM job_overview ORDER BY job_id")
+    return [dict(r) for r in rows]
+
+
+async def get_recent_job_runs(limit: int = 50, job_id: str | None = None) -> list[dict]:
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT * FROM job_run_history
+            WHERE ($2::text IS NULL OR job_id = $2)
+            ORDER BY started_at DESC
+            LIMIT $1
+        """, limit, job_id)
+    return [dict(r) for r in rows]
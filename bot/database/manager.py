@@ -19,6 +19,14 @@ async def close_pool() -> None:
         pool = None
 
 
+async def connect_listener() -> asyncpg.Connection:
+    """
+    Отдельное соединение под LISTEN (вне пула): воркер держит его всё время работы,
+    и из пула оно бы навсегда забирало место у хендлеров и планировщика.
+    """
+    return await asyncpg.connect(dsn=PG_DSN)
+
+
 def get_pool() -> asyncpg.Pool:
     """Возвращает пул, гарантируя что он инициализирован."""
     if pool is None:
@@ -0,0 +1,71 @@
+"""
+database/notifications.py — журнал отправленных напоминаний (notifications_sent).
+
+Одна запись на (подписка, вид напоминания, период). Период — expires_at подписки
+на момент отправки: после продления у подписки новый период, и напоминания о нём
+отправятся снова, а повторно об одном и том же сроке — никогда.
+
+Поэтому окна выборки можно делать широкими (с запасом на простой бота): что уже
+отправлено, отсекает журнал, а не «ровно одно попадание в часовое окно».
+"""
+
+from datetime import datetime
+
+from bot.database.manager import get_pool
+
+# Вид напоминания → дополнительное условие на подписку
+_KIND_FILTERS = {
+    "expiring": "s.is_active = TRUE AND (s.auto_renew = FALSE OR s.yukassa_payment_method_id IS NULL)",
+    "expired": "TRUE",
+    "week_1": "s.is_active = FALSE",
+    "week_2": "s.is_active = FALSE",
+}
+
+
+async def claim_due_notifications(
+    kind: str,
+    window_start: datetime,
+    window_end: datetime,
+    limit: int,
+    subscription_id: int | None = None,
+) -> list[dict]:
+    """
+    Забирает до limit подписок с expires_at в (window_start, window_end], которым
+    напоминание kind за текущий период ещё не отправлялось, и записывает их в журнал.
+    Вызывать в цикле до пустого результата — записанные в следующую пачку не попадут.
+
+    Запись делается до отправки: напоминание лучше потерять при падении,
+    чем прислать дважды. subscription_id — проверить только эту подписку (событие таймера).
+    """
+    condition = _KIND_FILTERS[kind]
+    async with get_pool().acquire() as conn:
+        async with conn.transaction():
+            rows = await conn.fetch(f"""
+                SELECT s.id, s.user_id, s.expires_at
+                FROM subscriptions s
+                WHERE s.expires_at > $1
+                  AND s.expires_at <= $2
+                  AND {condition}
+                  AND ($5::int IS NULL OR s.id = $5)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM notifications_sent n
+                      WHERE n.subscription_id = s.id
+                        AND n.kind = $3
+                        AND n.period = s.expires_at
+                  )
+                ORDER BY s.expires_at
+                LIMIT $4
+                FOR UPDATE OF s SKIP LOCKED
+            """, window_start, window_end, kind, limit, subscription_id)
+            if not rows:
+                return []
+
+            claimed = await conn.fetch("""
+                INSERT INTO notifications_sent (subscription_id, kind, period)
+                SELECT id, $2::text, period FROM unnest($1::int[], $3::timestamp[]) AS t(id, period)
+                ON CONFLICT DO NOTHING
+                RETURNING subscription_id
+            """, [r["id"] for r in rows], kind, [r["expires_at"] for r in rows])
+
+    claimed_ids = {r["subscription_id"] for r in claimed}
+    return [dict(r) for r in rows if r["id"] in claimed_ids]
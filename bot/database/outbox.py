@@ -0,0 +1,115 @@
+"""
+database/outbox.py — очередь синхронизации подписок с PasarGuard (panel_outbox).
+
+Каждое изменение срока подписки в БД ставит сюда задачу в той же транзакции.
+Задача не хранит «на сколько продлить» — воркер читает актуальное состояние
+подписки из БД и выставляет его в панели. Поэтому повторное выполнение
+безопасно (идемпотентно), а несколько изменений подряд схлопываются в одну задачу.
+
+Конкурентность:
+  • locked_until — аренда задачи воркером; пока она не истекла, задачу никто не берёт;
+  • version — растёт при каждом новом изменении подписки. Если подписка поменялась,
+    пока воркер работал, задача не закрывается, а сразу ставится на повтор
+    (воркер мог прочитать и отправить в панель уже устаревшее состояние).
+"""
+
+from datetime import timedelta
+
+import asyncpg
+
+from bot.database.manager import get_pool
+
+OUTBOX_CHANNEL = "panel_outbox"
+
+
+async def enqueue_panel_sync(
+    conn: asyncpg.Connection,
+    subscription_id: int,
+    panel_username: str,
+) -> None:
+    """
+    Ставит подписку в очередь синхронизации с панелью.
+    Вызывается внутри транзакции, которая меняет подписку, — поэтому conn передаётся явно.
+    Если задача для подписки уже ждёт — просто делаем её срочной (без дубля).
+    """
+    await conn.execute("""
+        INSERT INTO panel_outbox (subscription_id, panel_username)
+        VALUES ($1, $2)
+        ON CONFLICT (subscription_id) WHERE status = 'pending'
+        DO UPDATE SET version         = panel_outbox.version + 1,
+                      next_attempt_at = NOW(),
+                      attempts        = 0
+    """, subscription_id, panel_username)
+    # Доставляется слушателям только после COMMIT
+    await conn.execute("SELECT pg_notify($1, '')", OUTBOX_CHANNEL)
+
+
+async def request_panel_sync(subscription_id: int, panel_username: str) -> None:
+    """Ставит синхронизацию вне транзакции изменения подписки (напр. панель сообщила о расхождении)."""
+    async with get_pool().acquire() as conn:
+        await enqueue_panel_sync(conn, subscription_id, panel_username)
+
+
+async def claim_panel_ops(limit: int, lease_sec: int) -> list[dict]:
+    """
+    Забирает до limit готовых к выполнению задач и арендует их на lease_sec.
+    Если процесс упадёт посреди обработки, задача снова станет доступной
+    после истечения аренды.
+    """
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch("""
+            UPDATE panel_outbox
+            SET locked_until = NOW() + $2,
+                attempts     = attempts + 1
+            WHERE id IN (
+                SELECT id FROM panel_outbox
+                WHERE status = 'pending'
+                  AND next_attempt_at <= NOW()
+                  AND (locked_until IS NULL OR locked_until < NOW())
+                ORDER BY next_attempt_at
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        """, limit, timedelta(seconds=lease_sec))
+    return [dict(r) for r in rows]
+
+
+async def complete_panel_op(op_id: int, version: int) -> bool:
+    """
+    Закрывает задачу, если подписка не менялась с момента её захвата.
+    Иначе снимает аренду, чтобы задача сразу выполнилась ещё раз. Возвращает True если закрыта.
+    """
+    async with get_pool().acquire() as conn:
+        result = await conn.execute("""
+            UPDATE panel_outbox
+            SET status = 'done', done_at = NOW(), locked_until = NULL, last_error = NULL
+            WHERE id = $1 AND version = $2
+        """, op_id, version)
+        if result == "UPDATE 1":
+            return True
+        await conn.execute("UPDATE panel_outbox SET locked_until = NULL WHERE id = $1", op_id)
+    return False
+
+
+async def fail_panel_op(op_id: int, error: str, retry_in_sec: int | None) -> None:
+    """Откладывает задачу на retry_in_sec секунд или (retry_in_sec=None) помечает как dead."""
+    async with get_pool().acquire() as conn:
+        if retry_in_sec is None:
+            await conn.execute(
+                "UPDATE panel_outbox SET status = 'dead', locked_until = NULL, last_error = $2 WHERE id = $1",
+                op_id, error,
+            )
+        else:
+            await conn.execute("""
+                UPDATE panel_outbox
+                SET next_attempt_at = NOW() + $2,
+                    locked_until    = NULL,
+                    last_error      = $3
+                WHERE id = $1
+            """, op_id, timedelta(seconds=retry_in_sec), error)
+
+
+async def count_pending_panel_ops() -> int:
+    async with get_pool().acquire() as conn:
+        return await conn.fetchval("SELECT COUNT(*) FROM panel_outbox WHERE status = 'pending'")
@@ -1,8 +1,15 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+
+import asyncpg
+
 from bot.database.manager import get_pool
 from bot.config import PLAN_PRICE
 
 
+class PaymentAlreadyGranted(Exception):
+    """По платежу подписка уже выдана — транзакция выдачи откатывается."""
+
+
 async def create_payment(
     user_id: int,
     yukassa_payment_id: str,
@@ -39,16 +46,32 @@ async def update_payment_status(yukassa_payment_id: str, status: str) -> None:
         )
 
 
-async def link_payment_to_subscription(
-    yukassa_payment_id: str,
-    subscription_id: int,
-) -> None:
-    """Привязывает платёж к подписке."""
+async def get_ungranted_payment(yukassa_payment_id: str) -> dict | None:
+    """Платёж, по которому подписка ещё не выдана (None — выдана или платёж не найден)."""
     async with get_pool().acquire() as conn:
-        await conn.execute(
-            "UPDATE payments SET subscription_id = $1 WHERE yukassa_payment_id = $2",
-            subscription_id, yukassa_payment_id,
-        )
+        row = await conn.fetchrow("""
+            SELECT * FROM payments
+            WHERE yukassa_payment_id = $1 AND granted_at IS NULL
+        """, yukassa_payment_id)
+    return dict(row) if row else None
+
+
+async def mark_payment_granted(
+    conn: asyncpg.Connection, yukassa_payment_id: str, subscription_id: int
+) -> None:
+    """
+    Отмечает выдачу подписки по платежу и привязывает его к подписке.
+    Вызывается внутри транзакции, которая продлевает подписку, — поэтому conn передаётся явно:
+    продление и отметка фиксируются вместе или не фиксируются вовсе. Если платёж уже
+    выдан (другим обработчиком или репликой), бросает PaymentAlreadyGranted.
+    """
+    result = await conn.execute("""
+        UPDATE payments
+        SET status = 'succeeded', granted_at = NOW(), subscription_id = $2
+        WHERE yukassa_payment_id = $1 AND granted_at IS NULL
+    """, yukassa_payment_id, subscription_id)
+    if result != "UPDATE 1":
+        raise PaymentAlreadyGranted(yukassa_payment_id)
 
 
 async def get_user_payments(user_id: int) -> list[dict]:
@@ -61,6 +84,40 @@ async def get_user_payments(user_id: int) -> list[dict]:
     return [dict(r) for r in rows]
 
 
+async def get_pending_subscription_payment(subscription_id: int) -> str | None:
+    """
+    yukassa_payment_id незавершённого платежа по подписке (напр. автосписание СБП,
+    которое банк ещё подтверждает). Пока он есть, новое списание не делаем.
+    """
+    async with get_pool().acquire() as conn:
+        return await conn.fetchval("""
+            SELECT yukassa_payment_id FROM payments
+            WHERE subscription_id = $1 AND status = 'pending'
+            ORDER BY created_at DESC
+            LIMIT 1
+        """, subscription_id)
+
+
+async def get_unsettled_payments(
+    older_than: timedelta, newer_than: timedelta, limit: int
+) -> list[str]:
+    """
+    yukassa_payment_id платежей, которые дольше older_than висят в pending или
+    уже succeeded, но без выданной подписки (обработчик упал посреди выдачи).
+    Берутся только созданные не раньше newer_than назад (старше — ЮKassa их уже отменила).
+    """
+    now = datetime.utcnow()
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT yukassa_payment_id FROM payments
+            WHERE (status = 'pending' OR (status = 'succeeded' AND granted_at IS NULL))
+              AND created_at BETWEEN $1 AND $2
+            ORDER BY created_at
+            LIMIT $3
+        """, now - newer_than, now - older_than, limit)
+    return [r["yukassa_payment_id"] for r in rows]
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # ДОБАВИТЬ в конец bot/database/payments.py
 # ──────────────────────────────────────────────────────────────────────────────
@@ -1,6 +1,11 @@
 from datetime import datetime, timedelta
+from typing import AsyncIterator
+
 from bot.database.manager import get_pool
-from bot.config import PLAN_DAYS
+from bot.database.outbox import enqueue_panel_sync
+from bot.database.payments import mark_payment_granted
+from bot.config import PLAN_DAYS, PASARGUARD_PANELS
+from bot.utils.timers import schedule_subscription_timers
 
 
 async def get_active_subscription(user_id: int) -> dict | None:
@@ -14,6 +19,25 @@ async def get_active_subscription(user_id: int) -> dict | None:
     return dict(row) if row else None
 
 
+async def get_subscription(subscription_id: int) -> dict | None:
+    """Возвращает подписку по id или None."""
+    async with get_pool().acquire() as conn:
+        row = await conn.fetchrow("SELECT * FROM subscriptions WHERE id = $1", subscription_id)
+    return dict(row) if row else None
+
+
+async def get_subscription_by_panel_user(panel_id: str, panel_username: str) -> dict | None:
+    """Последняя подписка пользователя панели panel_id (для событий от PasarGuard)."""
+    async with get_pool().acquire() as conn:
+        row = await conn.fetchrow("""
+            SELECT * FROM subscriptions
+            WHERE panel_id = $1 AND panel_username COLLATE "C" = $2
+            ORDER BY panel_username COLLATE "C", id DESC
+            LIMIT 1
+        """, panel_id, panel_username)
+    return dict(row) if row else None
+
+
 async def get_any_subscription(user_id: int) -> dict | None:
     """Возвращает любую подписку пользователя (активную или нет) — для переиспользования."""
     async with get_pool().acquire() as conn:
@@ -29,19 +53,33 @@ async def reactivate_subscription(
     subscription_id: int,
     payment_method_id: str | None = None,
     days: int | None = None,
+    grant_payment: str | None = None,
 ) -> None:
-    """Реактивирует существующую подписку: включает, продлевает, обновляет метод оплаты."""
+    """
+    Реактивирует существующую подписку: включает, продлевает, обновляет метод оплаты.
+    В той же транзакции ставит синхронизацию с PasarGuard в panel_outbox
+    и отмечает выдачу по платежу grant_payment (см. mark_payment_granted),
+    после COMMIT — таймеры событий подписки (utils/timers.py).
+    """
     extend_days = days if days is not None else PLAN_DAYS
     expires_at = datetime.utcnow() + timedelta(days=extend_days)
     async with get_pool().acquire() as conn:
-        await conn.execute("""
-            UPDATE subscriptions
-            SET is_active = TRUE,
-                expires_at = $1,
-                yukassa_payment_method_id = COALESCE($2, yukassa_payment_method_id),
-                auto_renew = ($2 IS NOT NULL)
-            WHERE id = $3
-        """, expires_at, payment_method_id, subscription_id)
+        async with conn.transaction():
+            panel_username = await conn.fetchval("""
+                UPDATE subscriptions
+                SET is_active = TRUE,
+                    expires_at = $1,
+                    yukassa_payment_method_id = COALESCE($2, yukassa_payment_method_id),
+                    auto_renew = ($2 IS NOT NULL)
+                WHERE id = $3
+                RETURNING panel_username
+            """, expires_at, payment_method_id, subscription_id)
+            if panel_username:
+                await enqueue_panel_sync(conn, subscription_id, panel_username)
+            if grant_payment:
+                await mark_payment_granted(conn, grant_payment, subscription_id)
+    if panel_username:
+        await schedule_subscription_timers(subscription_id, expires_at)
 
 
 async def create_subscription(
@@ -51,38 +89,127 @@ async def create_subscription(
     days: int | None = None,
     auto_renew: bool = True,
     subscription_url: str | None = None,
+    panel_id: str | None = None,
+    grant_payment: str | None = None,
 ) -> int:
-    """Создаёт новую подписку. Возвращает id созданной записи."""
+    """
+    Создаёт новую подписку. Возвращает id созданной записи.
+    panel_id — панель PasarGuard, где создан пользователь (None — панель по умолчанию).
+    grant_payment — платёж, выдача по которому отмечается в той же транзакции.
+    """
     total_days = days if days is not None else PLAN_DAYS
     expires_at = datetime.utcnow() + timedelta(days=total_days)
     async with get_pool().acquire() as conn:
-        sub_id = await conn.fetchval("""
-            INSERT INTO subscriptions
-                (user_id, panel_username, expires_at, is_active,
-                 yukassa_payment_method_id, auto_renew, subscription_url)
-            VALUES ($1, $2, $3, TRUE, $4, $5, $6)
-            RETURNING id
-        """,
-            user_id, panel_username, expires_at, payment_method_id, auto_renew,
-            subscription_url,
-        )
+        async with conn.transaction():
+            sub_id = await conn.fetchval("""
+                INSERT INTO subscriptions
+                    (user_id, panel_username, expires_at, is_active,
+                     yukassa_payment_method_id, auto_renew, subscription_url, panel_id)
+                VALUES ($1, $2, $3, TRUE, $4, $5, $6, $7)
+                RETURNING id
+            """,
+                user_id, panel_username, expires_at, payment_method_id, auto_renew,
+                subscription_url, panel_id or PASARGUARD_PANELS[0],
+            )
+            if grant_payment:
+                await mark_payment_granted(conn, grant_payment, sub_id)
+    await schedule_subscription_timers(sub_id, expires_at)
     return sub_id
 
 
-async def extend_subscription(subscription_id: int, days: int | None = None) -> None:
-    """Продлевает подписку на days дней (по умолчанию PLAN_DAYS) от текущего expires_at."""
+async def extend_subscription(
+    subscription_id: int, days: int | None = None, grant_payment: str | None = None
+) -> None:
+    """
+    Продлевает подписку на days дней (по умолчанию PLAN_DAYS) от текущего expires_at.
+    В той же транзакции ставит синхронизацию с PasarGuard в panel_outbox
+    и отмечает выдачу по платежу grant_payment (см. mark_payment_granted),
+    после COMMIT — таймеры событий подписки (utils/timers.py).
+    """
     extend_days = days if days is not None else PLAN_DAYS
     async with get_pool().acquire() as conn:
-        await conn.execute("""
-            UPDATE subscriptions
-            SET expires_at = GREATEST(expires_at, NOW()) + $1,
-                is_active  = TRUE
-            WHERE id = $2
-        """,
-            timedelta(days=extend_days), subscription_id,
+        async with conn.transaction():
+            row = await conn.fetchrow("""
+                UPDATE subscriptions
+                SET expires_at = GREATEST(expires_at, NOW()) + $1,
+                    is_active  = TRUE
+                WHERE id = $2
+                RETURNING panel_username, expires_at
+            """,
+                timedelta(days=extend_days), subscription_id,
+            )
+            if row:
+                await enqueue_panel_sync(conn, subscription_id, row["panel_username"])
+            if grant_payment:
+                await mark_payment_granted(conn, grant_payment, subscription_id)
+    if row:
+        await schedule_subscription_timers(subscription_id, row["expires_at"])
+
+
+async def set_subscription_url(subscription_id: int, url: str) -> None:
+    """Сохраняет ссылку подписки, полученную из PasarGuard."""
+    async with get_pool().acquire() as conn:
+        await conn.execute(
+            "UPDATE subscriptions SET subscription_url = $1 WHERE id = $2",
+            url, subscription_id,
         )
 
 
+async def get_subscriptions_without_url(after_id: int, limit: int) -> list[dict]:
+    """
+    Активные подписки без subscription_url с id > after_id (keyset-страница для backfill).
+    Неактивные не берём: их пользователя в панели может уже не быть, и запрос падал бы каждый час.
+    """
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT id, user_id, panel_username, panel_id FROM subscriptions
+            WHERE is_active
+              AND (subscription_url IS NULL OR subscription_url = '')
+              AND id > $1
+            ORDER BY id
+            LIMIT $2
+        """, after_id, limit)
+    return [dict(r) for r in rows]
+
+
+async def get_subscriptions_page(after_id: int, limit: int) -> list[dict]:
+    """Подписки с id > after_id по возрастанию id (keyset-страница для обхода всей таблицы)."""
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT id, user_id, panel_username, panel_id, expires_at, is_active
+            FROM subscriptions
+            WHERE id > $1
+            ORDER BY id
+            LIMIT $2
+        """, after_id, limit)
+    return [dict(r) for r in rows]
+
+
+async def move_subscription_panel(
+    subscription_id: int,
+    from_panel: str,
+    to_panel: str,
+    subscription_url: str | None,
+) -> bool:
+    """
+    Переносит подписку на другую панель PasarGuard: panel_id и новая ссылка.
+    Срабатывает только если подписка всё ещё на from_panel. В той же транзакции
+    ставит синхронизацию в panel_outbox — на случай, если срок поменялся во время переноса.
+    Возвращает True если подписка перенесена.
+    """
+    async with get_pool().acquire() as conn:
+        async with conn.transaction():
+            panel_username = await conn.fetchval("""
+                UPDATE subscriptions
+                SET panel_id = $3, subscription_url = $4
+                WHERE id = $1 AND panel_id = $2
+                RETURNING panel_username
+            """, subscription_id, from_panel, to_panel, subscription_url)
+            if panel_username:
+                await enqueue_panel_sync(conn, subscription_id, panel_username)
+    return panel_username is not None
+
+
 async def save_payment_method(subscription_id: int, method_id: str) -> None:
     """Сохраняет id платёжного метода ЮKassa для автопродления."""
     async with get_pool().acquire() as conn:
@@ -93,12 +220,20 @@ async def save_payment_method(subscription_id: int, method_id: str) -> None:
 
 
 async def deactivate_subscription(subscription_id: int) -> None:
-    """Деактивирует подписку и сбрасывает сохранённый метод оплаты."""
+    """
+    Деактивирует подписку и сбрасывает сохранённый метод оплаты.
+    Панель синхронизируется через panel_outbox (срок в панели = expires_at из БД).
+    """
     async with get_pool().acquire() as conn:
-        await conn.execute(
-            "UPDATE subscriptions SET is_active = FALSE, yukassa_payment_method_id = NULL WHERE id = $1",
-            subscription_id,
-        )
+        async with conn.transaction():
+            panel_username = await conn.fetchval("""
+                UPDATE subscriptions
+                SET is_active = FALSE, yukassa_payment_method_id = NULL
+                WHERE id = $1
+                RETURNING panel_username
+            """, subscription_id)
+            if panel_username:
+                await enqueue_panel_sync(conn, subscription_id, panel_username)
 
 
 async def toggle_auto_renew(subscription_id: int, enabled: bool) -> None:
@@ -110,73 +245,81 @@ async def toggle_auto_renew(subscription_id: int, enabled: bool) -> None:
         )
 
 
-async def get_subscriptions_expiring_soon() -> list[dict]:
+async def get_expiring_subscriptions(within_hours: int = 24) -> list[dict]:
     """
-    Подписки, истекающие через 23–24 часа, у которых автопродление невозможно:
-      - auto_renew = FALSE, или
-      - нет сохранённого метода оплаты (ни разу не платили через ЮKassa).
-    Используется для напоминания «за день до окончания».
+    Возвращает активные подписки с auto_renew=TRUE и сохранённым методом оплаты,
+    которые истекают в ближайшие within_hours часов.
     """
-    now = datetime.utcnow()
-    window_start = now + timedelta(hours=23)
-    window_end   = now + timedelta(hours=24)
+    threshold = datetime.utcnow() + timedelta(hours=within_hours)
     async with get_pool().acquire() as conn:
         rows = await conn.fetch("""
             SELECT * FROM subscriptions
             WHERE is_active = TRUE
-              AND expires_at > $1
-              AND expires_at <= $2
-              AND (auto_renew = FALSE OR yukassa_payment_method_id IS NULL)
-        """, window_start, window_end)
-    return [dict(r) for r in rows]
-
-
-async def get_subscriptions_just_expired() -> list[dict]:
-    """
-    Подписки, у которых expires_at попал в последний 1 час (только что истекли).
-    Используется для уведомления «подписка закончилась».
-    """
-    now = datetime.utcnow()
-    window_start = now - timedelta(hours=1)
-    async with get_pool().acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT * FROM subscriptions
-            WHERE expires_at > $1
-              AND expires_at <= $2
-        """, window_start, now)
+              AND auto_renew = TRUE
+              AND yukassa_payment_method_id IS NOT NULL
+              AND expires_at <= $1
+        """, threshold)
     return [dict(r) for r in rows]
 
 
-async def get_subscriptions_expired_weeks_ago(weeks: int) -> list[dict]:
+async def claim_expiring_subscriptions(
+    within_hours: int, limit: int, lease_sec: int, subscription_id: int | None = None
+) -> list[dict]:
     """
-    Неактивные подписки, у которых expires_at был ровно `weeks` недель назад
-    (окно ±1 час). Используется для еженедельных напоминаний.
+    Как get_expiring_subscriptions, но забирает до limit подписок и арендует их на lease_sec.
+    Несколько реплик бота делят прогон автопродления: FOR UPDATE SKIP LOCKED не даёт
+    двум репликам взять одну подписку одновременно, а аренда — взять её повторно,
+    пока первая реплика её списывает.
+    subscription_id — взять только эту подписку (событие таймера renew).
     """
-    now = datetime.utcnow()
-    target       = now - timedelta(weeks=weeks)
-    window_start = target - timedelta(hours=1)
+    threshold = datetime.utcnow() + timedelta(hours=within_hours)
     async with get_pool().acquire() as conn:
         rows = await conn.fetch("""
-            SELECT * FROM subscriptions
-            WHERE is_active = FALSE
-              AND expires_at > $1
-              AND expires_at <= $2
-        """, window_start, target)
+            UPDATE subscriptions
+            SET renew_locked_until = NOW() + $3
+            WHERE id IN (
+                SELECT id FROM subscriptions
+                WHERE is_active = TRUE
+                  AND auto_renew = TRUE
+                  AND yukassa_payment_method_id IS NOT NULL
+                  AND expires_at <= $1
+                  AND (renew_locked_until IS NULL OR renew_locked_until < NOW())
+                  AND ($4::int IS NULL OR id = $4)
+                ORDER BY expires_at
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        """, threshold, limit, timedelta(seconds=lease_sec), subscription_id)
     return [dict(r) for r in rows]
 
 
-async def get_expiring_subscriptions(within_hours: int = 24) -> list[dict]:
+async def iter_subscriptions_by_panel_username(
+    panel_id: str,
+    batch_size: int = 1000,
+) -> AsyncIterator[list[dict]]:
     """
-    Возвращает активные подписки с auto_renew=TRUE и сохранённым методом оплаты,
-    которые истекают в ближайшие within_hours часов.
+    Постранично выдаёт подписки панели panel_id,
+    отсортированные по panel_username (побайтово, COLLATE "C").
+    Keyset-пагинация: каждая страница — отдельный короткий запрос, память ограничена batch_size.
+    На один panel_username возвращается только последняя запись (max id).
     """
-    threshold = datetime.utcnow() + timedelta(hours=within_hours)
-    async with get_pool().acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT * FROM subscriptions
-            WHERE is_active = TRUE
-              AND auto_renew = TRUE
-              AND yukassa_payment_method_id IS NOT NULL
-              AND expires_at <= $1
-        """, threshold)
-    return [dict(r) for r in rows]
+    last = ""
+    while True:
+        async with get_pool().acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT DISTINCT ON (panel_username COLLATE "C")
+                       id, user_id, panel_username, panel_id, expires_at, is_active,
+                       subscription_url
+                FROM subscriptions
+                WHERE panel_id = $3
+                  AND panel_username COLLATE "C" > $1
+                ORDER BY panel_username COLLATE "C", id DESC
+                LIMIT $2
+            """, last, batch_size, panel_id)
+        if not rows:
+            return
+        yield [dict(r) for r in rows]
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]["panel_username"]
@@ -0,0 +1,50 @@
+"""
+database/usage.py — снимки расхода трафика пользователей PasarGuard (usage_snapshots).
+
+Заполняется фоновой синхронизацией (services/usage.py) постранично по всей панели;
+меню и настройки читают отсюда — без запроса к панели на каждый показ.
+"""
+
+from datetime import datetime
+
+from bot.database.manager import get_pool
+
+
+async def upsert_usage(rows: list[tuple]) -> None:
+    """
+    Сохраняет страницу снимков одной пачкой.
+    rows — (panel_id, panel_username, used_traffic, data_limit, online_at, status, synced_at).
+    """
+    async with get_pool().acquire() as conn:
+        await conn.executemany("""
+            INSERT INTO usage_snapshots
+                (panel_id, panel_username, used_traffic, data_limit, online_at, status, synced_at)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ON CONFLICT (panel_id, panel_username) DO UPDATE
+            SET used_traffic = EXCLUDED.used_traffic,
+                data_limit   = EXCLUDED.data_limit,
+                online_at    = EXCLUDED.online_at,
+                status       = EXCLUDED.status,
+                synced_at    = EXCLUDED.synced_at
+        """, rows)
+
+
+async def delete_stale_usage(panel_id: str, synced_before: datetime) -> int:
+    """Удаляет снимки пользователей, которых не было в последнем проходе по панели."""
+    async with get_pool().acquire() as conn:
+        result = await conn.execute(
+            "DELETE FROM usage_snapshots WHERE panel_id = $1 AND synced_at < $2",
+            panel_id, synced_before,
+        )
+    return int(result.split()[-1])
+
+
+async def get_usage(panel_id: str, panel_username: str) -> dict | None:
+    """Снимок расхода трафика пользователя или None (ещё не синхронизирован)."""
+    async with get_pool().acquire() as conn:
+        row = await conn.fetchrow("""
+            SELECT used_traffic, data_limit, online_at, status, synced_at
+            FROM usage_snapshots
+            WHERE panel_id = $1 AND panel_username = $2
+        """, panel_id, panel_username)
+    return dict(row) if row else None
@@ -0,0 +1,94 @@
+"""
+database/yukassa_events.py — входящие уведомления ЮKassa (yukassa_events).
+
+Вебхук только сохраняет событие и сразу отвечает 200; обрабатывает его воркер
+services/yukassa_events.py. Одно событие на пару (payment_id, event_type) —
+повторная доставка того же уведомления в таблицу не попадает.
+Аренда (locked_until) и повторы устроены так же, как в panel_outbox.
+"""
+
+import json
+from datetime import timedelta
+
+from bot.database.manager import get_pool
+
+YUKASSA_EVENTS_CHANNEL = "yukassa_events"
+
+
+async def save_yukassa_event(
+    payment_id: str, event_type: str, payload: dict, requeue: bool = False
+) -> bool:
+    """
+    Сохраняет событие. Возвращает False, если такое событие уже было.
+    requeue=True — уже обработанное (done/dead) событие снова ставится в очередь
+    (досверка нашла платёж, который прошлая обработка не довела); False — только если оно ещё ждёт.
+    """
+    conflict = """
+        DO UPDATE SET status = 'pending', attempts = 0, next_attempt_at = NOW(),
+                      locked_until = NULL, payload = EXCLUDED.payload
+        WHERE yukassa_events.status <> 'pending'
+    """ if requeue else "DO NOTHING"
+    async with get_pool().acquire() as conn:
+        async with conn.transaction():
+            row_id = await conn.fetchval(f"""
+                INSERT INTO yukassa_events (payment_id, event_type, payload)
+                VALUES ($1, $2, $3::jsonb)
+                ON CONFLICT (payment_id, event_type) {conflict}
+                RETURNING id
+            """, payment_id, event_type, json.dumps(payload))
+            if row_id is not None:
+                await conn.execute("SELECT pg_notify($1, '')", YUKASSA_EVENTS_CHANNEL)
+    return row_id is not None
+
+
+async def claim_yukassa_events(limit: int, lease_sec: int) -> list[dict]:
+    """Забирает до limit готовых событий и арендует их на lease_sec."""
+    async with get_pool().acquire() as conn:
+        rows = await conn.fetch("""
+            UPDATE yukassa_events
+            SET locked_until = NOW() + $2,
+                attempts     = attempts + 1
+            WHERE id IN (
+                SELECT id FROM yukassa_events
+                WHERE status = 'pending'
+                  AND next_attempt_at <= NOW()
+                  AND (locked_until IS NULL OR locked_until < NOW())
+                ORDER BY next_attempt_at
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        """, limit, timedelta(seconds=lease_sec))
+    events = []
+    for r in rows:
+        event = dict(r)
+        event["payload"] = json.loads(event["payload"])
+        events.append(event)
+    return events
+
+
+async def complete_yukassa_event(event_id: int) -> None:
+    async with get_pool().acquire() as conn:
+        await conn.execute("""
+            UPDATE yukassa_events
+            SET status = 'done', done_at = NOW(), locked_until = NULL, last_error = NULL
+            WHERE id = $1
+        """, event_id)
+
+
+async def fail_yukassa_event(event_id: int, error: str, retry_in_sec: int | None) -> None:
+    """Откладывает событие на retry_in_sec секунд или (retry_in_sec=None) помечает как dead."""
+    async with get_pool().acquire() as conn:
+        if retry_in_sec is None:
+            await conn.execute(
+                "UPDATE yukassa_events SET status = 'dead', locked_until = NULL, last_error = $2 WHERE id = $1",
+                event_id, error,
+            )
+        else:
+            await conn.execute("""
+                UPDATE yukassa_events
+                SET next_attempt_at = NOW() + $2,
+                    locked_until    = NULL,
+                    last_error      = $3
+                WHERE id = $1
+            """, event_id, timedelta(seconds=retry_in_sec), error)
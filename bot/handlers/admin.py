@@ -7,6 +7,7 @@ handlers/admin.py — административные команды.
 import logging
 
 from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -14,9 +15,15 @@ from aiogram.types import Message, CallbackQuery
 
 from bot.config import ADMIN_IDS
 from bot.database.users import get_all_users, count_users, set_ban, get_user
+from bot.database.broadcasts import control_broadcast, create_broadcast, get_broadcast
+from bot.database.job_runs import get_job_overview
 from bot.database.subscriptions import get_active_subscription
 from bot.keyboards.admin import admin_menu_kb, confirm_broadcast_kb, admin_back_kb
+from bot.services.broadcasts import broadcast_progress
+from bot.services.job_runs import is_near_overrun
 from bot.services.subscription import create_paid_subscription
+from bot.services.tg_session import api_metrics, api_metrics_since
+from bot.utils.locks import user_lock
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -53,15 +60,60 @@ async def cb_adm_menu(callback: CallbackQuery, state: FSMContext) -> None:
 
 # ── Статистика ────────────────────────────────────────────────────────────────
 
+_API_METHODS_SHOWN = 8
+
+
 @router.callback_query(F.data == "adm_stats")
 async def cb_adm_stats(callback: CallbackQuery) -> None:
     if not _is_admin(callback.from_user.id):
         return
     total = await count_users()
-    await callback.message.edit_text(
-        f"📊 <b>Статистика</b>\n\nПользователей: <b>{total}</b>",
-        reply_markup=admin_back_kb(),
-    )
+    since = api_metrics_since(callback.bot)
+    window = f"эта реплика, с {since:%d.%m %H:%M} UTC" if since else "эта реплика"
+    lines = [f"📊 <b>Статистика</b>\n\nПользователей: <b>{total}</b>", "", f"<b>Telegram API</b> ({window})"]
+    for name, stats in api_metrics(callback.bot)[:_API_METHODS_SHOWN]:
+        p95 = stats.quantile_ms(0.95)
+        lines.append(
+            f"• {name}: {stats.calls} шт., ошибок {stats.error_rate:.1%} "
+            f"(сеть {stats.net_errors}), avg {stats.avg_ms:.0f} мс, "
+            f"p95 {'≤' + str(p95) if p95 else '>10000'} мс"
+        )
+    if len(lines) == 3:
+        lines.append("Запросов пока нет.")
+    await callback.message.edit_text("\n".join(lines), reply_markup=admin_back_kb())
+    await callback.answer()
+
+
+# ── Фоновые задачи ────────────────────────────────────────────────────────────
+
+_JOB_STATUS_ICONS = {"ok": "✅", "failed": "❌", "running": "⏳"}
+
+
+@router.callback_query(F.data == "adm_jobs")
+async def cb_adm_jobs(callback: CallbackQuery) -> None:
+    if not _is_admin(callback.from_user.id):
+        return
+    jobs = await get_job_overview()
+    lines = ["⏱ <b>Фоновые задачи</b> — последний запуск\n"]
+    for job in jobs:
+        icon = _JOB_STATUS_ICONS.get(job["status"], "•")
+        duration = job["duration_sec"] or 0
+        line = (
+            f"{icon} <b>{job['job_id']}</b> {job['started_at']:%d.%m %H:%M} UTC — "
+            f"{duration:.0f}с / {job['interval_sec']}с, "
+            f"{job['items']} шт., ошибок {job['failures']}"
+        )
+        if job["p95_ms"] is not None:
+            line += f", p50 {job['p50_ms']:.0f} мс, p95 {job['p95_ms']:.0f} мс"
+        if is_near_overrun(job["interval_load"]):
+            line += "\n    ⚠️ близко к интервалу: максимум за 10 запусков "
+            line += f"{job['max_duration_sec']:.0f}с"
+        if job["skipped_24h"]:
+            line += f"\n    ⏭ пропусков за сутки: {job['skipped_24h']}"
+        lines.append(line)
+    if not jobs:
+        lines.append("Запусков пока нет.")
+    await callback.message.edit_text("\n".join(lines), reply_markup=admin_back_kb())
     await callback.answer()
 
 
@@ -117,20 +169,35 @@ async def cb_adm_broadcast_confirm(callback: CallbackQuery, state: FSMContext) -
     text = data.get("text", "")
     await state.clear()
 
-    users = await get_all_users()
-    sent = 0
-    for u in users:
-        try:
-            await callback.bot.send_message(u["user_id"], text)
-            sent += 1
-        except Exception:
-            pass
-
-    await callback.message.edit_text(
-        f"✅ Рассылка завершена. Доставлено: {sent}/{len(users)}",
-        reply_markup=admin_back_kb(),
+    # Отправляет воркер (services/broadcasts.py); это сообщение он обновляет прогрессом
+    job = await create_broadcast(
+        text,
+        created_by=callback.from_user.id,
+        chat_id=callback.message.chat.id,
+        message_id=callback.message.message_id,
     )
-    await callback.answer()
+    progress, kb = broadcast_progress(job)
+    await callback.message.edit_text(progress, reply_markup=kb)
+    await callback.answer("Рассылка поставлена в очередь")
+
+
+@router.callback_query(F.data.startswith("adm_bc:"))
+async def cb_adm_broadcast_control(callback: CallbackQuery) -> None:
+    if not _is_admin(callback.from_user.id):
+        return
+    _, action, job_id = callback.data.split(":")
+    job = await control_broadcast(int(job_id), action)
+    if job is None:
+        job = await get_broadcast(int(job_id))
+        await callback.answer("Команда недоступна для этой рассылки", show_alert=True)
+    else:
+        await callback.answer()
+    if job is not None:
+        progress, kb = broadcast_progress(job)
+        try:
+            await callback.message.edit_text(progress, reply_markup=kb)
+        except TelegramBadRequest:
+            pass  # прогресс не изменился
 
 
 # ── Бан / разбан ──────────────────────────────────────────────────────────────
@@ -216,7 +283,9 @@ async def fsm_grant_id(message: Message, state: FSMContext) -> None:
 
     await state.clear()
     try:
-        url = await create_paid_subscription(uid)
+        # Та же блокировка, что и при оплате — начисление не наложится на платёж
+        async with user_lock(uid):
+            url = await create_paid_subscription(uid)
         # Уведомляем пользователя
         try:
             await message.bot.send_message(
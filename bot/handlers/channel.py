@@ -13,6 +13,7 @@ from aiogram.types import CallbackQuery
 
 from bot.config import CHANNEL_USERNAME
 from bot.database.subscriptions import get_active_subscription
+from bot.database.usage import get_usage
 from bot.database.users import get_referral_count
 from bot.keyboards.user import menu_kb_no_sub, menu_kb_with_sub
 from bot.messages import menu_text
@@ -63,10 +64,12 @@ async def cb_check_channel_sub(callback: CallbackQuery, redis=None) -> None:
     bot_info = await callback.bot.get_me()
     sub = await get_active_subscription(user_id)
     ref_count = await get_referral_count(user_id)
+    usage = await get_usage(sub["panel_id"], sub["panel_username"]) if sub else None
     caption = menu_text(
         sub=sub,
         ref_link=_ref_link(bot_info.username, user_id),
         ref_count=ref_count,
+        usage=usage,
     )
     kb = menu_kb_with_sub() if sub else menu_kb_no_sub()
     await send_photo_page(callback.message, "menu", caption, kb)
@@ -12,6 +12,7 @@ from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 
 from bot.database.subscriptions import get_active_subscription
+from bot.database.usage import get_usage
 from bot.database.users import get_referral_count
 from bot.keyboards.user import menu_kb_no_sub, menu_kb_with_sub
 from bot.messages import menu_text
@@ -31,10 +32,12 @@ async def _build(user_id: int, bot_username: str) -> tuple[str, object]:
     """Собирает текст и клавиатуру главного меню."""
     sub = await get_active_subscription(user_id)
     ref_count = await get_referral_count(user_id)
+    usage = await get_usage(sub["panel_id"], sub["panel_username"]) if sub else None
     text = menu_text(
         sub=sub,
         ref_link=_ref_link(bot_username, user_id),
         ref_count=ref_count,
+        usage=usage,
     )
     kb = menu_kb_with_sub() if sub else menu_kb_no_sub()
     return text, kb
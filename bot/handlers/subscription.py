@@ -10,6 +10,7 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery
 
 from bot.database.subscriptions import get_active_subscription, toggle_auto_renew
+from bot.database.usage import get_usage
 from bot.keyboards.user import settings_kb, back_to_menu_kb
 from bot.messages import settings_text, instruction_text
 from bot.services.subscription import get_subscription_url
@@ -42,10 +43,11 @@ async def cb_settings(callback: CallbackQuery) -> None:
         await callback.answer("Подписка не активна", show_alert=True)
         return
 
+    usage = await get_usage(sub["panel_id"], sub["panel_username"])
     await edit_photo_page(
         callback,
         page="settings",
-        caption=settings_text(sub),
+        caption=settings_text(sub, usage),
         reply_markup=settings_kb(sub.get("auto_renew", False)),
     )
     await callback.answer()
@@ -61,11 +63,12 @@ async def cb_toggle_renew(callback: CallbackQuery) -> None:
     new_state = not sub.get("auto_renew", False)
     await toggle_auto_renew(sub["id"], new_state)
     sub["auto_renew"] = new_state
+    usage = await get_usage(sub["panel_id"], sub["panel_username"])
 
     await edit_photo_page(
         callback,
         page="settings",
-        caption=settings_text(sub),
+        caption=settings_text(sub, usage),
         reply_markup=settings_kb(new_state),
     )
     await callback.answer("Автопродление " + ("включено ✅" if new_state else "выключено ❌"))
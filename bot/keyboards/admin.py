@@ -14,6 +14,7 @@ def admin_menu_kb() -> InlineKeyboardMarkup:
     kb.button(text="🚫 Забанить",         callback_data="adm_ban")
     kb.button(text="✅ Разбанить",        callback_data="adm_unban")
     kb.button(text="🎁 Начислить подписку", callback_data="adm_grant")
+    kb.button(text="⏱ Задачи",            callback_data="adm_jobs")
     kb.adjust(2)
     return kb.as_markup()
 
@@ -26,6 +27,19 @@ def confirm_broadcast_kb() -> InlineKeyboardMarkup:
     return kb.as_markup()
 
 
+def broadcast_control_kb(job_id: int, status: str) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    if status in ("pending", "running"):
+        kb.button(text="⏸ Пауза",       callback_data=f"adm_bc:pause:{job_id}")
+    if status == "paused":
+        kb.button(text="▶️ Продолжить",  callback_data=f"adm_bc:resume:{job_id}")
+    if status in ("pending", "running", "paused"):
+        kb.button(text="🛑 Отменить",    callback_data=f"adm_bc:cancel:{job_id}")
+    kb.button(text="◀️ Назад", callback_data="adm_menu")
+    kb.adjust(2)
+    return kb.as_markup()
+
+
 def admin_back_kb() -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.button(text="◀️ Назад", callback_data="adm_menu")
@@ -17,9 +17,22 @@ from bot.config import (
 from bot.database import create_pool, close_pool, create_tables
 from bot.handlers import register_all_handlers
 from bot.middlewares import ThrottlingMiddleware, BanCheckMiddleware, ChannelSubscriptionMiddleware
-from bot.webhooks import register_yukassa_webhook, register_redirect_routes
+from bot.webhooks import (
+    register_yukassa_webhook,
+    register_pasarguard_webhook,
+    register_redirect_routes,
+    register_subscription_proxy,
+)
 from bot.services.scheduler import setup_scheduler
-from bot.services.pasarguard import pasarguard
+from bot.services.pasarguard import panels
+from bot.services.outbox import start_outbox_worker, stop_outbox_worker
+from bot.services.yukassa_events import start_yukassa_worker, stop_yukassa_worker
+from bot.services.timers import start_timers_worker, stop_timers_worker
+from bot.services.broadcasts import start_broadcast_worker, stop_broadcast_worker
+from bot.services.tg_sender import FloodControlMiddleware, flood_control
+from bot.services.tg_session import create_bot_session
+from bot.services.yukassa import yukassa
+from bot.utils.redis import set_redis
 
 logging.basicConfig(
     level=logging.INFO,
@@ -32,6 +45,10 @@ async def on_startup(bot: Bot, redis: Redis) -> None:
     """Выполняется при старте: создаём пул, таблицы и регистрируем вебхук."""
     await create_pool()
     await create_tables()
+    await start_outbox_worker()
+    await start_yukassa_worker(bot)
+    await start_timers_worker(bot)
+    await start_broadcast_worker(bot)
     await bot.set_webhook(WEBHOOK_URL)
     setup_scheduler(bot)
     logger.info("Webhook set to %s", WEBHOOK_URL)
@@ -40,7 +57,12 @@ async def on_startup(bot: Bot, redis: Redis) -> None:
 async def on_shutdown(bot: Bot) -> None:
     """Выполняется при остановке: очищаем ресурсы."""
     await bot.delete_webhook()
-    await pasarguard.close()
+    await stop_outbox_worker()
+    await stop_yukassa_worker()
+    await stop_timers_worker()
+    await stop_broadcast_worker()
+    await panels.close()
+    await yukassa.close()
     await close_pool()
     logger.info("Bot shutdown complete")
 
@@ -50,9 +72,16 @@ def build_app() -> web.Application:
 
     # ── Redis ──────────────────────────────────────────────────────────────────
     redis = Redis.from_url(REDIS_URL, decode_responses=False)
+    set_redis(redis)
 
     # ── Бот и диспетчер ────────────────────────────────────────────────────────
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
+    bot = Bot(
+        token=BOT_TOKEN,
+        session=create_bot_session(),
+        default=DefaultBotProperties(parse_mode='HTML'),
+    )
+    # Все отправки — через общий лимит и приоритеты (services/tg_sender.py)
+    bot.session.middleware(FloodControlMiddleware(flood_control))
     storage = RedisStorage(redis=redis)
     dp = Dispatcher(storage=storage)
 
@@ -81,9 +110,15 @@ def build_app() -> web.Application:
     # ЮKassa webhook
     register_yukassa_webhook(app, bot)
 
+    # PasarGuard webhook (события пользователей панели)
+    register_pasarguard_webhook(app)
+
     # Умные редиректы для инструкции
     register_redirect_routes(app)
 
+    # Кэширующий прокси ссылок подписки
+    register_subscription_proxy(app)
+
     return app
 
 
@@ -54,9 +54,44 @@ def instruction_text(url: str = "") -> str:
     )
 
 
+# ── Расход трафика ────────────────────────────────────────────────────────────
+
+def _fmt_bytes(n: int) -> str:
+    size = float(n)
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit in ("Б", "КБ") else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ТБ"
+
+
+def _fmt_ago(dt: datetime) -> str:
+    minutes = int((datetime.utcnow() - dt).total_seconds() // 60)
+    if minutes < 5:
+        return "только что"
+    if minutes < 60:
+        return f"{minutes} мин назад"
+    if minutes < 24 * 60:
+        return f"{minutes // 60} ч назад"
+    return f"{minutes // (24 * 60)} дн назад"
+
+
+def _usage_lines(usage: dict | None) -> list[str]:
+    """Строки «Трафик» и «В сети» из usage_snapshots; пусто, если снимка ещё нет."""
+    if not usage:
+        return []
+    traffic = _fmt_bytes(usage["used_traffic"])
+    if usage.get("data_limit"):
+        traffic += f" из {_fmt_bytes(usage['data_limit'])}"
+    online = _fmt_ago(usage["online_at"]) if usage.get("online_at") else "ещё не подключался"
+    return [f"<b>Трафик:</b> {traffic}", f"<b>В сети:</b> {online}"]
+
+
 # ── Главное меню ──────────────────────────────────────────────────────────────
 
-def menu_text(sub: dict | None, ref_link: str, ref_count: int) -> str:
+def menu_text(
+    sub: dict | None, ref_link: str, ref_count: int, usage: dict | None = None
+) -> str:
     lines = []
 
     # Блок подписки
@@ -65,9 +100,13 @@ def menu_text(sub: dict | None, ref_link: str, ref_count: int) -> str:
         if isinstance(expires, str):
             expires = datetime.fromisoformat(expires)
         days_left = max(0, (expires - datetime.utcnow()).days)
+        rows = [f"<b>Осталось дней:</b> {days_left}", *_usage_lines(usage)]
+        tree = "\n".join(
+            ("╰ " if i == len(rows) - 1 else "├ ") + row for i, row in enumerate(rows)
+        )
         lines.append(
             f'<tg-emoji emoji-id="5350404270032166927">🏠</tg-emoji> <b>Подписка</b>\n'
-            f"╰ <b>Осталось дней:</b> {days_left}"
+            f"{tree}"
         )
     else:
         lines.append(
@@ -89,18 +128,25 @@ def menu_text(sub: dict | None, ref_link: str, ref_count: int) -> str:
 
 # ── Настройки подписки ────────────────────────────────────────────────────────
 
-def settings_text(sub: dict) -> str:
+def settings_text(sub: dict, usage: dict | None = None) -> str:
     expires = sub["expires_at"]
     if isinstance(expires, str):
         expires = datetime.fromisoformat(expires)
     days_left = max(0, (expires - datetime.utcnow()).days)
     auto = sub.get("auto_renew", False)
+    usage_block = "".join(
+        f"{icon} {row}\n" for icon, row in zip(("📊", "🕒"), _usage_lines(usage))
+    )
+    if usage_block:
+        usage_block += "\n"
     auto_icon = '<tg-emoji emoji-id="5411197345968701560">✅</tg-emoji>' if auto else '<tg-emoji emoji-id="5416076321442777828">❌</tg-emoji>'
 
     return (
         f"<tg-emoji emoji-id=\"5217604963571621845\">📅</tg-emoji> "
         f"Осталось дней: <b>{days_left}</b>\n\n"
 
+        f"{usage_block}"
+
         f"<tg-emoji emoji-id=\"5258419835922030550\">🔄</tg-emoji> "
         f"Автопродление: <b>{auto_icon}</b>\n\n"
 
@@ -0,0 +1,218 @@
+"""
+services/broadcasts.py — фоновый исполнитель рассылок (broadcast_jobs).
+
+Хендлер только создаёт задачу (database/broadcasts.py) и сразу отвечает.
+Воркер (каркас — services/queue_worker.py):
+  • просыпается по NOTIFY broadcast_jobs (и раз в BROADCAST_POLL_SEC);
+  • читает получателей страницами по BROADCAST_PAGE и отправляет в полосе broadcast
+    (services/tg_sender.py) — общий лимит и повторы после 429 берёт на себя FloodControl,
+    ответы пользователям рассылка не задерживает;
+  • пока страница отправляется, продлевает аренду раз в треть BROADCAST_LEASE_SEC:
+    полоса broadcast — самая низкая в лимитере, и страница может идти дольше аренды.
+    Пауза, отмена или потеря аренды (claim_token перехвачен) останавливают отправку
+    сразу, не дожидаясь конца страницы;
+  • после каждой страницы сохраняет контрольную точку (только со своим claim_token);
+  • раз в BROADCAST_PROGRESS_SEC обновляет сообщение с прогрессом у администратора.
+"""
+
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.types import InlineKeyboardMarkup
+
+from bot.config import (
+    BROADCAST_CONCURRENCY,
+    BROADCAST_LEASE_SEC,
+    BROADCAST_PAGE,
+    BROADCAST_POLL_SEC,
+    BROADCAST_PROGRESS_SEC,
+)
+from bot.database.broadcasts import (
+    BROADCASTS_CHANNEL,
+    claim_broadcast,
+    finish_broadcast,
+    get_broadcast_recipients,
+    renew_broadcast_lease,
+    save_broadcast_progress,
+)
+from bot.keyboards.admin import broadcast_control_kb
+from bot.services.queue_worker import QueueWorker
+from bot.services.tg_sender import Priority, send_priority
+
+logger = logging.getLogger(__name__)
+
+_STATUS_LABELS = {
+    "pending":   "⏳ в очереди",
+    "running":   "📤 идёт",
+    "paused":    "⏸ на паузе",
+    "cancelled": "🛑 отменена",
+    "done":      "✅ завершена",
+}
+
+_bot: Bot | None = None
+
+
+# ── Прогресс ──────────────────────────────────────────────────────────────────
+
+def broadcast_progress(job: dict) -> tuple[str, InlineKeyboardMarkup]:
+    """Текст и клавиатура сообщения с прогрессом рассылки."""
+    remaining = max((job["total"] or 0) - job["sent"] - job["failed"], 0)
+    text = (
+        f"📢 <b>Рассылка #{job['id']}</b> — {_STATUS_LABELS.get(job['status'], job['status'])}\n\n"
+        f"Доставлено: <b>{job['sent']}</b>\n"
+        f"Не доставлено: <b>{job['failed']}</b>\n"
+        f"Осталось: ~{remaining} из {job['total']}"
+    )
+    return text, broadcast_control_kb(job["id"], job["status"])
+
+
+async def _show_progress(job: dict) -> None:
+    if _bot is None or not job.get("chat_id") or not job.get("message_id"):
+        return
+    text, kb = broadcast_progress(job)
+    try:
+        await _bot.edit_message_text(
+            text, chat_id=job["chat_id"], message_id=job["message_id"], reply_markup=kb
+        )
+    except Exception as exc:
+        # «message is not modified», удалённое сообщение — на рассылку не влияет
+        logger.debug("Broadcast #%s: progress not updated: %s", job["id"], exc)
+
+
+# ── Выполнение ────────────────────────────────────────────────────────────────
+
+class _Lease:
+    """Фоновое продление аренды рассылки; status — последний известный статус задачи."""
+
+    def __init__(self, job: dict) -> None:
+        self._job_id = job["id"]
+        self.token: str = job["claim_token"]
+        self.status: str | None = job["status"]
+        self._task = asyncio.create_task(self._renew())
+
+    @property
+    def active(self) -> bool:
+        return self.status == "running"
+
+    async def _renew(self) -> None:
+        while self.active:
+            await asyncio.sleep(BROADCAST_LEASE_SEC / 3)
+            try:
+                self.status = await renew_broadcast_lease(
+                    self._job_id, self.token, BROADCAST_LEASE_SEC
+                )
+            except Exception as exc:
+                logger.warning("Broadcast #%s: lease renewal failed: %s", self._job_id, exc)
+
+    def stop(self) -> None:
+        self._task.cancel()
+
+
+async def _deliver(
+    user_id: int, text: str, sem: asyncio.Semaphore, lease: _Lease
+) -> bool | None:
+    """True — доставлено, False — нет, None — не отправляли (пауза, отмена, аренда потеряна)."""
+    async with sem:
+        if not lease.active:
+            return None
+        try:
+            with send_priority(Priority.BROADCAST):
+                await _bot.send_message(user_id, text)
+            return True
+        except TelegramForbiddenError:
+            return False  # пользователь заблокировал бота
+        except Exception as exc:
+            logger.warning("Broadcast not delivered to user %s: %s", user_id, exc)
+            return False
+
+
+async def _run_job(job: dict) -> None:
+    logger.info(
+        "Broadcast #%s: running from user_id > %s (%s/%s done)",
+        job["id"], job["last_user_id"], job["sent"] + job["failed"], job["total"],
+    )
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    lease = _Lease(job)
+    shown_at = 0.0
+    try:
+        while lease.active:
+            page = await get_broadcast_recipients(
+                job["audience"], job["last_user_id"], BROADCAST_PAGE
+            )
+            if not page:
+                break
+            results = await asyncio.gather(
+                *(_deliver(uid, job["text"], sem, lease) for uid in page)
+            )
+            # Контрольная точка — до первого неотправленного: остаток страницы уйдёт
+            # после возобновления (отправленные после него могут повториться)
+            done = results.index(None) if None in results else len(results)
+            if done:
+                sent = sum(1 for r in results[:done] if r)
+                failed = done - sent
+                status = await save_broadcast_progress(
+                    job["id"], lease.token, page[done - 1], sent, failed, BROADCAST_LEASE_SEC
+                )
+                if status is not None:
+                    job.update(
+                        last_user_id=page[done - 1],
+                        sent=job["sent"] + sent,
+                        failed=job["failed"] + failed,
+                    )
+                lease.status = status
+            job["status"] = lease.status or job["status"]
+
+            if time.monotonic() - shown_at >= BROADCAST_PROGRESS_SEC:
+                await _show_progress(job)
+                shown_at = time.monotonic()
+    finally:
+        lease.stop()
+
+    if lease.status is None:
+        logger.warning("Broadcast #%s: lease taken over by another replica, stopping", job["id"])
+        return
+
+    final = await finish_broadcast(job["id"], lease.token)
+    if final is not None:
+        logger.info(
+            "Broadcast #%s: %s, sent=%d failed=%d",
+            final["id"], final["status"], final["sent"], final["failed"],
+        )
+        await _show_progress(final)
+
+
+# ── Воркер ────────────────────────────────────────────────────────────────────
+
+async def _claim() -> list[dict]:
+    # По одной рассылке за раз: следующая начнётся, когда эта закончится или встанет на паузу
+    job = await claim_broadcast(BROADCAST_LEASE_SEC)
+    return [job] if job else []
+
+
+_worker = QueueWorker(
+    name="Broadcast",
+    channel=BROADCASTS_CHANNEL,
+    poll_sec=BROADCAST_POLL_SEC,
+    claim=_claim,
+    handle=_run_job,
+    describe=lambda job: f"broadcast #{job['id']}",
+)
+
+
+async def drain_once() -> int:
+    """Выполняет одну рассылку целиком (или до паузы/отмены). Возвращает 1, если была работа."""
+    return await _worker.drain_once()
+
+
+async def start_broadcast_worker(bot: Bot) -> None:
+    """Запускает воркер. Вызывается при старте после create_pool()."""
+    global _bot
+    _bot = bot
+    await _worker.start()
+
+
+async def stop_broadcast_worker() -> None:
+    await _worker.stop()
@@ -0,0 +1,107 @@
+"""
+services/job_runs.py — учёт запусков фоновых задач.
+
+run_tracked() оборачивает запуск задачи планировщика: пишет строку в job_runs
+(database/job_runs.py) с длительностью, числом обработанных элементов, ошибок
+и p50/p95 времени на элемент.
+
+Элементы отмечают сами задачи через record_item() / add_items(); текущий запуск
+передаётся через contextvar, поэтому параметр не нужно протаскивать по всем вызовам.
+Вне запуска задачи (напр. событие таймера) обе функции ничего не делают.
+"""
+
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable
+
+from bot.config import JOB_OVERRUN_RATIO
+from bot.database.job_runs import finish_job_run, record_skipped_run, start_job_run
+
+logger = logging.getLogger(__name__)
+
+
+class _JobRun:
+    def __init__(self) -> None:
+        self.items = 0
+        self.failures = 0
+        self.durations: list[float] = []
+
+    def percentile_ms(self, q: float) -> float | None:
+        if not self.durations:
+            return None
+        ordered = sorted(self.durations)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000
+
+
+_current: ContextVar[_JobRun | None] = ContextVar("job_run", default=None)
+
+
+def record_item(duration_sec: float, ok: bool = True) -> None:
+    """Отмечает обработанный элемент текущего запуска."""
+    run = _current.get()
+    if run is None:
+        return
+    run.items += 1
+    run.durations.append(duration_sec)
+    if not ok:
+        run.failures += 1
+
+
+def add_items(count: int, failures: int = 0) -> None:
+    """Отмечает сразу count элементов (для задач, которые знают только итог)."""
+    run = _current.get()
+    if run is None:
+        return
+    run.items += count
+    run.failures += failures
+
+
+def is_near_overrun(interval_load: float | None) -> bool:
+    """Запуск занял почти весь интервал задачи (доля interval_load) — следующий рискует наложиться."""
+    return interval_load is not None and interval_load >= JOB_OVERRUN_RATIO
+
+
+async def run_tracked(
+    job_id: str, interval_sec: int, func: Callable[..., Awaitable[Any]], **kwargs: Any
+) -> None:
+    """Выполняет задачу и записывает запуск в job_runs. Ошибки задачи логируются, не пробрасываются."""
+    try:
+        run_id = await start_job_run(job_id, interval_sec)
+    except Exception as exc:
+        logger.warning("Job %s: run not recorded: %s", job_id, exc)
+        run_id = None
+
+    run = _JobRun()
+    token = _current.set(run)
+    started = time.monotonic()
+    status, error = "ok", None
+    try:
+        await func(**kwargs)
+    except Exception as exc:
+        status, error = "failed", str(exc)
+        logger.error("Job %s failed: %s", job_id, exc)
+    finally:
+        _current.reset(token)
+
+    elapsed = time.monotonic() - started
+    if interval_sec and is_near_overrun(elapsed / interval_sec):
+        logger.warning(
+            "Job %s took %.0fs of its %ds interval", job_id, elapsed, interval_sec
+        )
+    if run_id is None:
+        return
+    try:
+        await finish_job_run(
+            run_id, status, run.items, run.failures,
+            run.percentile_ms(0.5), run.percentile_ms(0.95), error,
+        )
+    except Exception as exc:
+        logger.warning("Job %s: run not recorded: %s", job_id, exc)
+
+
+async def record_skip(job_id: str, interval_sec: int, reason: str) -> None:
+    try:
+        await record_skipped_run(job_id, interval_sec, reason)
+    except Exception as exc:
+        logger.warning("Job %s: skip not recorded: %s", job_id, exc)
@@ -0,0 +1,134 @@
+"""
+services/outbox.py — фоновый воркер, применяющий panel_outbox к PasarGuard.
+
+Хэндлеры и сервисы меняют только БД (см. database/outbox.py) — задержка панели
+больше не входит во время ответа пользователю. Воркер (каркас — services/queue_worker.py):
+  • просыпается по NOTIFY panel_outbox сразу после COMMIT (и раз в OUTBOX_POLL_SEC на всякий случай);
+  • читает актуальную подписку и выставляет в панели её expires_at (идемпотентно);
+    PUT отправляет полного пользователя, поэтому строится по свежему GET. Снимок из Redis
+    (services/panel_cache.py) заменяет GET, только когда вебхук панели включён
+    и снимок не старше PANEL_SNAPSHOT_TRUST_SEC — иначе он мог пропустить правки в панели;
+  • при ошибке повторяет с экспоненциальной задержкой, после OUTBOX_MAX_ATTEMPTS —
+    помечает задачу dead и пишет ERROR в лог. Ни одно продление не теряется молча.
+"""
+
+import logging
+from datetime import timezone
+
+import aiohttp
+
+from bot.config import (
+    OUTBOX_BATCH,
+    OUTBOX_CONCURRENCY,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_POLL_SEC,
+    PANEL_SNAPSHOT_TRUST_SEC,
+    PASARGUARD_WEBHOOK_SECRET,
+)
+from bot.database.outbox import (
+    OUTBOX_CHANNEL,
+    claim_panel_ops,
+    complete_panel_op,
+    fail_panel_op,
+)
+from bot.database.subscriptions import get_subscription
+from bot.services.panel_cache import drop_user_snapshot, get_user_snapshot, save_user_snapshot
+from bot.services.pasarguard import PasarGuardClient, panels
+from bot.services.queue_worker import QueueWorker
+from bot.services.sub_cache import invalidate_sub_cache
+
+logger = logging.getLogger(__name__)
+
+_LEASE_SEC = 120             # аренда задачи на время обработки
+
+
+# ── Применение одной задачи ───────────────────────────────────────────────────
+
+async def _apply(op: dict) -> None:
+    """Приводит пользователя в панели к состоянию подписки в БД."""
+    sub = await get_subscription(op["subscription_id"])
+    if sub is None:
+        logger.info("Outbox: subscription %s no longer exists, skipping", op["subscription_id"])
+        return
+
+    pasarguard = panels.for_sub(sub)
+    await _sync(pasarguard, sub)
+    # Срок изменился — закэшированный конфиг подписки устарел
+    await invalidate_sub_cache(pasarguard.panel_id, sub.get("subscription_url"))
+
+
+async def _sync(pasarguard: PasarGuardClient, sub: dict) -> None:
+    username = sub["panel_username"]
+    expire_ts = int(sub["expires_at"].replace(tzinfo=timezone.utc).timestamp())
+
+    data = None
+    if PASARGUARD_WEBHOOK_SECRET:
+        data = await get_user_snapshot(pasarguard.panel_id, username, PANEL_SNAPSHOT_TRUST_SEC)
+    if data is not None:
+        try:
+            await _put(pasarguard, sub, data, expire_ts)
+            return
+        except aiohttp.ClientResponseError as exc:
+            if exc.status != 404:
+                raise
+            # Снимок устарел (пользователя удалили, а вебхук не дошёл) — спросим панель
+            await drop_user_snapshot(pasarguard.panel_id, username)
+
+    data = await pasarguard.get_user(username)
+    if data is None:
+        if not sub["is_active"]:
+            return  # неактивной подписке пользователь в панели не нужен
+        logger.warning("Outbox: '%s' missing in PasarGuard, creating", username)
+        created = await pasarguard.create_user(username, days=0, expire_ts=expire_ts)
+        await save_user_snapshot(pasarguard.panel_id, created)
+        return
+
+    await _put(pasarguard, sub, data, expire_ts)
+
+
+async def _put(pasarguard: PasarGuardClient, sub: dict, data: dict, expire_ts: int) -> None:
+    # Возврат после окончания подписки — заново выбираем наименее загруженную группу
+    group_ids = await pasarguard.regroup_if_returning(data) if sub["is_active"] else None
+    updated = await pasarguard.set_expire(
+        sub["panel_username"], expire_ts, data=data, group_ids=group_ids
+    )
+    await save_user_snapshot(pasarguard.panel_id, updated)
+
+
+# ── Воркер ────────────────────────────────────────────────────────────────────
+
+async def _complete(op: dict) -> bool:
+    # False — подписка изменилась во время синхронизации, задача выполнится ещё раз
+    return await complete_panel_op(op["id"], op["version"])
+
+
+async def _fail(op: dict, error: str, retry_in_sec: int | None) -> None:
+    await fail_panel_op(op["id"], error, retry_in_sec)
+
+
+_worker = QueueWorker(
+    name="Outbox",
+    channel=OUTBOX_CHANNEL,
+    poll_sec=OUTBOX_POLL_SEC,
+    claim=lambda: claim_panel_ops(OUTBOX_BATCH, _LEASE_SEC),
+    handle=_apply,
+    complete=_complete,
+    fail=_fail,
+    describe=lambda op: f"sync of sub {op['subscription_id']} ('{op['panel_username']}')",
+    concurrency=OUTBOX_CONCURRENCY,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+)
+
+
+async def drain_once() -> int:
+    """Обрабатывает одну пачку задач. Возвращает количество взятых задач."""
+    return await _worker.drain_once()
+
+
+async def start_outbox_worker() -> None:
+    """Запускает воркер. Вызывается при старте после create_pool()."""
+    await _worker.start()
+
+
+async def stop_outbox_worker() -> None:
+    await _worker.stop()
@@ -0,0 +1,59 @@
+"""
+services/panel_cache.py — снимки пользователей PasarGuard в Redis.
+
+Снимок — последний известный ответ панели по пользователю (GET/PUT/POST или вебхук).
+Обновляется вебхуком панели (webhooks/pasarguard.py) и воркером panel_outbox после
+каждой записи. Снимок хранит время сохранения: PUT полного пользователя из старого
+снимка затёр бы правки, сделанные в панели после него, поэтому читатель задаёт max_age_sec.
+
+Кэш — только оптимизация: при любой ошибке Redis функции ведут себя как «снимка нет».
+"""
+
+import json
+import logging
+import time
+from typing import Any
+
+from bot.config import PANEL_SNAPSHOT_TTL
+from bot.utils.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+def _key(panel_id: str, username: str) -> str:
+    return f"pg_user:{panel_id}:{username}"
+
+
+async def get_user_snapshot(
+    panel_id: str, username: str, max_age_sec: int
+) -> dict[str, Any] | None:
+    """Снимок пользователя, если он сохранён не раньше max_age_sec назад."""
+    try:
+        raw = await get_redis().get(_key(panel_id, username))
+    except Exception as exc:
+        logger.warning("Panel cache read error: %s", exc)
+        return None
+    if not raw:
+        return None
+    entry = json.loads(raw)
+    if "saved_at" not in entry or time.time() - entry["saved_at"] > max_age_sec:
+        return None  # старый формат без отметки времени или устаревший снимок
+    return entry["data"]
+
+
+async def save_user_snapshot(panel_id: str, data: dict[str, Any]) -> None:
+    try:
+        await get_redis().setex(
+            _key(panel_id, data["username"]),
+            PANEL_SNAPSHOT_TTL,
+            json.dumps({"saved_at": time.time(), "data": data}),
+        )
+    except Exception as exc:
+        logger.warning("Panel cache write error: %s", exc)
+
+
+async def drop_user_snapshot(panel_id: str, username: str) -> None:
+    try:
+        await get_redis().delete(_key(panel_id, username))
+    except Exception as exc:
+        logger.warning("Panel cache delete error: %s", exc)
@@ -3,26 +3,41 @@ services/pasarguard.py — клиент для работы с PasarGuard API.
 
 PasarGuard — форк Marzban с идентичным REST API.
 Все обращения к PasarGuard идут через этот модуль.
+
+Панелей может быть несколько (PASARGUARD_PANELS) — пользователи распределяются
+между ними consistent hashing'ом по user_id. Панель, назначенная пользователю,
+хранится в subscriptions.panel_id; все запросы по подписке идут в её панель:
+
+    client = panels.for_sub(sub)          # существующая подписка
+    panel_id = panels.assign(user_id)     # новая подписка
+
+Перенос пользователей между панелями — services/rebalance.py.
+Группа (набор нод) нового пользователя выбирается в services/placement.py.
 """
 
+import bisect
+import hashlib
 import logging
+import re
 from datetime import datetime, timedelta
-from typing import Any
+from typing import Any, AsyncIterator
 
 import aiohttp
 
 from bot.config import (
-    PASARGUARD_URL,
-    PASARGUARD_USERNAME,
-    PASARGUARD_PASSWORD,
     PASARGUARD_INBOUND_TAG,
     PASARGUARD_FLOW,
+    PASARGUARD_PANEL_SETTINGS,
+    PASARGUARD_DRAINING,
+    PASARGUARD_GROUP_IDS,
 )
+from bot.services.placement import pick_groups
 
 logger = logging.getLogger(__name__)
 
-_TOKEN: str | None = None
-_TOKEN_EXPIRES: datetime = datetime.min
+# Виртуальных узлов на панель в кольце — чем больше, тем ровнее распределение
+_RING_VNODES = 160
+_PANEL_ID_RE = re.compile(r"[a-z0-9_]+")
 
 
 
@@ -46,17 +61,57 @@ def _parse_expire(value) -> int:
                 continue
     return int(float(s))
 
+def _modify_payload(
+    data: dict[str, Any], expire_ts: int, group_ids: list[int] | None = None
+) -> dict[str, Any]:
+    """
+    Тело PUT /api/user/{username}: новый срок, остальные поля пользователя — как были.
+    group_ids — переназначить группу (реактивация); None — оставить текущую.
+    """
+    # Явно проверяем наличие ключа "vless" — пустой dict ({}) truthy,
+    # поэтому `data.get(...) or fallback` не работает.
+    existing_proxies = data.get("proxies") or {}
+    existing_inbounds = data.get("inbounds") or {}
+
+    proxies = (
+        existing_proxies
+        if existing_proxies.get("vless")
+        else {"vless": {"flow": PASARGUARD_FLOW}}
+    )
+    inbounds = (
+        existing_inbounds
+        if existing_inbounds.get("vless")
+        else {"vless": [PASARGUARD_INBOUND_TAG]}
+    )
+
+    return {
+        "proxies": proxies,
+        "inbounds": inbounds,
+        "expire": expire_ts,
+        "data_limit": data.get("data_limit", 0),
+        "data_limit_reset_strategy": data.get("data_limit_reset_strategy", "no_reset"),
+        "status": "active",
+        "group_ids": group_ids or data.get("group_ids") or PASARGUARD_GROUP_IDS[:1],
+    }
+
+
 class PasarGuardClient:
-    """Тонкий клиент к PasarGuard REST API с автообновлением токена."""
+    """Тонкий клиент к одной панели PasarGuard с автообновлением токена."""
 
-    def __init__(self) -> None:
+    def __init__(self, panel_id: str, url: str, username: str, password: str) -> None:
+        self.panel_id = panel_id
+        self.url = url
+        self._username = username
+        self._password = password
         self._session: aiohttp.ClientSession | None = None
+        self._token: str | None = None
+        self._token_expires: datetime = datetime.min
 
     # ── Сессия ────────────────────────────────────────────────────────────────
 
     def _get_session(self) -> aiohttp.ClientSession:
         if self._session is None or self._session.closed:
-            self._session = aiohttp.ClientSession(base_url=PASARGUARD_URL)
+            self._session = aiohttp.ClientSession(base_url=self.url)
         return self._session
 
     async def close(self) -> None:
@@ -66,21 +121,20 @@ class PasarGuardClient:
     # ── Авторизация ───────────────────────────────────────────────────────────
 
     async def _get_token(self) -> str:
-        global _TOKEN, _TOKEN_EXPIRES
-        if _TOKEN and datetime.utcnow() < _TOKEN_EXPIRES:
-            return _TOKEN
+        if self._token and datetime.utcnow() < self._token_expires:
+            return self._token
 
         session = self._get_session()
         async with session.post(
             "/api/admin/token",
-            data={"username": PASARGUARD_USERNAME, "password": PASARGUARD_PASSWORD},
+            data={"username": self._username, "password": self._password},
         ) as resp:
             resp.raise_for_status()
             data = await resp.json()
 
-        _TOKEN = data["access_token"]
-        _TOKEN_EXPIRES = datetime.utcnow() + timedelta(minutes=50)
-        return _TOKEN
+        self._token = data["access_token"]
+        self._token_expires = datetime.utcnow() + timedelta(minutes=50)
+        return self._token
 
     async def _headers(self) -> dict[str, str]:
         token = await self._get_token()
@@ -108,12 +162,67 @@ class PasarGuardClient:
                 resp.raise_for_status()
             return await resp.json()
 
-    async def create_user(self, username: str, days: int) -> dict[str, Any]:
+    async def get_groups(self) -> list[dict[str, Any]]:
+        """Группы панели с нагрузкой (total_users) — для выбора группы новому пользователю."""
+        session = self._get_session()
+        async with session.get("/api/groups", headers=await self._headers()) as resp:
+            if not resp.ok:
+                body = await resp.text()
+                logger.error("PasarGuard: GET /api/groups returned %d: %s", resp.status, body)
+                resp.raise_for_status()
+            data = await resp.json()
+        return data.get("groups") or []
+
+    async def iter_users(self, page_size: int = 500) -> AsyncIterator[list[dict[str, Any]]]:
+        """
+        Постранично выдаёт пользователей панели, отсортированных по username.
+        В памяти держится только одна страница — подходит для обхода всей панели.
+
+        API панели умеет только offset/limit, поэтому при создании пользователей
+        во время обхода страницы могут сдвинуться (дубли/пропуски на границе).
+        """
+        session = self._get_session()
+        offset = 0
+        while True:
+            async with session.get(
+                "/api/users",
+                params={"offset": offset, "limit": page_size, "sort": "username"},
+                headers=await self._headers(),
+            ) as resp:
+                if not resp.ok:
+                    body = await resp.text()
+                    logger.error(
+                        "PasarGuard: GET /api/users (offset=%d) returned %d: %s",
+                        offset, resp.status, body,
+                    )
+                    resp.raise_for_status()
+                data = await resp.json()
+
+            users = data.get("users") or []
+            if not users:
+                return
+            yield users
+            if len(users) < page_size:
+                return
+            offset += len(users)
+
+    async def create_user(
+        self,
+        username: str,
+        days: int,
+        expire_ts: int | None = None,
+        group_ids: list[int] | None = None,
+    ) -> dict[str, Any]:
         """
         Создаёт пользователя в PasarGuard и возвращает данные.
+        expire_ts (если задан) имеет приоритет над days.
+        group_ids не задан — группа выбирается services/placement.py.
         Если пользователь уже существует (409) — бросает ValueError.
         """
-        expire_ts = int((datetime.utcnow() + timedelta(days=days)).timestamp())
+        if expire_ts is None:
+            expire_ts = int((datetime.utcnow() + timedelta(days=days)).timestamp())
+        if group_ids is None:
+            group_ids = await pick_groups(self)
         payload = {
             "username": username,
             "proxies": {"vless": {"flow": PASARGUARD_FLOW}},
@@ -122,7 +231,7 @@ class PasarGuardClient:
             "data_limit": 0,
             "data_limit_reset_strategy": "no_reset",
             "status": "active",
-            "group_ids": [1],  # Группа "ALL" — даёт доступ ко всем серверам
+            "group_ids": group_ids,
         }
         session = self._get_session()
         async with session.post(
@@ -138,68 +247,106 @@ class PasarGuardClient:
                 )
                 resp.raise_for_status()
             data = await resp.json()
-            logger.info("PasarGuard: created user '%s' for %d days", username, days)
+            logger.info(
+                "PasarGuard: created user '%s' for %d days in groups %s", username, days, group_ids
+            )
             return data
 
-    async def ensure_user(self, username: str, days: int) -> None:
+    async def provision_user(self, username: str, days: int) -> tuple[str, int]:
         """
-        Создаёт пользователя если не существует, продлевает если уже есть.
-        Стратегия GET-first: проверяем наличие через GET перед созданием,
-        чтобы не зависеть от конкретного HTTP-кода ошибки дубликата
-        (PasarGuard может вернуть 400/409/422).
+        Выдаёт пользователю days дней и возвращает (subscription_url, expire_ts).
+
+        Обычный случай (пользователя нет) — ОДИН запрос: POST /api/user,
+        ссылка и срок берутся прямо из ответа на создание.
+        Если пользователь уже есть (409, а также 400/422 — PasarGuard отвечает
+        на дубликат по-разному) — GET + продление PUT, данные берутся из ответа PUT.
         """
-        data = await self.get_user(username)
-        if data is not None:
+        try:
+            data = await self.create_user(username, days=days)
+        except ValueError:
+            data = None  # 409 — точно дубликат
+        except aiohttp.ClientResponseError as exc:
+            if exc.status not in (400, 422):
+                raise
+            data = None  # возможно дубликат — проверим через GET
+
+        if data is None:
+            existing = await self.get_user(username)
+            if existing is None:
+                raise RuntimeError(f"PasarGuard refused to create '{username}'")
             logger.info("PasarGuard: user '%s' exists, extending by %d days", username, days)
-            await self.extend_user(username, days)
-        else:
-            await self.create_user(username, days=days)
+            data = await self.extend_user(
+                username, days, data=existing, group_ids=await self.regroup_if_returning(existing)
+            )
 
-    async def extend_user(self, username: str, additional_days: int) -> None:
+        return self.subscription_url_from(data), _parse_expire(data.get("expire"))
+
+    async def regroup_if_returning(self, data: dict[str, Any]) -> list[int] | None:
+        """
+        Новая группа для пользователя, который возвращается после окончания подписки
+        (в панели он не active или без группы). Для активного — None: группу не трогаем,
+        чтобы не перекидывать клиента между нодами при каждом продлении.
+        """
+        if data.get("status") == "active" and data.get("group_ids"):
+            return None
+        return await pick_groups(self)
+
+    async def extend_user(
+        self,
+        username: str,
+        additional_days: int,
+        data: dict[str, Any] | None = None,
+        group_ids: list[int] | None = None,
+    ) -> dict[str, Any]:
         """
         Продлевает подписку пользователя на additional_days дней.
+        Возвращает данные пользователя из ответа панели.
 
+        data — уже полученные данные пользователя (чтобы не делать лишний GET).
         Если пользователь не найден — создаёт его (fallback при рассинхроне DB/панели).
-        
         """
-        data = await self.get_user(username)
+        if data is None:
+            data = await self.get_user(username)
         if data is None:
             logger.warning(
                 "PasarGuard: user '%s' not found during extend, creating instead", username
             )
-            await self.create_user(username, days=additional_days)
-            return
+            return await self.create_user(username, days=additional_days)
 
         current_expire = _parse_expire(data.get("expire"))
         new_expire = max(current_expire, int(datetime.utcnow().timestamp()))
         new_expire += additional_days * 86400
 
-        # Явно проверяем наличие ключа "vless" — пустой dict ({}) truthy,
-        # поэтому `data.get(...) or fallback` не работает.
-        existing_proxies = data.get("proxies") or {}
-        existing_inbounds = data.get("inbounds") or {}
-
-        proxies = (
-            existing_proxies
-            if existing_proxies.get("vless")
-            else {"vless": {"flow": PASARGUARD_FLOW}}
-        )
-        inbounds = (
-            existing_inbounds
-            if existing_inbounds.get("vless")
-            else {"vless": [PASARGUARD_INBOUND_TAG]}
+        updated = await self._put_user(username, _modify_payload(data, new_expire, group_ids))
+        logger.info(
+            "PasarGuard: extended user '%s' by %d days (new expire ts: %d)",
+            username, additional_days, new_expire,
         )
+        return updated
+
+    async def set_expire(
+        self,
+        username: str,
+        expire_ts: int,
+        data: dict[str, Any] | None = None,
+        group_ids: list[int] | None = None,
+    ) -> dict[str, Any]:
+        """
+        Устанавливает точную дату истечения (Unix timestamp) существующему пользователю.
+        Остальные поля (proxies, inbounds, лимиты, группа) сохраняются как есть,
+        если group_ids не задан явно.
+        data — уже полученные данные пользователя (чтобы не делать лишний GET).
+        """
+        if data is None:
+            data = await self.get_user(username)
+        if data is None:
+            raise ValueError(f"User '{username}' not found in PasarGuard")
 
-        payload = {
-            "proxies": proxies,
-            "inbounds": inbounds,
-            "expire": new_expire,
-            "data_limit": data.get("data_limit", 0),
-            "data_limit_reset_strategy": data.get("data_limit_reset_strategy", "no_reset"),
-            "status": "active",
-            "group_ids": [1],
-        }
+        updated = await self._put_user(username, _modify_payload(data, expire_ts, group_ids))
+        logger.info("PasarGuard: set expire for '%s' to %d", username, expire_ts)
+        return updated
 
+    async def _put_user(self, username: str, payload: dict[str, Any]) -> dict[str, Any]:
         session = self._get_session()
         async with session.put(
             f"/api/user/{username}",
@@ -213,27 +360,46 @@ class PasarGuardClient:
                     username, resp.status, body,
                 )
                 resp.raise_for_status()
-            logger.info(
-                "PasarGuard: extended user '%s' by %d days (new expire ts: %d)",
-                username, additional_days, new_expire,
+            return await resp.json()
+
+    def subscription_url_from(self, data: dict[str, Any]) -> str:
+        """
+        Достаёт полную ссылку подписки из данных пользователя.
+        Если панель вернула относительный путь — добавляем базовый URL.
+        Если url пустой — бросает ValueError.
+        """
+        path = data.get("subscription_url") or ""
+        if not path:
+            raise ValueError(
+                f"PasarGuard returned empty subscription_url for '{data.get('username')}'"
             )
+        if path.startswith("/"):
+            return f"{self.url.rstrip('/')}{path}"
+        return path
+
+    async def fetch_subscription(
+        self, path: str, user_agent: str, query: str = ""
+    ) -> tuple[int, dict[str, str], bytes]:
+        """
+        Содержимое подписки (публичный эндпоинт панели, без токена админа).
+        Возвращает (статус, заголовки, тело) как есть — формат зависит от User-Agent.
+        """
+        session = self._get_session()
+        async with session.get(
+            f"{path}?{query}" if query else path,
+            headers={"User-Agent": user_agent},
+        ) as resp:
+            return resp.status, dict(resp.headers), await resp.read()
 
     async def get_subscription_url(self, username: str) -> str:
         """
         Возвращает полную ссылку подписки из PasarGuard API.
-        Если панель вернула относительный путь — добавляем базовый URL.
         Если пользователь не найден или url пустой — бросает ValueError.
         """
         data = await self.get_user(username)
         if data is None:
             raise ValueError(f"User '{username}' not found in PasarGuard")
-
-        path = data.get("subscription_url") or ""
-        if not path:
-            raise ValueError(f"PasarGuard returned empty subscription_url for '{username}'")
-        if path.startswith("/"):
-            return f"{PASARGUARD_URL.rstrip('/')}{path}"
-        return path
+        return self.subscription_url_from(data)
 
     async def delete_user(self, username: str) -> None:
         """Удаляет пользователя из PasarGuard."""
@@ -245,5 +411,76 @@ class PasarGuardClient:
                 resp.raise_for_status()
 
 
-# Глобальный экземпляр — используется во всём проекте
-pasarguard = PasarGuardClient()
+
+# ── Несколько панелей ─────────────────────────────────────────────────────────
+
+def _ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class PanelRegistry:
+    """
+    Набор панелей и распределение пользователей между ними.
+
+    assign() — consistent hashing: при добавлении панели к ней переезжает
+    только ~1/N пользователей, остальные назначения не меняются.
+    Назначение сохраняется в БД при создании подписки, поэтому смена
+    конфигурации не переносит существующих пользователей сама по себе —
+    для этого есть services/rebalance.py.
+    """
+
+    def __init__(self, settings: dict[str, dict[str, str]], draining: list[str]) -> None:
+        for panel_id in settings:
+            if not _PANEL_ID_RE.fullmatch(panel_id):
+                raise ValueError(f"Invalid PasarGuard panel id '{panel_id}' (use [a-z0-9_])")
+        unknown = set(draining) - set(settings)
+        if unknown:
+            raise ValueError(f"PASARGUARD_DRAINING lists unknown panels: {sorted(unknown)}")
+
+        self._clients = {
+            panel_id: PasarGuardClient(panel_id, **params)
+            for panel_id, params in settings.items()
+        }
+        self.default_id = next(iter(settings))
+
+        open_ids = [p for p in settings if p not in draining]
+        if not open_ids:
+            raise ValueError("All PasarGuard panels are draining — nowhere to place new users")
+        ring = sorted(
+            (_ring_hash(f"{panel_id}#{i}"), panel_id)
+            for panel_id in open_ids
+            for i in range(_RING_VNODES)
+        )
+        self._ring_keys = [h for h, _ in ring]
+        self._ring_ids = [p for _, p in ring]
+
+    def __iter__(self):
+        return iter(self._clients.values())
+
+    def get(self, panel_id: str | None) -> PasarGuardClient:
+        """Клиент панели по id; None — панель по умолчанию (старые записи без panel_id)."""
+        if panel_id is None:
+            panel_id = self.default_id
+        try:
+            return self._clients[panel_id]
+        except KeyError:
+            raise ValueError(
+                f"Unknown PasarGuard panel '{panel_id}' — not listed in PASARGUARD_PANELS"
+            ) from None
+
+    def for_sub(self, sub: dict) -> PasarGuardClient:
+        """Клиент панели, на которой живёт пользователь подписки."""
+        return self.get(sub.get("panel_id"))
+
+    def assign(self, user_id: int) -> str:
+        """Панель для нового пользователя (детерминированно по user_id)."""
+        i = bisect.bisect(self._ring_keys, _ring_hash(str(user_id))) % len(self._ring_keys)
+        return self._ring_ids[i]
+
+    async def close(self) -> None:
+        for client in self._clients.values():
+            await client.close()
+
+
+# Глобальный реестр — используется во всём проекте
+panels = PanelRegistry(PASARGUARD_PANEL_SETTINGS, PASARGUARD_DRAINING)
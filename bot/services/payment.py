@@ -1,28 +1,98 @@
 """
 services/payment.py — работа с ЮKassa.
 
-Создаёт платёжные ссылки и обрабатывает автосписания.
+Создаёт платёжные ссылки, выдаёт подписку по успешному платежу
+и обрабатывает автосписания.
+
+Открытая ссылка на оплату (сценарии с редиректом) кэшируется в Redis под
+paylink:{user_id} на PAYLINK_TTL_SEC — повторное нажатие «Купить» отдаёт её сразу,
+без нового платежа в ЮKassa и новой строки в payments.
 """
 
+import json
 import logging
 import uuid
 from typing import Any
 
-from yookassa import Configuration, Payment as YkPayment
-
-from bot.config import YUKASSA_SHOP_ID, YUKASSA_SECRET_KEY, PLAN_PRICE, PLAN_NAME, WEBHOOK_HOST
-from bot.database.payments import create_payment, update_payment_status, link_payment_to_subscription
-from bot.database.subscriptions import extend_subscription
-from bot.services.pasarguard import pasarguard
+from bot.config import PAYLINK_TTL_SEC, PLAN_DAYS, PLAN_PRICE, PLAN_NAME, WEBHOOK_HOST
+from bot.database.payments import (
+    PaymentAlreadyGranted,
+    create_payment,
+    get_payment_by_yukassa_id,
+    get_ungranted_payment,
+    update_payment_status,
+)
+from bot.database.subscriptions import save_payment_method
+from bot.services.subscription import create_paid_subscription
+from bot.services.tg_sender import Priority, send_priority
+from bot.services.yukassa import yukassa
+from bot.utils.locks import user_lock
+from bot.utils.redis import get_redis
 
 logger = logging.getLogger(__name__)
 
-Configuration.account_id = YUKASSA_SHOP_ID
-Configuration.secret_key = YUKASSA_SECRET_KEY
-
 RETURN_URL = f"{WEBHOOK_HOST}/payment/success"
 
 
+# ── Кэш открытой ссылки на оплату ────────────────────────────────────────────
+
+def _paylink_key(user_id: int) -> str:
+    return f"paylink:{user_id}"
+
+
+async def get_open_payment_link(user_id: int) -> tuple[str, str] | None:
+    """
+    (payment_id, confirmation_url) ещё не оплаченной ссылки пользователя или None.
+    Платёж, который уже завершился (оплачен/отменён), из кэша удаляется.
+    Любая ошибка (Redis, битый кэш, БД) — None: кэш лишь ускоряет, вызывающий создаст новую ссылку.
+    """
+    try:
+        raw = await get_redis().get(_paylink_key(user_id))
+        if raw is None:
+            return None
+        cached = json.loads(raw)
+        payment_id, url = cached["payment_id"], cached["url"]
+        payment = await get_payment_by_yukassa_id(payment_id)
+    except Exception as exc:
+        logger.warning("Paylink cache read failed for %s: %s", user_id, exc)
+        await drop_payment_link(user_id)
+        return None
+
+    if payment is None or payment["status"] != "pending":
+        await drop_payment_link(user_id)
+        return None
+    return payment_id, url
+
+
+async def _cache_payment_link(user_id: int, payment_id: str, url: str) -> None:
+    try:
+        await get_redis().set(
+            _paylink_key(user_id),
+            json.dumps({"payment_id": payment_id, "url": url}),
+            ex=PAYLINK_TTL_SEC,
+        )
+    except Exception as exc:
+        logger.warning("Paylink cache write failed for %s: %s", user_id, exc)
+
+
+async def drop_payment_link(user_id: int) -> None:
+    try:
+        await get_redis().delete(_paylink_key(user_id))
+    except Exception as exc:
+        logger.warning("Paylink cache drop failed for %s: %s", user_id, exc)
+
+
+async def save_card(user_id: int, subscription_id: int, method_id: str) -> None:
+    """
+    Сохраняет платёжный метод для автопродления и сбрасывает кэш ссылки:
+    с сохранённой картой «Купить» идёт по сценарию прямого списания, а не по старой ссылке.
+    """
+    await save_payment_method(subscription_id, method_id)
+    await drop_payment_link(user_id)
+
+
+# ── Создание платежей ─────────────────────────────────────────────────────────
+
 async def create_payment_link(user_id: int) -> tuple[str, str | None]:
     """
     Создаёт платёж в ЮKassa.
@@ -46,7 +116,7 @@ async def create_payment_link(user_id: int) -> tuple[str, str | None]:
 
     if saved_method_id:
         # ── Сценарий 1: прямое списание через сохранённый СБП-метод ──────────
-        payment = YkPayment.create(
+        payment = await yukassa.create_payment(
             {
                 "amount": {"value": f"{PLAN_PRICE}.00", "currency": "RUB"},
                 "capture": True,
@@ -56,8 +126,8 @@ async def create_payment_link(user_id: int) -> tuple[str, str | None]:
             },
             idempotency_key,
         )
-        await create_payment(user_id, payment.id)
-        return payment.id, None
+        await create_payment(user_id, payment["id"])
+        return payment["id"], None
 
     elif existing_sub:
         # ── Сценарий 2: продление без привязки ───────────────────────────────
@@ -65,7 +135,7 @@ async def create_payment_link(user_id: int) -> tuple[str, str | None]:
         # (вебхук не пришёл вовремя / банк не поддерживал автоплатёж).
         # Делаем обычный СБП-платёж БЕЗ save_payment_method, чтобы ЮКасса
         # не жаловалась на «счёт уже привязан».
-        payment = YkPayment.create(
+        payment = await yukassa.create_payment(
             {
                 "amount": {"value": f"{PLAN_PRICE}.00", "currency": "RUB"},
                 "payment_method_data": {"type": "sbp"},
@@ -80,12 +150,14 @@ async def create_payment_link(user_id: int) -> tuple[str, str | None]:
             },
             idempotency_key,
         )
-        await create_payment(user_id, payment.id)
-        return payment.id, payment.confirmation.confirmation_url
+        await create_payment(user_id, payment["id"])
+        url = payment["confirmation"]["confirmation_url"]
+        await _cache_payment_link(user_id, payment["id"], url)
+        return payment["id"], url
 
     else:
         # ── Сценарий 3: первая оплата — редирект + сохраняем метод ───────────
-        payment = YkPayment.create(
+        payment = await yukassa.create_payment(
             {
                 "amount": {"value": f"{PLAN_PRICE}.00", "currency": "RUB"},
                 "payment_method_data": {"type": "sbp"},
@@ -100,47 +172,85 @@ async def create_payment_link(user_id: int) -> tuple[str, str | None]:
             },
             idempotency_key,
         )
-        await create_payment(user_id, payment.id)
-        return payment.id, payment.confirmation.confirmation_url
+        await create_payment(user_id, payment["id"])
+        url = payment["confirmation"]["confirmation_url"]
+        await _cache_payment_link(user_id, payment["id"], url)
+        return payment["id"], url
 
 
-async def charge_auto_renew(sub: dict[str, Any], bot: Any) -> bool:
+async def process_succeeded_payment(
+    yukassa_payment_id: str, payment_method_id: str | None = None
+) -> str | None:
     """
-    Списывает оплату за автопродление.
-    Возвращает True при успехе.
+    Выдаёт подписку по успешному платежу — общая точка для вебхука ЮKassa,
+    «Проверить оплату» и автопродления. Возвращает ссылку подписки или None,
+    если подписку по платежу уже выдали.
+
+    Продление подписки, статус succeeded и отметка granted_at фиксируются одной
+    транзакцией (mark_payment_granted): падение посреди выдачи ничего не записывает,
+    и платёж остаётся «не выданным» — его доведёт повтор события или досверка
+    (services/payment_sweeper.py). Изменение подписки идёт под блокировкой пользователя
+    в Redis — одновременные платежи и начисления админом не продлят подписку дважды.
     """
-    if not sub.get("yukassa_payment_method_id"):
-        return False
+    payment = await get_ungranted_payment(yukassa_payment_id)
+    if payment is None:
+        return None
 
+    user_id = payment["user_id"]
+    await drop_payment_link(user_id)
     try:
-        idempotency_key = str(uuid.uuid4())
-        payment = YkPayment.create(
-            {
-                "amount": {"value": f"{PLAN_PRICE}.00", "currency": "RUB"},
-                "capture": True,
-                "payment_method_id": sub["yukassa_payment_method_id"],
-                "description": f"Автопродление VPN — sub {sub['id']}",
-                "metadata": {"user_id": str(sub["user_id"]), "sub_id": str(sub["id"])},
-            },
-            idempotency_key,
-        )
+        async with user_lock(user_id):
+            return await create_paid_subscription(
+                user_id, payment_method_id=payment_method_id, grant_payment=yukassa_payment_id
+            )
+    except PaymentAlreadyGranted:
+        return None  # выдал параллельный обработчик (другая реплика)
 
-        if payment.status == "succeeded":
-            await update_payment_status(payment.id, "succeeded")
-            await extend_subscription(sub["id"])
-            await pasarguard.extend_user(sub["panel_username"], 30)
 
-            try:
-                await bot.send_message(
-                    sub["user_id"],
-                    "✅ Подписка автоматически продлена на 30 дней.",
-                )
-            except Exception:
-                pass
+def renewal_idempotency_key(sub: dict[str, Any]) -> str:
+    """Ключ списания за период: одна подписка + один expires_at = один платёж в ЮKassa."""
+    return f"renew-{sub['id']}-{sub['expires_at']:%Y%m%d%H%M}"
 
-            return True
 
-    except Exception as exc:
-        logger.error("Auto-renew payment failed for sub %s: %s", sub["id"], exc)
+async def charge_auto_renew(sub: dict[str, Any], bot: Any) -> str:
+    """
+    Списывает оплату за автопродление через сохранённый метод.
+    Возвращает итог: 'succeeded', 'pending' (СБП-банк ещё подтверждает — это не отказ,
+    платёж доведёт вебхук) или 'canceled'. Ошибки API пробрасываются.
+
+    Ключ идемпотентности выводится из подписки и оплачиваемого периода, поэтому
+    повтор после падения посреди прогона вернёт тот же платёж, а не спишет деньги второй раз.
+    """
+    payment = await yukassa.create_payment(
+        {
+            "amount": {"value": f"{PLAN_PRICE}.00", "currency": "RUB"},
+            "capture": True,
+            "payment_method_id": sub["yukassa_payment_method_id"],
+            "description": f"Автопродление VPN — sub {sub['id']}",
+            "metadata": {"user_id": str(sub["user_id"]), "sub_id": str(sub["id"])},
+        },
+        renewal_idempotency_key(sub),
+    )
+    # Запись нужна вебхуку: pending-платёж он доведёт сам
+    await create_payment(sub["user_id"], payment["id"], subscription_id=sub["id"])
+
+    if payment["status"] == "succeeded":
+        url = await process_succeeded_payment(
+            payment["id"], payment_method_id=sub["yukassa_payment_method_id"]
+        )
+        if url is not None:
+            try:
+                with send_priority(Priority.TRANSACTIONAL):
+                    await bot.send_message(
+                        sub["user_id"],
+                        f"✅ Подписка автоматически продлена на {PLAN_DAYS} дней.",
+                    )
+            except Exception as exc:
+                logger.warning("Auto-renew notice not delivered to user %s: %s", sub["user_id"], exc)
+        return "succeeded"
+
+    if payment["status"] == "canceled":
+        await update_payment_status(payment["id"], "canceled")
+        return "canceled"
 
-    return False
+    return "pending"
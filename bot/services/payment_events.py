@@ -0,0 +1,68 @@
+"""
+services/payment_events.py — уведомление о результате платежа через Redis pub/sub.
+
+Вебхук ЮKassa после обработки платежа публикует его итоговый статус в канал
+payment:{yukassa_payment_id}. Кнопка «Проверить оплату» подписывается на этот канал
+и получает результат сразу, как только придёт вебхук, — без опроса API ЮKassa.
+"""
+
+import asyncio
+import logging
+
+from bot.database.payments import get_payment_by_yukassa_id
+from bot.utils.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Итоговые статусы — после них платёж уже не меняется
+FINAL_STATUSES = ("succeeded", "canceled")
+
+
+def _channel(payment_id: str) -> str:
+    return f"payment:{payment_id}"
+
+
+async def publish_payment_status(payment_id: str, status: str) -> None:
+    """Сообщает ожидающим проверкам итоговый статус платежа."""
+    try:
+        await get_redis().publish(_channel(payment_id), status)
+    except Exception as exc:
+        logger.warning("Payment event publish failed for %s: %s", payment_id, exc)
+
+
+async def wait_payment_status(payment_id: str, timeout: float) -> str | None:
+    """
+    Ждёт итоговый статус платежа до timeout секунд.
+    Возвращает 'succeeded' / 'canceled' или None, если вебхук за это время не пришёл.
+
+    Сначала подписываемся, потом смотрим статус в БД — так не теряется событие,
+    опубликованное между проверкой и подпиской.
+    """
+    try:
+        pubsub = get_redis().pubsub()
+        await pubsub.subscribe(_channel(payment_id))
+    except Exception as exc:
+        logger.warning("Payment event subscribe failed for %s: %s", payment_id, exc)
+        return None
+
+    try:
+        payment = await get_payment_by_yukassa_id(payment_id)
+        if payment and payment["status"] in FINAL_STATUSES:
+            return payment["status"]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (remaining := deadline - loop.time()) > 0:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+            if message is not None:
+                return message["data"].decode()
+        return None
+    except Exception as exc:
+        logger.warning("Payment event wait failed for %s: %s", payment_id, exc)
+        return None
+    finally:
+        try:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+        except Exception:
+            pass
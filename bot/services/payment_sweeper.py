@@ -0,0 +1,75 @@
+"""
+services/payment_sweeper.py — досверка зависших платежей с ЮKassa.
+
+Если вебхук потерялся, а пользователь не нажал «Проверить оплату», платёж остаётся
+pending, хотя деньги списаны. Если обработчик упал посреди выдачи, платёж succeeded,
+но подписка не выдана (granted_at пуст). Раз в PAYMENT_SWEEP_MIN минут берём такие платежи
+из окна [PAYMENT_SWEEP_WINDOW_HOURS назад; PAYMENT_SWEEP_MIN_AGE_SEC назад], спрашиваем
+их статус у ЮKassa (не больше PAYMENT_SWEEP_CONCURRENCY запросов одновременно и
+PAYMENT_SWEEP_LIMIT за прогон) и завершённые ставим (или возвращаем) в yukassa_events —
+дальше их обрабатывает тот же воркер, что и вебхуки (services/yukassa_events.py), идемпотентно.
+"""
+
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+
+from bot.config import (
+    PAYMENT_SWEEP_CONCURRENCY,
+    PAYMENT_SWEEP_LIMIT,
+    PAYMENT_SWEEP_MIN_AGE_SEC,
+    PAYMENT_SWEEP_WINDOW_HOURS,
+)
+from bot.database.payments import get_unsettled_payments
+from bot.database.yukassa_events import save_yukassa_event
+from bot.services.job_runs import record_item
+from bot.services.yukassa import yukassa
+
+logger = logging.getLogger(__name__)
+
+_FINAL_STATUSES = ("succeeded", "canceled")
+
+
+async def _sweep_one(payment_id: str, stats: Counter, sem: asyncio.Semaphore) -> None:
+    async with sem:
+        started = time.monotonic()
+        try:
+            payment = await yukassa.get_payment(payment_id)
+        except Exception as exc:
+            record_item(time.monotonic() - started, ok=False)
+            stats["errors"] += 1
+            logger.warning("Payment sweep: lookup of %s failed: %s", payment_id, exc)
+            return
+        record_item(time.monotonic() - started)
+
+    status = payment.get("status")
+    if status not in _FINAL_STATUSES:
+        stats["still_pending"] += 1
+        return
+
+    # То же уведомление, что прислал бы вебхук. Уже обработанное событие возвращается
+    # в очередь: раз платёж здесь, прошлая обработка его не довела.
+    event_type = f"payment.{status}"
+    payload = {"event": event_type, "object": payment}
+    if await save_yukassa_event(payment_id, event_type, payload, requeue=True):
+        stats[status] += 1
+        logger.warning("Payment sweep: %s is %s but no webhook was processed", payment_id, status)
+    else:
+        stats["already_queued"] += 1
+
+
+async def sweep_pending_payments() -> Counter:
+    """Один прогон досверки. Возвращает счётчики по итогам."""
+    payment_ids = await get_unsettled_payments(
+        older_than=timedelta(seconds=PAYMENT_SWEEP_MIN_AGE_SEC),
+        newer_than=timedelta(hours=PAYMENT_SWEEP_WINDOW_HOURS),
+        limit=PAYMENT_SWEEP_LIMIT,
+    )
+    stats: Counter = Counter(checked=len(payment_ids))
+    if payment_ids:
+        sem = asyncio.Semaphore(PAYMENT_SWEEP_CONCURRENCY)
+        await asyncio.gather(*(_sweep_one(pid, stats, sem) for pid in payment_ids))
+        logger.info("Payment sweep: %s", dict(stats))
+    return stats
@@ -0,0 +1,104 @@
+"""
+services/placement.py — выбор группы PasarGuard для нового или вернувшегося пользователя.
+
+Раньше все получали group_ids=[1] («ALL») — каждый клиент видел все ноды и самая
+популярная перегружалась. Теперь группа выбирается при создании пользователя
+в панели и при реактивации истёкшей подписки; при обычном продлении группа не меняется.
+
+Стратегии (PLACEMENT_STRATEGY):
+  • static       — всегда первая группа из PASARGUARD_GROUP_IDS;
+  • least_loaded — группа с наименьшим total_users из GET /api/groups.
+    Нагрузка кэшируется на PLACEMENT_CACHE_SEC для каждой панели; между обновлениями
+    выданные места учитываются локально, чтобы всплеск регистраций не ушёл в одну группу.
+    Если панель не отдала группы — используется первая группа (создание не блокируется).
+
+Стратегию можно подменить через set_placer() — например, для прогона
+против tools/pasarguard_stub.py с --groups.
+"""
+
+import logging
+import time
+from typing import TYPE_CHECKING
+
+from bot.config import PASARGUARD_GROUP_IDS, PLACEMENT_STRATEGY, PLACEMENT_CACHE_SEC
+
+if TYPE_CHECKING:
+    from bot.services.pasarguard import PasarGuardClient
+
+logger = logging.getLogger(__name__)
+
+
+class StaticPlacer:
+    """Всегда одна и та же группа."""
+
+    def __init__(self, group_ids: list[int]) -> None:
+        self.group_ids = group_ids
+
+    async def pick(self, client: "PasarGuardClient") -> list[int]:
+        return [self.group_ids[0]]
+
+
+class LeastLoadedPlacer:
+    """Наименее загруженная группа по данным панели (с кэшем)."""
+
+    def __init__(self, group_ids: list[int], cache_sec: int) -> None:
+        self.group_ids = group_ids
+        self.cache_sec = cache_sec
+        # panel_id → (когда обновлять, {group_id: total_users})
+        self._load: dict[str, tuple[float, dict[int, int]]] = {}
+
+    async def _get_load(self, client: "PasarGuardClient") -> dict[int, int] | None:
+        cached = self._load.get(client.panel_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        try:
+            groups = await client.get_groups()
+        except Exception as exc:
+            logger.warning("Placement: groups of '%s' unavailable: %s", client.panel_id, exc)
+            return cached[1] if cached else None
+
+        load = {
+            g["id"]: g.get("total_users") or 0
+            for g in groups
+            if g["id"] in self.group_ids and not g.get("is_disabled")
+        }
+        if not load:
+            logger.warning(
+                "Placement: none of groups %s are enabled on '%s'", self.group_ids, client.panel_id
+            )
+            return None
+        self._load[client.panel_id] = (time.monotonic() + self.cache_sec, load)
+        return load
+
+    async def pick(self, client: "PasarGuardClient") -> list[int]:
+        if len(self.group_ids) == 1:
+            return list(self.group_ids)
+        load = await self._get_load(client)
+        if not load:
+            return [self.group_ids[0]]
+        group_id = min(load, key=load.__getitem__)
+        load[group_id] += 1  # учитываем выданное место до следующего обновления
+        return [group_id]
+
+
+def _build_placer():
+    if PLACEMENT_STRATEGY == "static":
+        return StaticPlacer(PASARGUARD_GROUP_IDS)
+    if PLACEMENT_STRATEGY == "least_loaded":
+        return LeastLoadedPlacer(PASARGUARD_GROUP_IDS, PLACEMENT_CACHE_SEC)
+    raise ValueError(f"Unknown PLACEMENT_STRATEGY '{PLACEMENT_STRATEGY}'")
+
+
+# Глобальный экземпляр — используется клиентом PasarGuard
+placer = _build_placer()
+
+
+def set_placer(new_placer) -> None:
+    """Подменяет стратегию (тесты, стенд с заглушкой панели)."""
+    global placer
+    placer = new_placer
+
+
+async def pick_groups(client: "PasarGuardClient") -> list[int]:
+    """group_ids для пользователя, которого создают или возвращают на панель client."""
+    return await placer.pick(client)
@@ -0,0 +1,151 @@
+"""
+services/queue_worker.py — общий каркас фоновых воркеров очередей в Postgres.
+
+Используется panel_outbox (services/outbox.py), yukassa_events
+(services/yukassa_events.py) и broadcast_jobs (services/broadcasts.py):
+  • просыпается по NOTIFY channel сразу после COMMIT (и раз в poll_sec на всякий случай);
+    LISTEN держится на собственном соединении (connect_listener), не из общего пула;
+  • claim() забирает пачку задач с арендой, handle() выполняет каждую,
+    не больше concurrency одновременно;
+  • успех → complete(item). complete может вернуть False («задача изменилась,
+    пока выполнялась») — тогда воркер сразу идёт на следующий круг;
+  • ошибка → fail(item, error, retry_in_sec) с экспоненциальной задержкой,
+    после max_attempts — fail(item, error, None) (dead) и ERROR в лог.
+Очереди без complete/fail (рассылки сами ведут свои записи) — ошибка только логируется.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+import asyncpg
+
+from bot.database.manager import connect_listener
+
+logger = logging.getLogger(__name__)
+
+_BACKOFF_BASE_SEC = 5
+_BACKOFF_MAX_SEC = 3600
+
+Item = dict[str, Any]
+
+
+def backoff(attempts: int) -> int:
+    return min(_BACKOFF_BASE_SEC * 2 ** (attempts - 1), _BACKOFF_MAX_SEC)
+
+
+class QueueWorker:
+    def __init__(
+        self,
+        name: str,
+        channel: str,
+        poll_sec: float,
+        claim: Callable[[], Awaitable[list[Item]]],
+        handle: Callable[[Item], Awaitable[None]],
+        complete: Callable[[Item], Awaitable[bool | None]] | None = None,
+        fail: Callable[[Item, str, int | None], Awaitable[None]] | None = None,
+        describe: Callable[[Item], str] = lambda item: f"#{item['id']}",
+        concurrency: int = 1,
+        max_attempts: int | None = None,
+    ) -> None:
+        self.name = name
+        self._channel = channel
+        self._poll_sec = poll_sec
+        self._claim = claim
+        self._handle = handle
+        self._complete = complete
+        self._fail = fail
+        self._describe = describe
+        self._concurrency = concurrency
+        self._max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._listen_conn: asyncpg.Connection | None = None
+
+    def wakeup(self) -> None:
+        self._wakeup.set()
+
+    # ── Обработка ─────────────────────────────────────────────────────────────
+
+    async def _process(self, item: Item, sem: asyncio.Semaphore) -> None:
+        async with sem:
+            try:
+                await self._handle(item)
+            except Exception as exc:
+                await self._on_error(item, exc)
+                return
+            if self._complete is not None and await self._complete(item) is False:
+                self._wakeup.set()
+
+    async def _on_error(self, item: Item, exc: Exception) -> None:
+        what = self._describe(item)
+        if self._fail is None:
+            logger.error("%s: %s failed: %s", self.name, what, exc)
+            return
+        attempts = item["attempts"]
+        if self._max_attempts is not None and attempts >= self._max_attempts:
+            logger.error("%s: giving up on %s after %d attempts: %s", self.name, what, attempts, exc)
+            await self._fail(item, str(exc), None)
+        else:
+            delay = backoff(attempts)
+            logger.warning(
+                "%s: %s failed (attempt %d), retry in %ds: %s", self.name, what, attempts, delay, exc
+            )
+            await self._fail(item, str(exc), delay)
+
+    async def drain_once(self) -> int:
+        """Обрабатывает одну пачку задач. Возвращает количество взятых задач."""
+        items = await self._claim()
+        if items:
+            sem = asyncio.Semaphore(self._concurrency)
+            await asyncio.gather(*(self._process(item, sem) for item in items))
+        return len(items)
+
+    # ── Жизненный цикл ────────────────────────────────────────────────────────
+
+    def _on_notify(self, *_args) -> None:
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self.drain_once():
+                    continue  # есть ещё работа — не ждём
+            except Exception as exc:
+                logger.error("%s worker error: %s", self.name, exc)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._poll_sec)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def start(self) -> None:
+        """Запускает воркер. Вызывается при старте после create_pool()."""
+        try:
+            self._listen_conn = await connect_listener()
+            await self._listen_conn.add_listener(self._channel, self._on_notify)
+        except Exception as exc:
+            logger.warning("%s: LISTEN unavailable, polling only: %s", self.name, exc)
+            await self._close_listener()
+        self._task = asyncio.create_task(self._run())
+        logger.info("%s worker started", self.name)
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._close_listener()
+
+    async def _close_listener(self) -> None:
+        conn, self._listen_conn = self._listen_conn, None
+        if conn is None:
+            return
+        try:
+            await conn.close(timeout=5)
+        except Exception:
+            conn.terminate()
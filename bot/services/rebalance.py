@@ -0,0 +1,141 @@
+"""
+services/rebalance.py — перенос пользователей между панелями PasarGuard.
+
+Запуск с тем же окружением, что и бот:
+    python -m bot.services.rebalance                  # dry-run: кто и куда переедет
+    python -m bot.services.rebalance --apply          # перенести
+    python -m bot.services.rebalance --apply --limit 500 --concurrency 4
+
+Целевая панель пользователя — panels.assign(user_id) (consistent hashing по панелям,
+не указанным в PASARGUARD_DRAINING). Переезжают только подписки, у которых
+subscriptions.panel_id отличается от цели: после добавления панели — ~1/N
+пользователей, после PASARGUARD_DRAINING=<id> — все пользователи этой панели.
+
+Перенос одного пользователя:
+  1. пользователь создаётся на целевой панели со сроком из БД (или обновляется, если уже есть);
+  2. в одной транзакции — новый panel_id, новая ссылка и задача в panel_outbox;
+  3. пользователь удаляется со старой панели.
+Если 1 или 2 не удались — пользователь остаётся на старой панели, повторный запуск безопасен.
+Если не удался 3 — на старой панели остаётся «сирота», её покажет сверка (reconcile).
+
+ВАЖНО: у перенесённого пользователя меняется ссылка подписки (другой хост панели) —
+новую ссылку он получит в боте.
+"""
+
+import argparse
+import asyncio
+import logging
+from collections import Counter
+from datetime import timezone
+
+from bot.database import create_pool, close_pool
+from bot.database.subscriptions import get_subscriptions_page, move_subscription_panel
+from bot.services.pasarguard import panels
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = 500
+
+
+async def _migrate(sub: dict, target_id: str) -> None:
+    source = panels.get(sub["panel_id"])
+    target = panels.get(target_id)
+    username = sub["panel_username"]
+    expire_ts = int(sub["expires_at"].replace(tzinfo=timezone.utc).timestamp())
+
+    existing = await target.get_user(username)
+    if existing is None:
+        data = await target.create_user(username, days=0, expire_ts=expire_ts)
+    else:
+        data = await target.set_expire(username, expire_ts, data=existing)
+
+    try:
+        url = target.subscription_url_from(data)
+    except ValueError:
+        url = None  # подтянет backfill ссылок
+
+    if not await move_subscription_panel(sub["id"], source.panel_id, target_id, url):
+        # Подписку перенесли параллельно — новый пользователь на target ей и принадлежит
+        logger.warning("Rebalance: sub %s already moved off '%s'", sub["id"], source.panel_id)
+        return
+
+    await source.delete_user(username)
+    logger.info("Rebalance: moved '%s' %s → %s", username, source.panel_id, target_id)
+
+
+async def rebalance(apply: bool = False, limit: int | None = None, concurrency: int = 4) -> Counter:
+    """
+    Обходит все подписки и переносит тех, кто живёт не на своей панели.
+    Возвращает счётчик переездов по направлениям {(from, to): n}; при ошибках — ключ "failed".
+    """
+    moves: Counter = Counter()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _one(sub: dict, target_id: str) -> None:
+        async with sem:
+            try:
+                await _migrate(sub, target_id)
+                moves[(sub["panel_id"], target_id)] += 1
+            except Exception as exc:
+                moves["failed"] += 1
+                logger.error(
+                    "Rebalance: failed to move '%s' %s → %s: %s",
+                    sub["panel_username"], sub["panel_id"], target_id, exc,
+                )
+
+    planned = 0
+    after_id = 0
+    while limit is None or planned < limit:
+        page = await get_subscriptions_page(after_id, _PAGE_SIZE)
+        if not page:
+            break
+        after_id = page[-1]["id"]
+
+        batch = []
+        for sub in page:
+            target_id = panels.assign(sub["user_id"])
+            if target_id == sub["panel_id"]:
+                continue
+            if limit is not None and planned >= limit:
+                break
+            planned += 1
+            batch.append((sub, target_id))
+
+        if apply:
+            await asyncio.gather(*(_one(sub, target_id) for sub, target_id in batch))
+        else:
+            for sub, target_id in batch:
+                moves[(sub["panel_id"], target_id)] += 1
+
+    return moves
+
+
+async def _main(args: argparse.Namespace) -> None:
+    await create_pool()
+    try:
+        moves = await rebalance(apply=args.apply, limit=args.limit, concurrency=args.concurrency)
+    finally:
+        await panels.close()
+        await close_pool()
+
+    failed = moves.pop("failed", 0)
+    verb = "moved" if args.apply else "to move"
+    for (source, target), n in sorted(moves.items()):
+        print(f"{source} → {target}: {n} {verb}")
+    print(f"total: {sum(moves.values())} {verb}, {failed} failed")
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Move users to the PasarGuard panel they hash to")
+    p.add_argument("--apply", action="store_true", help="actually migrate (default: dry-run)")
+    p.add_argument("--limit", type=int, default=None, help="migrate at most N users")
+    p.add_argument("--concurrency", type=int, default=4, help="parallel migrations")
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    )
+    asyncio.run(_main(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+services/reconcile.py — сверка подписок в БД с пользователями PasarGuard.
+
+БД и панель могут разойтись (панель упала при продлении, ручные правки в панели,
+удаление из админки). Сверка находит:
+  • expiry_mismatch  — срок в панели отличается от expires_at в БД больше чем на допуск;
+  • missing_in_panel — активная подписка в БД, а пользователя в панели нет;
+  • orphan_in_panel  — пользователь есть в панели, а подписки в БД нет.
+
+Каждая панель (PASARGUARD_PANELS) сверяется отдельно с подписками, у которых
+subscriptions.panel_id указывает на неё. Пользователь, оставшийся на старой панели
+после переноса, попадёт в orphan_in_panel этой панели.
+
+Алгоритм — merge-join двух отсортированных по username потоков:
+  панель  → постранично через GET /api/users?sort=username;
+  БД      → keyset-пагинация по panel_username (COLLATE "C").
+В памяти одновременно держится не больше одной страницы с каждой стороны,
+поэтому сверку можно гонять каждую ночь на сотнях тысяч аккаунтов.
+
+Исправление (fix=True):
+  • expiry_mismatch  → в панели выставляется срок из БД (БД — источник истины, там оплата);
+  • missing_in_panel → пользователь создаётся в панели со сроком из БД, новая ссылка
+    подписки (у пересозданного пользователя другой токен) сохраняется в БД;
+  • orphan_in_panel  → только отчёт, из панели автоматически ничего не удаляется.
+"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator
+
+from bot.config import RECONCILE_PAGE_SIZE, RECONCILE_TOLERANCE_SEC
+from bot.database.subscriptions import iter_subscriptions_by_panel_username, set_subscription_url
+from bot.services.pasarguard import PasarGuardClient, panels, _parse_expire
+from bot.services.sub_cache import invalidate_sub_cache
+
+logger = logging.getLogger(__name__)
+
+# Сколько примеров каждого расхождения попадает в лог
+_SAMPLE_SIZE = 20
+
+
+class ReconcileOrderError(RuntimeError):
+    """Панель отдала пользователей не по возрастанию username — merge-join невозможен."""
+
+
+@dataclass
+class ReconcileReport:
+    checked: int = 0
+    expiry_mismatch: int = 0
+    missing_in_panel: int = 0
+    orphan_in_panel: int = 0
+    fixed: int = 0
+    fix_errors: int = 0
+    samples: dict[str, list[str]] = field(default_factory=dict)
+
+    def sample(self, kind: str, username: str) -> None:
+        bucket = self.samples.setdefault(kind, [])
+        if len(bucket) < _SAMPLE_SIZE:
+            bucket.append(username)
+
+
+def _db_expire_ts(expires_at: datetime) -> int:
+    """expires_at в БД хранится как naive UTC."""
+    return int(expires_at.replace(tzinfo=timezone.utc).timestamp())
+
+
+# ── Потоки ────────────────────────────────────────────────────────────────────
+
+async def _panel_stream(
+    pasarguard: PasarGuardClient, page_size: int
+) -> AsyncIterator[dict[str, Any]]:
+    """Пользователи панели по одному, строго по возрастанию username."""
+    last: str | None = None
+    async for page in pasarguard.iter_users(page_size):
+        for user in sorted(page, key=lambda u: u["username"]):
+            name = user["username"]
+            if last is not None and name <= last:
+                if name == last:
+                    continue  # дубль на границе страниц (сдвиг offset)
+                raise ReconcileOrderError(
+                    f"PasarGuard '{pasarguard.panel_id}' returned '{name}' after '{last}' — "
+                    "panel sort order differs from byte order"
+                )
+            last = name
+            yield user
+
+
+async def _db_stream(panel_id: str, page_size: int) -> AsyncIterator[dict]:
+    async for page in iter_subscriptions_by_panel_username(panel_id, page_size):
+        for sub in page:
+            yield sub
+
+
+async def _next(it: AsyncIterator):
+    try:
+        return await it.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+# ── Сравнение и исправление ───────────────────────────────────────────────────
+
+async def _compare(
+    pasarguard: PasarGuardClient,
+    sub: dict,
+    user: dict[str, Any],
+    report: ReconcileReport,
+    fix: bool,
+) -> None:
+    username = sub["panel_username"]
+    now = int(time.time())
+    db_ts = _db_expire_ts(sub["expires_at"])
+    db_alive = sub["is_active"] and db_ts > now
+
+    raw_expire = user.get("expire")
+    panel_ts = _parse_expire(raw_expire) if raw_expire else None  # None/0 — бессрочно
+
+    if db_alive:
+        drift = panel_ts is None or abs(panel_ts - db_ts) > RECONCILE_TOLERANCE_SEC
+    else:
+        # Подписка в БД закончилась — в панели не должно остаться живого срока
+        drift = (
+            user.get("status") == "active"
+            and (panel_ts is None or panel_ts > now + RECONCILE_TOLERANCE_SEC)
+        )
+
+    if not drift:
+        return
+
+    report.expiry_mismatch += 1
+    report.sample("expiry_mismatch", f"{pasarguard.panel_id}:{username}")
+    logger.warning(
+        "Reconcile: expiry mismatch for '%s' on '%s' (db=%s, active=%s, panel=%s)",
+        username, pasarguard.panel_id, db_ts, sub["is_active"], panel_ts,
+    )
+    if fix:
+        await _fix(report, pasarguard.set_expire(username, db_ts), pasarguard, sub)
+
+
+async def _missing(
+    pasarguard: PasarGuardClient, sub: dict, report: ReconcileReport, fix: bool
+) -> None:
+    username = sub["panel_username"]
+    db_ts = _db_expire_ts(sub["expires_at"])
+    if not sub["is_active"] or db_ts <= int(time.time()):
+        return  # неактивную подписку могли удалить из панели намеренно
+
+    report.missing_in_panel += 1
+    report.sample("missing_in_panel", f"{pasarguard.panel_id}:{username}")
+    logger.warning(
+        "Reconcile: '%s' is active in DB but missing in PasarGuard '%s'",
+        username, pasarguard.panel_id,
+    )
+    if not fix:
+        return
+    data = await _fix(
+        report, pasarguard.create_user(username, days=0, expire_ts=db_ts), pasarguard, sub
+    )
+    if data is None:
+        return
+    # Пересозданный пользователь получил новый токен — старая ссылка в БД уже мертва
+    try:
+        await set_subscription_url(sub["id"], pasarguard.subscription_url_from(data))
+    except Exception as exc:
+        report.fix_errors += 1
+        logger.error("Reconcile: new subscription_url not saved for '%s': %s", username, exc)
+
+
+def _orphan(pasarguard: PasarGuardClient, user: dict[str, Any], report: ReconcileReport) -> None:
+    report.orphan_in_panel += 1
+    report.sample("orphan_in_panel", f"{pasarguard.panel_id}:{user['username']}")
+
+
+async def _fix(report: ReconcileReport, action, pasarguard: PasarGuardClient, sub: dict) -> Any:
+    """Выполняет исправление; возвращает ответ панели или None, если исправить не удалось."""
+    try:
+        result = await action
+        report.fixed += 1
+    except Exception as exc:
+        report.fix_errors += 1
+        logger.error("Reconcile: fix FAILED for '%s': %s", sub["panel_username"], exc)
+        return None
+    await invalidate_sub_cache(pasarguard.panel_id, sub.get("subscription_url"))
+    return result
+
+
+# ── Точка входа ───────────────────────────────────────────────────────────────
+
+async def _reconcile_panel(
+    pasarguard: PasarGuardClient, report: ReconcileReport, fix: bool, page_size: int
+) -> None:
+    """Один потоковый проход по панели и её подпискам в БД."""
+    panel_it = _panel_stream(pasarguard, page_size)
+    db_it = _db_stream(pasarguard.panel_id, page_size)
+    user = await _next(panel_it)
+    sub = await _next(db_it)
+
+    while user is not None or sub is not None:
+        if sub is None or (user is not None and user["username"] < sub["panel_username"]):
+            _orphan(pasarguard, user, report)
+            user = await _next(panel_it)
+        elif user is None or sub["panel_username"] < user["username"]:
+            await _missing(pasarguard, sub, report, fix)
+            sub = await _next(db_it)
+        else:
+            report.checked += 1
+            await _compare(pasarguard, sub, user, report, fix)
+            user = await _next(panel_it)
+            sub = await _next(db_it)
+
+
+async def reconcile(fix: bool = False, page_size: int = RECONCILE_PAGE_SIZE) -> ReconcileReport:
+    """Сверяет подписки БД с пользователями всех панелей (по панели за проход)."""
+    report = ReconcileReport()
+    started = time.monotonic()
+
+    for pasarguard in panels:
+        try:
+            await _reconcile_panel(pasarguard, report, fix, page_size)
+        except Exception as exc:
+            # Недоступная панель не должна отменять сверку остальных
+            logger.error("Reconcile: panel '%s' failed: %s", pasarguard.panel_id, exc)
+
+    logger.info(
+        "Reconcile finished in %.1fs: checked=%d mismatch=%d missing=%d orphans=%d "
+        "fixed=%d fix_errors=%d samples=%s",
+        time.monotonic() - started, report.checked, report.expiry_mismatch,
+        report.missing_in_panel, report.orphan_in_panel, report.fixed,
+        report.fix_errors, report.samples,
+    )
+    return report
@@ -3,7 +3,7 @@ services/referral.py — бизнес-логика реферальной сис
 
 Правила:
   • Пригласивший получает +REFERRAL_BONUS_DAYS дней реальной подписки:
-      - есть активная подписка → продлевается в PasarGuard и DB
+      - есть активная подписка → продлевается в DB, PasarGuard — через panel_outbox
       - подписки нет → создаётся новая в PasarGuard и DB
 """
 
@@ -21,7 +21,8 @@ from bot.database.subscriptions import (
     extend_subscription,
 )
 from bot.messages import referral_reward_text
-from bot.services.pasarguard import pasarguard
+from bot.services.pasarguard import panels
+from bot.services.tg_sender import Priority, send_priority
 
 logger = logging.getLogger(__name__)
 
@@ -37,14 +38,7 @@ async def _grant_subscription(referrer_id: int) -> None:
     active_sub = await get_active_subscription(referrer_id)
 
     if active_sub:
-        # ── Продление активной подписки ───────────────────────────────────────
-        try:
-            await pasarguard.extend_user(username, REFERRAL_BONUS_DAYS)
-        except Exception as pg_exc:
-            logger.error(
-                "PasarGuard extend_user FAILED for referrer %s (panel: %s): %s",
-                referrer_id, username, pg_exc,
-            )
+        # ── Продление активной подписки (PasarGuard — через panel_outbox) ─────
         await extend_subscription(active_sub["id"], days=REFERRAL_BONUS_DAYS)
         logger.info(
             "Referral: extended sub %s by %d days for user %s",
@@ -55,13 +49,6 @@ async def _grant_subscription(referrer_id: int) -> None:
         if any_sub:
             # ── Реактивация истёкшей подписки — переиспользуем существующий аккаунт ──
             # PasarGuard-пользователь уже создан, ссылка у пользователя остаётся прежней.
-            try:
-                await pasarguard.extend_user(username, REFERRAL_BONUS_DAYS)
-            except Exception as pg_exc:
-                logger.error(
-                    "PasarGuard extend_user FAILED during referral reactivation for user %s: %s",
-                    referrer_id, pg_exc,
-                )
             await reactivate_subscription(any_sub["id"], days=REFERRAL_BONUS_DAYS)
             logger.info(
                 "Referral: reactivated sub %s by %d days for user %s",
@@ -69,11 +56,13 @@ async def _grant_subscription(referrer_id: int) -> None:
             )
         else:
             # ── Первая выдача — создаём с нуля ────────────────────────────────
-            await pasarguard.ensure_user(username, days=REFERRAL_BONUS_DAYS)
+            panel_id = panels.assign(referrer_id)
             try:
-                url = await pasarguard.get_subscription_url(username)
-            except Exception:
-                url = None
+                url, _ = await panels.get(panel_id).provision_user(
+                    username, days=REFERRAL_BONUS_DAYS
+                )
+            except ValueError:
+                url = None  # панель не вернула ссылку — подтянется позже
             await create_subscription(
                 user_id=referrer_id,
                 panel_username=username,
@@ -81,6 +70,7 @@ async def _grant_subscription(referrer_id: int) -> None:
                 days=REFERRAL_BONUS_DAYS,
                 auto_renew=False,
                 subscription_url=url,
+                panel_id=panel_id,
             )
             logger.info(
                 "Referral: created %d-day subscription for user %s",
@@ -99,9 +89,10 @@ async def handle_referral(referrer_id: int, referred_id: int, bot: Bot) -> None:
         await _grant_subscription(referrer_id)
         await mark_rewarded(referred_id)
 
-        await bot.send_message(
-            referrer_id,
-            referral_reward_text(REFERRAL_BONUS_DAYS),
-        )
+        with send_priority(Priority.TRANSACTIONAL):
+            await bot.send_message(
+                referrer_id,
+                referral_reward_text(REFERRAL_BONUS_DAYS),
+            )
     except Exception as exc:
         logger.error("Failed to process referral reward for %s: %s", referrer_id, exc)
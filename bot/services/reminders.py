@@ -0,0 +1,106 @@
+"""
+services/reminders.py — напоминания о подписке.
+
+Кому и когда: выборка по окну expires_at + журнал notifications_sent
+(database/notifications.py), поэтому одно напоминание не уходит дважды — ни при
+повторном проходе планировщика, ни при срабатывании таймера (services/timers.py).
+Адресаты выбираются пачками по NOTIFY_BATCH.
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+
+from bot.config import NOTIFY_BATCH, NOTIFY_CATCHUP_HOURS
+from bot.database.notifications import claim_due_notifications
+from bot.keyboards.user import reminder_kb
+from bot.services.job_runs import record_item
+from bot.services.tg_sender import Priority, send_priority
+from bot.messages import (
+    reminder_expiring_soon_text,
+    reminder_just_expired_text,
+    reminder_week_1_text,
+    reminder_week_2_text,
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько недель слать еженедельные напоминания после окончания
+_REMINDER_WEEKS = (1, 2)
+
+
+async def _send_reminder(bot: Bot, user_id: int, text: str) -> None:
+    """Отправляет напоминание пользователю; подавляет любые ошибки доставки."""
+    started = time.monotonic()
+    try:
+        with send_priority(Priority.REMINDER):
+            await bot.send_message(user_id, text, reply_markup=reminder_kb(), parse_mode="HTML")
+    except Exception as exc:
+        record_item(time.monotonic() - started, ok=False)
+        logger.warning("Reminder not delivered to user %s: %s", user_id, exc)
+    else:
+        record_item(time.monotonic() - started)
+
+
+async def _notify(
+    bot: Bot,
+    kind: str,
+    window_start: datetime,
+    window_end: datetime,
+    text: str,
+    subscription_id: int | None = None,
+) -> None:
+    """Отправляет напоминание kind всем, кто попал в окно и ещё не получал его за этот период."""
+    sent = 0
+    while batch := await claim_due_notifications(
+        kind, window_start, window_end, NOTIFY_BATCH, subscription_id
+    ):
+        for sub in batch:
+            await _send_reminder(bot, sub["user_id"], text)
+        sent += len(batch)
+    if subscription_id is None or sent:
+        logger.info("Reminder (%s): %d users", kind, sent)
+
+
+async def remind_expiring(bot: Bot, subscription_id: int | None = None) -> None:
+    """
+    Напоминание за сутки до окончания (подписка истекает в ближайшие 24 ч).
+    Получают только те, у кого автопродление невозможно:
+      — auto_renew выключен, или
+      — нет сохранённого метода оплаты (ни разу не платили через ЮKassa).
+    """
+    now = datetime.utcnow()
+    # Минута запаса — таймер срабатывает ровно за 24 ч до expires_at
+    await _notify(
+        bot, "expiring", now, now + timedelta(hours=24, minutes=1),
+        reminder_expiring_soon_text(), subscription_id,
+    )
+
+
+async def remind_expired(bot: Bot, subscription_id: int | None = None) -> None:
+    """Уведомление об окончании подписки (с досылкой за NOTIFY_CATCHUP_HOURS)."""
+    now = datetime.utcnow()
+    await _notify(
+        bot, "expired", now - timedelta(hours=NOTIFY_CATCHUP_HOURS), now,
+        reminder_just_expired_text(), subscription_id,
+    )
+
+
+async def remind_weekly(bot: Bot) -> None:
+    """
+    Еженедельные напоминания после окончания подписки.
+    Отправляется на 1-й и 2-й неделях.
+    """
+    texts = {
+        1: reminder_week_1_text,
+        2: reminder_week_2_text,
+    }
+    now = datetime.utcnow()
+    for week in _REMINDER_WEEKS:
+        target = now - timedelta(weeks=week)
+        await _notify(
+            bot, f"week_{week}", target - timedelta(hours=NOTIFY_CATCHUP_HOURS), target,
+            texts[week](),
+        )
@@ -0,0 +1,144 @@
+"""
+services/renewal.py — движок автопродления подписок.
+
+Раз в час берёт подписки с автопродлением, истекающие в ближайшие 24 ч, и списывает
+оплату через сохранённый метод (services/payment.charge_auto_renew):
+  • подписки забираются пачками по RENEW_BATCH с арендой на RENEW_LEASE_SEC
+    (FOR UPDATE SKIP LOCKED) — прогон запускается на всех репликах, и они делят работу;
+  • параллельно, не больше RENEW_CONCURRENCY списаний одновременно и не чаще
+    RENEW_RATE_PER_SEC новых в секунду — один медленный ответ ЮKassa не задерживает остальных;
+  • ключ идемпотентности renew-{sub_id}-{expires_at} — повтор после падения не спишет дважды;
+  • pending-автоплатёж СБП — «в пути», а не отказ: подписку не отключаем, платёж доведёт
+    вебхук, а следующий прогон пропустит подписку, пока платёж не завершится;
+  • подписка отключается только при явном отказе — платёж вернулся canceled;
+    любые ошибки API (4xx в т.ч.: 401/403 при сменённом ключе магазина, 400 при
+    конфликте ключа идемпотентности), сеть и 5xx — повтор в следующем прогоне.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from bot.config import RENEW_BATCH, RENEW_CONCURRENCY, RENEW_LEASE_SEC, RENEW_RATE_PER_SEC
+from bot.database.payments import get_pending_subscription_payment
+from bot.database.subscriptions import claim_expiring_subscriptions, deactivate_subscription
+from bot.services.job_runs import record_item
+from bot.services.payment import charge_auto_renew
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RenewalStats:
+    due: int = 0
+    charged: int = 0
+    pending: int = 0      # списание создано, банк ещё подтверждает
+    in_flight: int = 0    # пропущены: pending-платёж с прошлого прогона
+    declined: int = 0     # отказ — подписка отключена
+    errors: int = 0       # временная ошибка — повтор в следующем прогоне
+    elapsed_sec: float = 0.0
+
+    @property
+    def per_sec(self) -> float:
+        return self.due / self.elapsed_sec if self.elapsed_sec else 0.0
+
+
+class _RateLimiter:
+    """Равномерно распределяет старты: не больше rate в секунду."""
+
+    def __init__(self, rate: float) -> None:
+        self._interval = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Общий для всех событий таймера — их поток тоже не должен превышать RENEW_RATE_PER_SEC
+_single_limiter = _RateLimiter(RENEW_RATE_PER_SEC)
+
+
+async def _renew_one(
+    sub: dict, bot: Any, stats: RenewalStats, sem: asyncio.Semaphore, limiter: _RateLimiter
+) -> None:
+    async with sem:
+        if await get_pending_subscription_payment(sub["id"]):
+            stats.in_flight += 1
+            return
+
+        await limiter.wait()
+        started = time.monotonic()
+        ok = False
+        try:
+            ok = await _charge(sub, bot, stats)
+        finally:
+            record_item(time.monotonic() - started, ok)
+
+
+async def _charge(sub: dict, bot: Any, stats: RenewalStats) -> bool:
+    """Списание и его итог для подписки. False — временная ошибка, повтор в следующем прогоне."""
+    try:
+        result = await charge_auto_renew(sub, bot)
+    except Exception as exc:
+        # Ошибка запроса — не отказ банка: ключ магазина, лимиты и конфликт ключа
+        # идемпотентности касаются всех подписок сразу, отключать их нельзя
+        stats.errors += 1
+        logger.error("Auto-renew failed for sub %s: %s", sub["id"], exc)
+        return False
+
+    if result == "succeeded":
+        stats.charged += 1
+    elif result == "pending":
+        stats.pending += 1
+        logger.info("Auto-renew for sub %s is pending bank confirmation", sub["id"])
+    else:
+        stats.declined += 1
+        logger.warning("Auto-renew declined for sub %s", sub["id"])
+        await deactivate_subscription(sub["id"])  # заморозка в панели — через panel_outbox
+    return True
+
+
+async def renew_subscription(bot: Any, subscription_id: int) -> None:
+    """Автопродление одной подписки по таймеру renew (services/timers.py)."""
+    subscriptions = await claim_expiring_subscriptions(
+        within_hours=24, limit=1, lease_sec=RENEW_LEASE_SEC, subscription_id=subscription_id
+    )
+    if subscriptions:
+        await _renew_one(
+            subscriptions[0], bot, RenewalStats(due=1), asyncio.Semaphore(1), _single_limiter
+        )
+
+
+async def run_renewals(bot: Any) -> RenewalStats:
+    """
+    Один прогон автопродления на этой реплике. Возвращает статистику прогона.
+    Обработанные подписки остаются арендованными до конца RENEW_LEASE_SEC, поэтому
+    в этом прогоне повторно не попадаются, и цикл заканчивается, когда брать нечего.
+    """
+    started = time.monotonic()
+    stats = RenewalStats()
+    sem = asyncio.Semaphore(RENEW_CONCURRENCY)
+    limiter = _RateLimiter(RENEW_RATE_PER_SEC)
+
+    while subscriptions := await claim_expiring_subscriptions(
+        within_hours=24, limit=RENEW_BATCH, lease_sec=RENEW_LEASE_SEC
+    ):
+        stats.due += len(subscriptions)
+        await asyncio.gather(*(_renew_one(sub, bot, stats, sem, limiter) for sub in subscriptions))
+
+    stats.elapsed_sec = time.monotonic() - started
+    logger.info(
+        "Auto-renew finished in %.1fs (%.1f subs/s): due=%d charged=%d pending=%d "
+        "in_flight=%d declined=%d errors=%d",
+        stats.elapsed_sec, stats.per_sec, stats.due, stats.charged, stats.pending,
+        stats.in_flight, stats.declined, stats.errors,
+    )
+    return stats
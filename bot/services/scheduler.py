@@ -2,52 +2,106 @@
 services/scheduler.py — планировщик задач (APScheduler).
 
 Задачи:
-  • auto_renew_check      — каждый час: автопродление истекающих подписок.
+  • auto_renew_check      — каждый час: автопродление истекающих подписок (services/renewal.py).
   • reminder_expiring     — каждый час: напоминание за ~24 ч до конца
                             (только тем, у кого нет автопродления / метода оплаты).
   • reminder_just_expired — каждый час: уведомление в момент окончания.
   • reminder_weekly       — каждый час: напоминание через 1 и 2 недели после окончания.
-
-Принцип идемпотентности (без изменения БД):
-  Каждая задача проверяет строгое временно́е окно шириной 1 час.
-  При запуске раз в час каждая подписка попадёт в окно ровно один раз.
+  • payment_sweep         — каждые PAYMENT_SWEEP_MIN минут: досверка зависших pending-платежей.
+  • usage_sync            — каждые USAGE_SYNC_MIN минут: расход трафика из PasarGuard для меню.
+  • backfill_urls         — при старте и каждый час: заполнение пустых subscription_url.
+  • reconcile             — раз в сутки (RECONCILE_HOUR UTC): сверка БД с PasarGuard.
+
+Каждый запуск (и каждый пропуск из-за наложения) записывается в job_runs —
+см. services/job_runs.py, /api/jobs в админке и «⏱ Задачи» в /admin.
+
+Точное время:
+  Продление, «истекает завтра» и окончание срабатывают по таймерам в Redis
+  (services/timers.py) с точностью до секунды. Часовые проходы ниже — страховка
+  на случай потерянного таймера.
+
+Напоминания без дублей и пропусков:
+  Каждое отправленное напоминание записывается в журнал notifications_sent
+  (подписка, вид, период = expires_at). Окна выборки — с запасом NOTIFY_CATCHUP_HOURS,
+  поэтому после простоя или долгого прогона пропущенное досылается, а журнал не даёт
+  отправить одно напоминание дважды. Адресаты выбираются пачками по NOTIFY_BATCH.
+
+Несколько реплик бота:
+  Планировщик запускается в каждой реплике. auto_renew выполняют все — подписки
+  делятся между ними арендой в БД (services/renewal.py). Остальные задачи обёрнуты
+  с exclusive=True: за период задачу выполняет только реплика, первой взявшая
+  аренду job:{id} в Redis; остальные пропускают запуск.
 """
 
+import asyncio
 import logging
 from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable
 
 from aiogram import Bot
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, JobExecutionEvent
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from bot.database.subscriptions import (
-    get_expiring_subscriptions,
-    deactivate_subscription,
-    get_subscriptions_expiring_soon,
-    get_subscriptions_just_expired,
-    get_subscriptions_expired_weeks_ago,
-)
-from bot.keyboards.user import reminder_kb
-from bot.messages import (
-    reminder_expiring_soon_text,
-    reminder_just_expired_text,
-    reminder_week_1_text,
-    reminder_week_2_text,
-)
-from bot.services.pasarguard import pasarguard
-from bot.services.payment import charge_auto_renew
+from bot.config import PAYMENT_SWEEP_MIN, RECONCILE_HOUR, RECONCILE_FIX, USAGE_SYNC_MIN
+from bot.services.job_runs import add_items, record_skip, run_tracked
+from bot.services.payment_sweeper import sweep_pending_payments
+from bot.services.reconcile import reconcile
+from bot.services.reminders import remind_expired, remind_expiring, remind_weekly
+from bot.services.renewal import run_renewals
+from bot.services.subscription import backfill_subscription_urls
+from bot.services.usage import sync_usage
+from bot.utils.locks import acquire_lease
 
 logger = logging.getLogger(__name__)
 
 _scheduler: AsyncIOScheduler | None = None
 
-# Сколько недель слать еженедельные напоминания после окончания
-_REMINDER_WEEKS = (1, 2)
+_HOUR = 3600
+
+
+# job_id → период запуска (сек) — для учёта пропусков и предупреждения о перерасходе
+_PERIODS: dict[str, int] = {}
+
+
+def _job(
+    job_id: str, period_sec: int, func: Callable[..., Awaitable[Any]], exclusive: bool = True
+) -> Callable[..., Awaitable[None]]:
+    """
+    Обёртка задачи: запуск записывается в job_runs (services/job_runs.py).
+
+    exclusive=True — за period_sec задачу выполнит только одна реплика.
+    Аренда не снимается по окончании — иначе реплика, у которой таймер сработал
+    чуть позже, выполнила бы задачу повторно. 10% запаса — чтобы к следующему
+    запуску аренда точно истекла.
+    """
+    _PERIODS[job_id] = period_sec
+
+    async def run(**kwargs: Any) -> None:
+        if exclusive:
+            try:
+                if not await acquire_lease(f"job:{job_id}", period_sec * 0.9):
+                    logger.debug("Job %s already ran on another replica, skipping", job_id)
+                    return
+            except Exception as exc:
+                logger.error("Job %s skipped, lease unavailable: %s", job_id, exc)
+                return
+        await run_tracked(job_id, period_sec, func, **kwargs)
+
+    return run
+
+
+def _on_job_skipped(event: JobExecutionEvent) -> None:
+    """Запуск пропущен: предыдущий ещё идёт (max_instances) или планировщик опоздал (misfire)."""
+    reason = "overlap" if event.code == EVENT_JOB_MAX_INSTANCES else "missed"
+    logger.warning("Job %s skipped: %s", event.job_id, reason)
+    asyncio.ensure_future(record_skip(event.job_id, _PERIODS.get(event.job_id, 0), reason))
 
 
 def setup_scheduler(bot: Bot) -> None:
     """Инициализирует и запускает планировщик."""
     global _scheduler
     _scheduler = AsyncIOScheduler(timezone="UTC")
+    _scheduler.add_listener(_on_job_skipped, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
 
     common = dict(
         trigger="interval",
@@ -55,98 +109,71 @@ def setup_scheduler(bot: Bot) -> None:
         next_run_time=datetime.now(tz=timezone.utc),
     )
 
+    # Автопродление выполняют все реплики — подписки делятся арендой в БД
     _scheduler.add_job(
-        _auto_renew_task,
+        _job("auto_renew", _HOUR, run_renewals, exclusive=False),
         **common,
         id="auto_renew",
         kwargs={"bot": bot},
     )
     _scheduler.add_job(
-        _reminder_expiring_task,
+        _job("reminder_expiring", _HOUR, remind_expiring),
         **common,
         id="reminder_expiring",
         kwargs={"bot": bot},
     )
     _scheduler.add_job(
-        _reminder_just_expired_task,
+        _job("reminder_just_expired", _HOUR, remind_expired),
         **common,
         id="reminder_just_expired",
         kwargs={"bot": bot},
     )
     _scheduler.add_job(
-        _reminder_weekly_task,
+        _job("reminder_weekly", _HOUR, remind_weekly),
         **common,
         id="reminder_weekly",
         kwargs={"bot": bot},
     )
+    _scheduler.add_job(
+        _job("payment_sweep", PAYMENT_SWEEP_MIN * 60, sweep_pending_payments),
+        trigger="interval",
+        minutes=PAYMENT_SWEEP_MIN,
+        next_run_time=datetime.now(tz=timezone.utc),
+        id="payment_sweep",
+    )
+    _scheduler.add_job(
+        _job("usage_sync", USAGE_SYNC_MIN * 60, _usage_sync_task),
+        trigger="interval",
+        minutes=USAGE_SYNC_MIN,
+        next_run_time=datetime.now(tz=timezone.utc),
+        id="usage_sync",
+    )
+    _scheduler.add_job(
+        _job("backfill_urls", _HOUR, backfill_subscription_urls),
+        **common,
+        id="backfill_urls",
+    )
+    _scheduler.add_job(
+        _job("reconcile", 24 * _HOUR, _reconcile_task),
+        trigger="cron",
+        hour=RECONCILE_HOUR,
+        minute=0,
+        id="reconcile",
+    )
 
     _scheduler.start()
     logger.info("Scheduler started")
 
 
-# ── Вспомогательная функция отправки ─────────────────────────────────────────
-
-async def _send_reminder(bot: Bot, user_id: int, text: str) -> None:
-    """Отправляет напоминание пользователю; подавляет любые ошибки доставки."""
-    try:
-        await bot.send_message(user_id, text, reply_markup=reminder_kb(), parse_mode="HTML")
-    except Exception as exc:
-        logger.warning("Reminder not delivered to user %s: %s", user_id, exc)
-
-
 # ── Задачи ────────────────────────────────────────────────────────────────────
+# Ошибки логирует и записывает в job_runs обёртка _job.
 
-async def _auto_renew_task(bot: Bot) -> None:
-    """Продлевает подписки с автопродлением у которых осталось < 24 ч."""
-    subscriptions = await get_expiring_subscriptions(within_hours=24)
-    logger.info("Auto-renew check: %d subscriptions to process", len(subscriptions))
+async def _reconcile_task() -> None:
+    """Ночная сверка подписок в БД с пользователями PasarGuard."""
+    report = await reconcile(fix=RECONCILE_FIX)
+    add_items(report.checked, failures=report.fix_errors)
 
-    for sub in subscriptions:
-        try:
-            success = await charge_auto_renew(sub, bot=bot)
-            if not success:
-                await deactivate_subscription(sub["id"])
-                await pasarguard.extend_user(sub["panel_username"], 0)  # заморозка
-        except Exception as exc:
-            logger.error("Auto-renew failed for sub %s: %s", sub["id"], exc)
 
-
-async def _reminder_expiring_task(bot: Bot) -> None:
-    """
-    Напоминание за ~24 часа до окончания.
-    Получают только те, у кого автопродление невозможно:
-      — auto_renew выключен, или
-      — нет сохранённого метода оплаты (ни разу не платили через ЮKassa).
-    """
-    subscriptions = await get_subscriptions_expiring_soon()
-    logger.info("Reminder (expiring soon): %d users", len(subscriptions))
-
-    for sub in subscriptions:
-        await _send_reminder(bot, sub["user_id"], reminder_expiring_soon_text())
-
-
-async def _reminder_just_expired_task(bot: Bot) -> None:
-    """Уведомление в момент, когда подписка только что истекла (окно 1 час)."""
-    subscriptions = await get_subscriptions_just_expired()
-    logger.info("Reminder (just expired): %d users", len(subscriptions))
-
-    for sub in subscriptions:
-        await _send_reminder(bot, sub["user_id"], reminder_just_expired_text())
-
-
-async def _reminder_weekly_task(bot: Bot) -> None:
-    """
-    Еженедельные напоминания после окончания подписки.
-    Отправляется на 1-й и 2-й неделях.
-    """
-    texts = {
-        1: reminder_week_1_text,
-        2: reminder_week_2_text,
-    }
-    for week in _REMINDER_WEEKS:
-        subscriptions = await get_subscriptions_expired_weeks_ago(weeks=week)
-        logger.info("Reminder (week %d after expiry): %d users", week, len(subscriptions))
-
-        text = texts[week]()
-        for sub in subscriptions:
-            await _send_reminder(bot, sub["user_id"], text)
+async def _usage_sync_task() -> None:
+    """Подтягивает расход трафика всех пользователей в usage_snapshots."""
+    add_items(await sync_usage())
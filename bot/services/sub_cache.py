@@ -0,0 +1,145 @@
+"""
+services/sub_cache.py — кэш содержимого подписок (то, что VPN-клиент получает по ссылке).
+
+VPN-приложения периодически опрашивают ссылку подписки, и на каждый опрос панель
+заново генерирует конфиг. Бот отдаёт ссылку вида {BASE_URL}{SUB_PROXY_PATH}/{panel_id}/{token}
+(webhooks/subscription.py) и кэширует ответ панели в Redis:
+
+    subcache:{panel_id}:{token}  — hash; поле = класс клиента (по User-Agent) + query,
+                                   значения «<поле>:m» (статус, заголовки, ETag) и «<поле>:b» (тело).
+
+Разные приложения получают разные форматы, поэтому кэш раздельный по классу клиента.
+Ключ живёт SUB_CACHE_TTL и удаляется целиком при любом изменении пользователя:
+воркер panel_outbox, вебхук PasarGuard и исправления сверки вызывают invalidate_sub_cache().
+Расход трафика в заголовке subscription-userinfo поэтому отстаёт не больше чем на SUB_CACHE_TTL.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+
+from bot.config import BASE_URL, SUB_PROXY_ENABLED, SUB_PROXY_PATH, SUB_CACHE_TTL, PASARGUARD_SUB_PATH
+from bot.services.pasarguard import panels
+from bot.utils.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Заголовки ответа панели, которые нужны клиентам (метаданные профиля, трафик, имя файла)
+_PASSTHROUGH_HEADERS = (
+    "content-type",
+    "content-disposition",
+    "subscription-userinfo",
+    "profile-update-interval",
+    "profile-title",
+    "profile-web-page-url",
+    "support-url",
+    "announce",
+)
+
+# Один запрос к панели на ключ, даже если клиенты пришли одновременно
+_inflight: dict[tuple[str, str, str], asyncio.Task] = {}
+
+
+def _key(panel_id: str, token: str) -> str:
+    return f"subcache:{panel_id}:{token}"
+
+
+def _panel_sub_prefix(panel_id: str) -> str:
+    return f"{panels.get(panel_id).url.rstrip('/')}{PASARGUARD_SUB_PATH.rstrip('/')}/"
+
+
+def _token_of(panel_id: str, url: str | None) -> str | None:
+    """Токен из ссылки панели (всё после {panel_url}{PASARGUARD_SUB_PATH}/) или None."""
+    if not url:
+        return None
+    prefix = _panel_sub_prefix(panel_id)
+    return url[len(prefix):] if url.startswith(prefix) else None
+
+
+def public_subscription_url(panel_id: str, url: str | None) -> str | None:
+    """
+    Ссылка, которую видит пользователь: через кэширующий прокси бота, если он включён
+    и ссылка указывает на панель. Иначе — ссылка панели как есть.
+    """
+    if not SUB_PROXY_ENABLED:
+        return url
+    token = _token_of(panel_id, url)
+    if token is None:
+        return url
+    return f"{BASE_URL.rstrip('/')}{SUB_PROXY_PATH}/{panel_id}/{token}"
+
+
+async def invalidate_sub_cache(panel_id: str, *urls: str | None) -> None:
+    """Сбрасывает кэш подписки пользователя (по одной или нескольким его ссылкам)."""
+    keys = {_key(panel_id, token) for url in urls if (token := _token_of(panel_id, url))}
+    if not keys:
+        return
+    try:
+        await get_redis().delete(*keys)
+    except Exception as exc:
+        logger.warning("Subscription cache invalidate error: %s", exc)
+
+
+# ── Чтение / заполнение ───────────────────────────────────────────────────────
+
+async def _read(panel_id: str, token: str, field: str) -> dict | None:
+    try:
+        meta, body = await get_redis().hmget(_key(panel_id, token), f"{field}:m", f"{field}:b")
+    except Exception as exc:
+        logger.warning("Subscription cache read error: %s", exc)
+        return None
+    if meta is None or body is None:
+        return None
+    entry = json.loads(meta)
+    entry["body"] = body
+    return entry
+
+
+async def _write(panel_id: str, token: str, field: str, entry: dict) -> None:
+    meta = {k: v for k, v in entry.items() if k != "body"}
+    try:
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.hset(_key(panel_id, token), mapping={
+                f"{field}:m": json.dumps(meta),
+                f"{field}:b": entry["body"],
+            })
+            pipe.expire(_key(panel_id, token), SUB_CACHE_TTL)
+            await pipe.execute()
+    except Exception as exc:
+        logger.warning("Subscription cache write error: %s", exc)
+
+
+async def _fetch(panel_id: str, token: str, field: str, user_agent: str, query: str) -> dict:
+    status, headers, body = await panels.get(panel_id).fetch_subscription(
+        f"{PASARGUARD_SUB_PATH.rstrip('/')}/{token}", user_agent, query
+    )
+    entry = {
+        "status": status,
+        "headers": {k: v for k, v in headers.items() if k.lower() in _PASSTHROUGH_HEADERS},
+        "etag": f'"{hashlib.sha1(body).hexdigest()}"',
+        "body": body,
+    }
+    if status == 200:
+        await _write(panel_id, token, field, entry)
+    return entry
+
+
+async def get_subscription_content(
+    panel_id: str, token: str, field: str, user_agent: str, query: str = ""
+) -> tuple[dict, bool]:
+    """
+    Содержимое подписки для класса клиента field: (entry, hit).
+    entry — {"status", "headers", "etag", "body"}; кэшируются только ответы 200.
+    """
+    entry = await _read(panel_id, token, field)
+    if entry is not None:
+        return entry, True
+
+    flight = (panel_id, token, field)
+    task = _inflight.get(flight)
+    if task is None:
+        task = asyncio.create_task(_fetch(panel_id, token, field, user_agent, query))
+        _inflight[flight] = task
+        task.add_done_callback(lambda _: _inflight.pop(flight, None))
+    return await asyncio.shield(task), False
@@ -1,10 +1,10 @@
 """
 services/subscription.py — создание и продление подписок.
 
-PasarGuard и БД всегда обновляются вместе в одном вызове.
-
 subscription_url запрашивается из PasarGuard только один раз — при создании подписки —
 и сохраняется в БД. При последующих обращениях URL берётся из БД.
+В БД хранится ссылка панели; пользователю отдаётся public_subscription_url()
+(через кэширующий прокси бота, если он включён — см. services/sub_cache.py).
 
 ВАЖНО: порядок операций при создании новой подписки:
   1. Сначала PasarGuard (create/extend)
@@ -12,25 +12,29 @@ subscription_url запрашивается из PasarGuard только оди
 Это гарантирует что если PasarGuard падает — DB не обновляется,
 и следующая попытка оплаты пройдёт корректно.
 
-При продлении существующей подписки порядок:
-  1. PasarGuard extend
-  2. DB extend
-Если PasarGuard падает при продлении — логируем ошибку, но НЕ бросаем исключение,
-чтобы пользователь не видел "ошибку создания подписки" когда DB уже обновлена.
+При продлении/реактивации существующей подписки меняется только DB:
+extend_subscription / reactivate_subscription в той же транзакции ставят задачу
+в panel_outbox, а фоновый воркер (services/outbox.py) применяет её к PasarGuard
+с повторами. Пользователь не ждёт панель, и продление не теряется при её сбое.
 """
 
+import asyncio
 import logging
+import time
 
-from bot.config import PLAN_DAYS, GIFT_DAYS
-from bot.database.manager import get_pool
+from bot.config import PLAN_DAYS, GIFT_DAYS, BACKFILL_CONCURRENCY, BACKFILL_BATCH
 from bot.database.subscriptions import (
     create_subscription,
     extend_subscription,
     reactivate_subscription,
     get_active_subscription,
     get_any_subscription,
+    get_subscriptions_without_url,
+    set_subscription_url,
 )
-from bot.services.pasarguard import pasarguard
+from bot.services.job_runs import record_item
+from bot.services.pasarguard import panels
+from bot.services.sub_cache import public_subscription_url
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +44,13 @@ def _panel_username(user_id: int) -> str:
     return f"tg_{user_id}"
 
 
+async def _fetch_and_store_url(sub: dict) -> str:
+    """Запрашивает ссылку подписки из PasarGuard и сохраняет её в БД (следующий раз — без панели)."""
+    url = await panels.for_sub(sub).get_subscription_url(sub["panel_username"])
+    await set_subscription_url(sub["id"], url)
+    return url
+
+
 async def create_gift_subscription(user_id: int) -> str:
     """
     Создаёт подарочную подписку на GIFT_DAYS дней.
@@ -51,45 +62,42 @@ async def create_gift_subscription(user_id: int) -> str:
     active_sub = await get_active_subscription(user_id)
 
     if active_sub:
-        # Продление активной подписки
-        try:
-            await pasarguard.extend_user(username, GIFT_DAYS)
-        except Exception as pg_exc:
-            logger.error("PasarGuard extend FAILED for gift (user %s): %s", user_id, pg_exc)
+        # Продление активной подписки (PasarGuard — через panel_outbox)
         await extend_subscription(active_sub["id"], days=GIFT_DAYS)
-        url = active_sub.get("subscription_url") or await pasarguard.get_subscription_url(username)
+        url = active_sub.get("subscription_url") or await _fetch_and_store_url(active_sub)
+        panel_id = active_sub["panel_id"]
     else:
         any_sub = await get_any_subscription(user_id)
         if any_sub:
             # Реактивация истёкшей — переиспользуем существующий PasarGuard-аккаунт
-            try:
-                await pasarguard.extend_user(username, GIFT_DAYS)
-            except Exception as pg_exc:
-                logger.error("PasarGuard extend FAILED for gift reactivation (user %s): %s", user_id, pg_exc)
             await reactivate_subscription(any_sub["id"], days=GIFT_DAYS)
-            url = any_sub.get("subscription_url") or await pasarguard.get_subscription_url(username)
+            url = any_sub.get("subscription_url") or await _fetch_and_store_url(any_sub)
+            panel_id = any_sub["panel_id"]
         else:
-            # Первая выдача — создаём с нуля
-            await pasarguard.ensure_user(username, days=GIFT_DAYS)
-            url = await pasarguard.get_subscription_url(username)
+            # Первая выдача — создаём с нуля (один запрос к панели в обычном случае)
+            panel_id = panels.assign(user_id)
+            url, _ = await panels.get(panel_id).provision_user(username, days=GIFT_DAYS)
             await create_subscription(
                 user_id=user_id,
                 panel_username=username,
                 days=GIFT_DAYS,
                 auto_renew=False,
                 subscription_url=url,
+                panel_id=panel_id,
             )
 
     logger.info("Gift subscription processed for user %s (%d days)", user_id, GIFT_DAYS)
-    return url
+    return public_subscription_url(panel_id, url)
 
 
 async def create_paid_subscription(
-    user_id: int, payment_method_id: str | None = None
+    user_id: int, payment_method_id: str | None = None, grant_payment: str | None = None
 ) -> str:
     """
     Создаёт, продлевает или реактивирует платную подписку на PLAN_DAYS дней.
-    Возвращает ссылку подписки.
+    Возвращает ссылку подписки. grant_payment — yukassa_payment_id оплаты: выдача по нему
+    отмечается в той же транзакции, что и изменение подписки (PaymentAlreadyGranted,
+    если подписку по этому платежу уже выдали).
 
     Логика:
     - Есть активная подписка → продлить (extend).
@@ -105,26 +113,14 @@ async def create_paid_subscription(
 
     if existing:
         # ── Продление активной подписки ───────────────────────────────────────
-        try:
-            await pasarguard.extend_user(username, PLAN_DAYS)
-        except Exception as pg_exc:
-            logger.error(
-                "PasarGuard extend_user FAILED for user %s (panel: %s): %s — "
-                "DB will be updated anyway. Check PasarGuard manually.",
-                user_id, username, pg_exc,
-            )
-
-        await extend_subscription(existing["id"], days=PLAN_DAYS)
+        # PasarGuard продлевается воркером panel_outbox (задача ставится в той же транзакции)
+        await extend_subscription(existing["id"], days=PLAN_DAYS, grant_payment=grant_payment)
+        panel_id = existing["panel_id"]
 
         url = existing.get("subscription_url")
         if not url:
             try:
-                url = await pasarguard.get_subscription_url(username)
-                async with get_pool().acquire() as conn:
-                    await conn.execute(
-                        "UPDATE subscriptions SET subscription_url = $1 WHERE id = $2",
-                        url, existing["id"],
-                    )
+                url = await _fetch_and_store_url(existing)
             except Exception:
                 url = ""
 
@@ -133,32 +129,21 @@ async def create_paid_subscription(
 
         if any_sub:
             # ── Реактивация существующей (истёкшей) подписки ─────────────────
-            # PasarGuard-пользователь уже создан — просто продлеваем его.
+            # PasarGuard-пользователь уже создан — его продлит воркер panel_outbox.
             # Ссылка VPN у пользователя остаётся прежней.
-            try:
-                await pasarguard.extend_user(username, PLAN_DAYS)
-            except Exception as pg_exc:
-                logger.error(
-                    "PasarGuard extend_user FAILED during reactivation for user %s: %s",
-                    user_id, pg_exc,
-                )
-
             await reactivate_subscription(
                 any_sub["id"],
                 payment_method_id=payment_method_id,
                 days=PLAN_DAYS,
+                grant_payment=grant_payment,
             )
+            panel_id = any_sub["panel_id"]
 
             # URL берём из старой записи; если нет — запрашиваем из PasarGuard
             url = any_sub.get("subscription_url")
             if not url:
                 try:
-                    url = await pasarguard.get_subscription_url(username)
-                    async with get_pool().acquire() as conn:
-                        await conn.execute(
-                            "UPDATE subscriptions SET subscription_url = $1 WHERE id = $2",
-                            url, any_sub["id"],
-                        )
+                    url = await _fetch_and_store_url(any_sub)
                 except Exception:
                     url = ""
 
@@ -166,8 +151,8 @@ async def create_paid_subscription(
 
         else:
             # ── Первая покупка — создаём с нуля ──────────────────────────────
-            await pasarguard.ensure_user(username, days=PLAN_DAYS)
-            url = await pasarguard.get_subscription_url(username)
+            panel_id = panels.assign(user_id)
+            url, _ = await panels.get(panel_id).provision_user(username, days=PLAN_DAYS)
 
             await create_subscription(
                 user_id=user_id,
@@ -175,27 +160,71 @@ async def create_paid_subscription(
                 payment_method_id=payment_method_id,
                 auto_renew=payment_method_id is not None,
                 subscription_url=url,
+                panel_id=panel_id,
+                grant_payment=grant_payment,
             )
 
     logger.info("Paid subscription processed for user %s (%d days)", user_id, PLAN_DAYS)
-    return url
+    return public_subscription_url(panel_id, url) or ""
 
 
 async def get_subscription_url(user_id: int) -> str | None:
     """
     Возвращает сохранённую ссылку подписки для пользователя.
-    Если в БД нет — запрашивает из PasarGuard (fallback для старых записей).
+    Если в БД нет — запрашивает из PasarGuard и сохраняет (fallback для старых записей).
     """
     sub = await get_active_subscription(user_id)
     if not sub:
         return None
 
     url = sub.get("subscription_url")
-    if url:
-        return url
-
-    # Fallback для подписок без subscription_url в DB
-    logger.warning(
-        "subscription_url missing in DB for user %s, fetching from PasarGuard", user_id
-    )
-    return await pasarguard.get_subscription_url(sub["panel_username"])
+    if not url:
+        # Fallback для подписок без subscription_url в DB
+        logger.warning(
+            "subscription_url missing in DB for user %s, fetching from PasarGuard", user_id
+        )
+        url = await _fetch_and_store_url(sub)
+    return public_subscription_url(sub["panel_id"], url)
+
+
+async def backfill_subscription_urls(
+    concurrency: int = BACKFILL_CONCURRENCY,
+    batch_size: int = BACKFILL_BATCH,
+) -> int:
+    """
+    Заполняет subscription_url у всех подписок, где он пустой.
+    Идёт keyset-страницами по id, к панели — не больше concurrency запросов одновременно.
+    Возвращает количество заполненных записей. Ошибки по отдельным пользователям
+    не прерывают проход — такие записи попадут в следующий запуск.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    filled = failed = 0
+
+    async def _one(sub: dict) -> bool:
+        async with sem:
+            started = time.monotonic()
+            try:
+                await _fetch_and_store_url(sub)
+            except Exception as exc:
+                record_item(time.monotonic() - started, ok=False)
+                logger.warning(
+                    "Backfill: no subscription_url for sub %s ('%s'): %s",
+                    sub["id"], sub["panel_username"], exc,
+                )
+                return False
+            record_item(time.monotonic() - started)
+            return True
+
+    after_id = 0
+    while True:
+        batch = await get_subscriptions_without_url(after_id, batch_size)
+        if not batch:
+            break
+        results = await asyncio.gather(*(_one(sub) for sub in batch))
+        filled += sum(results)
+        failed += len(results) - sum(results)
+        after_id = batch[-1]["id"]
+
+    if filled or failed:
+        logger.info("Backfill subscription_url: filled=%d failed=%d", filled, failed)
+    return filled
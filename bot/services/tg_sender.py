@@ -0,0 +1,255 @@
+"""
+services/tg_sender.py — единый контроль исходящих сообщений в Telegram.
+
+Все вызовы Bot API проходят через middleware сессии бота (FloodControlMiddleware),
+поэтому ответы хендлеров, напоминания, уведомления об оплате и рассылка делят
+один бюджет и не упираются в лимиты Telegram по отдельности:
+  • общий token bucket в Redis — не больше TG_GLOBAL_RATE сообщений в секунду на бота
+    суммарно по всем репликам (лимит Telegram — на токен бота, а не на процесс).
+    Без Redis — локальный bucket с тем же темпом (деградация: лимит станет на реплику);
+  • приоритетные полосы: interactive > transactional > reminder > broadcast.
+    Когда токенов не хватает, первым получает токен ожидающий с более высоким
+    приоритетом — рассылка не задерживает ответ пользователю;
+  • интервал на чат (TG_CHAT_INTERVAL_SEC / TG_GROUP_INTERVAL_SEC) — для фоновых полос;
+    интерактивные ответы в чат пользователя идут без задержки;
+  • 429 (TelegramRetryAfter) — пауза ВСЕЙ отправки бота (на всех репликах, через тот же
+    ключ Redis) на retry_after и повтор, до _MAX_RETRIES раз. Пауза глобальная и для 429
+    по одному чату: Telegram не сообщает, чей лимит превышен, а продолжать слать в
+    перегретый бот — продлевать бан. Ошибки больше не глотаются молча.
+
+Полоса задаётся контекстом: with send_priority(Priority.BROADCAST): await bot.send_message(...).
+По умолчанию — interactive (хендлеры).
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Iterator
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage,
+    ForwardMessage,
+    SendAnimation,
+    SendAudio,
+    SendDocument,
+    SendMediaGroup,
+    SendMessage,
+    SendPhoto,
+    SendSticker,
+    SendVideo,
+    SendVoice,
+    TelegramMethod,
+)
+from aiogram.methods.base import Response, TelegramType
+
+from bot.config import TG_CHAT_INTERVAL_SEC, TG_GLOBAL_RATE, TG_GROUP_INTERVAL_SEC
+from bot.utils.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+_MAX_RETRIES = 3
+_CHAT_PRUNE_SIZE = 10_000
+
+_BUCKET_KEY = "tg:send_bucket"
+
+# Общий token bucket: берёт токен или возвращает, сколько секунд ждать.
+# Время — Redis TIME, чтобы часы реплик не расходились. Строка — Lua режет дроби у чисел.
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local s = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'paused_until')
+local paused_until = tonumber(s[3]) or 0
+if now < paused_until then
+    return tostring(paused_until - now)
+end
+local tokens = tonumber(s[1]) or rate
+local ts = tonumber(s[2]) or now
+tokens = math.min(rate, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 60)
+return tostring(wait)
+"""
+
+_PAUSE_SCRIPT = """
+local t = redis.call('TIME')
+local until_ts = tonumber(t[1]) + tonumber(t[2]) / 1000000 + tonumber(ARGV[1])
+local current = tonumber(redis.call('HGET', KEYS[1], 'paused_until')) or 0
+if until_ts > current then
+    redis.call('HSET', KEYS[1], 'paused_until', tostring(until_ts))
+    redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[1])) + 60)
+end
+return 1
+"""
+
+# Методы, на которые действуют лимиты Telegram на отправку сообщений
+_SEND_METHODS = (
+    SendMessage, SendPhoto, SendDocument, SendVideo, SendAnimation, SendAudio,
+    SendVoice, SendSticker, SendMediaGroup, CopyMessage, ForwardMessage,
+)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0     # ответ на действие пользователя
+    TRANSACTIONAL = 1   # оплата, продление, реферальный бонус
+    REMINDER = 2        # напоминания планировщика
+    BROADCAST = 3       # рассылка
+
+
+_priority: ContextVar[Priority] = ContextVar("tg_send_priority", default=Priority.INTERACTIVE)
+
+
+@contextmanager
+def send_priority(priority: Priority) -> Iterator[None]:
+    """Отправки внутри блока идут в полосе priority."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class FloodControl:
+    """Общий (Redis) token bucket с приоритетной очередью ожидающих и интервалом на чат."""
+
+    def __init__(self, rate: float, chat_interval: float, group_interval: float) -> None:
+        self._rate = rate
+        self._chat_interval = chat_interval
+        self._group_interval = group_interval
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._chat_next: dict[int | str, float] = {}
+        self._wakeup = asyncio.Event()
+        self._dispatcher: asyncio.Task | None = None
+        self._shared = True
+
+    async def pause(self, seconds: float) -> None:
+        """Telegram прислал retry_after — приостанавливаем всю отправку бота, на всех репликах."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        try:
+            await get_redis().eval(_PAUSE_SCRIPT, 1, _BUCKET_KEY, seconds)
+        except Exception as exc:
+            logger.warning("Flood control: shared pause unavailable: %s", exc)
+
+    async def _take(self) -> float:
+        """Берёт токен; возвращает 0 или сколько секунд подождать перед следующей попыткой."""
+        try:
+            wait = float(await get_redis().eval(_TAKE_SCRIPT, 1, _BUCKET_KEY, self._rate))
+        except Exception as exc:
+            if self._shared:
+                logger.warning("Flood control: Redis unavailable, limiting per replica: %s", exc)
+                self._shared = False
+            return self._take_local()
+        if not self._shared:
+            logger.info("Flood control: shared Redis bucket is back")
+            self._shared = True
+        return wait
+
+    def _take_local(self) -> float:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._tokens = min(self._rate, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        if self._tokens < 1:
+            return (1 - self._tokens) / self._rate
+        self._tokens -= 1
+        return 0.0
+
+    async def acquire(self, chat_id: int | str | None, priority: Priority) -> None:
+        if chat_id is not None and priority is not Priority.INTERACTIVE:
+            await self._wait_chat(chat_id)
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+    async def _wait_chat(self, chat_id: int | str) -> None:
+        is_group = isinstance(chat_id, str) or chat_id < 0
+        interval = self._group_interval if is_group else self._chat_interval
+        now = time.monotonic()
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + interval
+        if len(self._chat_next) > _CHAT_PRUNE_SIZE:
+            self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _dispatch(self) -> None:
+        """Раздаёт токены ожидающим по приоритету."""
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Отменённые ожидающие токен не расходуют
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+            if not self._waiters:
+                continue
+
+            wait = await self._take()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            # Токен выдаём ожидающему с самым высоким приоритетом на момент выдачи
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+
+
+class FloodControlMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: каждая отправка сообщения получает токен у FloodControl."""
+
+    def __init__(self, flood: FloodControl) -> None:
+        self._flood = flood
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not isinstance(method, _SEND_METHODS):
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        for attempt in range(1, _MAX_RETRIES + 1):
+            await self._flood.acquire(getattr(method, "chat_id", None), priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as exc:
+                await self._flood.pause(exc.retry_after)
+                logger.warning(
+                    "Telegram flood control: %s to %s, retry after %ss (attempt %d/%d, %s)",
+                    type(method).__name__, getattr(method, "chat_id", None),
+                    exc.retry_after, attempt, _MAX_RETRIES, priority.name.lower(),
+                )
+                if attempt == _MAX_RETRIES:
+                    raise
+        raise AssertionError("unreachable")
+
+
+flood_control = FloodControl(TG_GLOBAL_RATE, TG_CHAT_INTERVAL_SEC, TG_GROUP_INTERVAL_SEC)
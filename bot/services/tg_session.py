@@ -0,0 +1,124 @@
+"""
+services/tg_session.py — HTTP-сессия Bot API с настраиваемым пулом и метриками.
+
+Вместо сессии aiogram по умолчанию:
+  • пул соединений, keep-alive и таймаут берутся из config (TG_API_*);
+  • TG_API_BASE_URL — свой Bot API сервер (self-hosted или заглушка для нагрузочных тестов);
+  • каждый запрос попадает в гистограмму задержки своего метода + счётчики ошибок.
+
+Метрики живут в памяти процесса (у каждой реплики свои, с её запуска) и показываются
+в админке на экране статистики вместе с началом окна. Время ожидания в FloodControl (services/tg_sender.py)
+сюда не входит — меряется только сам HTTP-запрос.
+"""
+
+import bisect
+import time
+from datetime import datetime, timezone
+from dataclasses import dataclass, field
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from bot.config import (
+    TG_API_BASE_URL,
+    TG_API_CONN_LIMIT,
+    TG_API_KEEPALIVE_SEC,
+    TG_API_TIMEOUT_SEC,
+)
+
+# Верхние границы корзин гистограммы, мс (последняя корзина — всё, что больше)
+_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+@dataclass
+class MethodStats:
+    calls: int = 0
+    errors: int = 0          # любой отказ: 4xx от Telegram, 5xx, сеть
+    net_errors: int = 0      # только сеть/таймаут/5xx — проблема канала, а не запроса
+    total_ms: float = 0.0
+    buckets: list[int] = field(default_factory=lambda: [0] * (len(_BUCKETS_MS) + 1))
+
+    def observe(self, elapsed_ms: float, error: BaseException | None) -> None:
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.buckets[bisect.bisect_left(_BUCKETS_MS, elapsed_ms)] += 1
+        if error is not None:
+            self.errors += 1
+            if isinstance(error, (TelegramNetworkError, TelegramServerError)):
+                self.net_errors += 1
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.calls if self.calls else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.calls if self.calls else 0.0
+
+    def quantile_ms(self, q: float) -> float | None:
+        """Оценка квантиля по гистограмме — верхняя граница корзины (None — выше последней)."""
+        rank = q * self.calls
+        seen = 0
+        for bound, count in zip(_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return None
+
+
+class InstrumentedSession(AiohttpSession):
+    """AiohttpSession с настраиваемым keep-alive и учётом задержки по методам."""
+
+    def __init__(self, keepalive_sec: float, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._connector_init["keepalive_timeout"] = keepalive_sec
+        self.started_at = time.time()
+        self.stats: dict[str, MethodStats] = {}
+
+    async def make_request(
+        self,
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+        timeout: int | None = None,
+    ) -> TelegramType:
+        started = time.monotonic()
+        error: BaseException | None = None
+        try:
+            return await super().make_request(bot, method, timeout)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            name = method.__api_method__
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = MethodStats()
+            stats.observe((time.monotonic() - started) * 1000, error)
+
+
+def create_bot_session() -> InstrumentedSession:
+    kwargs = {}
+    if TG_API_BASE_URL:
+        kwargs["api"] = TelegramAPIServer.from_base(TG_API_BASE_URL)
+    return InstrumentedSession(
+        keepalive_sec=TG_API_KEEPALIVE_SEC,
+        limit=TG_API_CONN_LIMIT,
+        timeout=TG_API_TIMEOUT_SEC,
+        **kwargs,
+    )
+
+
+def api_metrics(bot: Bot) -> list[tuple[str, MethodStats]]:
+    """Метрики по методам, самые частые первыми. Пусто, если сессия не наша."""
+    stats = getattr(bot.session, "stats", None) or {}
+    return sorted(stats.items(), key=lambda kv: kv[1].calls, reverse=True)
+
+
+def api_metrics_since(bot: Bot) -> datetime | None:
+    """Начало окна метрик (UTC) — запуск сессии этой реплики. None, если сессия не наша."""
+    started_at = getattr(bot.session, "started_at", None)
+    return datetime.fromtimestamp(started_at, timezone.utc) if started_at else None
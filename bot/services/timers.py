@@ -0,0 +1,82 @@
+"""
+services/timers.py — обработчик таймеров жизненных событий подписки.
+
+Таймеры ставит database/subscriptions.py при создании, продлении и реактивации
+(utils/timers.py). Здесь раз в секунду забираются наступившие события:
+  • renew  → автопродление этой подписки (services/renewal.py);
+  • remind → напоминание «истекает завтра» (services/reminders.py);
+  • expire → уведомление об окончании.
+
+Все действия идемпотентны: renew берёт подписку той же арендой, что и ежечасный
+прогон, напоминания проходят через журнал notifications_sent. Поэтому часовые
+проходы планировщика остаются страховкой (таймер потерялся при падении, Redis
+очищен, подписку изменили в админке) и не дублируют того, что уже сделал таймер.
+"""
+
+import asyncio
+import logging
+
+from aiogram import Bot
+
+from bot.services.reminders import remind_expired, remind_expiring
+from bot.services.renewal import renew_subscription
+from bot.utils.timers import SUB_TIMERS_KEY, pop_due_timers
+
+logger = logging.getLogger(__name__)
+
+_POLL_SEC = 1.0
+_BATCH = 100
+_CONCURRENCY = 8
+
+_task: asyncio.Task | None = None
+
+_HANDLERS = {
+    "renew": renew_subscription,
+    "remind": remind_expiring,
+    "expire": remind_expired,
+}
+
+
+async def _fire(bot: Bot, member: str, sem: asyncio.Semaphore) -> None:
+    kind, _, sub_id = member.partition(":")
+    handler = _HANDLERS.get(kind)
+    if handler is None:
+        logger.warning("Timers: unknown event '%s'", member)
+        return
+    async with sem:
+        try:
+            await handler(bot, int(sub_id))
+        except Exception as exc:
+            # Не повторяем: событие подберёт ежечасный проход планировщика
+            logger.error("Timers: %s failed: %s", member, exc)
+
+
+async def _run(bot: Bot) -> None:
+    sem = asyncio.Semaphore(_CONCURRENCY)
+    while True:
+        try:
+            due = await pop_due_timers(SUB_TIMERS_KEY, _BATCH)
+            if due:
+                await asyncio.gather(*(_fire(bot, member, sem) for member in due))
+                if len(due) == _BATCH:
+                    continue  # есть ещё наступившие — не ждём
+        except Exception as exc:
+            logger.error("Timers worker error: %s", exc)
+        await asyncio.sleep(_POLL_SEC)
+
+
+async def start_timers_worker(bot: Bot) -> None:
+    global _task
+    _task = asyncio.create_task(_run(bot))
+    logger.info("Timers worker started")
+
+
+async def stop_timers_worker() -> None:
+    global _task
+    if _task:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
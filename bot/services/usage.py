@@ -0,0 +1,62 @@
+"""
+services/usage.py — периодическая синхронизация расхода трафика из PasarGuard.
+
+Раз в USAGE_SYNC_MIN минут обходит всех пользователей каждой панели постранично
+(GET /api/users — один запрос на USAGE_PAGE_SIZE пользователей) и складывает
+used_traffic / data_limit / online_at в usage_snapshots. Меню показывает данные
+оттуда, поэтому показ меню не стоит ни одного запроса к панели.
+"""
+
+import logging
+from datetime import datetime, timezone
+
+from bot.config import USAGE_PAGE_SIZE
+from bot.database.usage import upsert_usage, delete_stale_usage
+from bot.services.pasarguard import panels
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_dt(value) -> datetime | None:
+    """online_at из панели (ISO-строка или None) → naive UTC, как всё время в БД."""
+    if not value:
+        return None
+    dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+async def sync_usage(page_size: int = USAGE_PAGE_SIZE) -> int:
+    """Обновляет снимки по всем панелям. Возвращает количество обработанных пользователей."""
+    total = 0
+    for client in panels:
+        started = datetime.utcnow()
+        synced = 0
+        try:
+            async for page in client.iter_users(page_size):
+                await upsert_usage([
+                    (
+                        client.panel_id,
+                        user["username"],
+                        user.get("used_traffic") or 0,
+                        user.get("data_limit") or None,
+                        _parse_dt(user.get("online_at")),
+                        user.get("status"),
+                        started,
+                    )
+                    for user in page
+                ])
+                synced += len(page)
+        except Exception as exc:
+            # Старые снимки оставляем — лучше вчерашние цифры, чем никаких
+            logger.error("Usage sync: panel '%s' failed after %d users: %s",
+                         client.panel_id, synced, exc)
+            total += synced
+            continue
+
+        removed = await delete_stale_usage(client.panel_id, started)
+        logger.info("Usage sync: panel '%s' — %d users, %d stale removed",
+                    client.panel_id, synced, removed)
+        total += synced
+    return total
@@ -0,0 +1,120 @@
+"""
+services/yukassa.py — асинхронный клиент API ЮKassa (v3) на aiohttp.
+
+Официальный SDK `yookassa` синхронный (requests) — каждый вызов внутри корутины
+останавливал весь event loop на время HTTPS-запроса. Этот клиент:
+  • держит одну сессию с пулом соединений (keep-alive к api.yookassa.ru);
+  • ограничивает время запроса (YUKASSA_TIMEOUT_SEC);
+  • отправляет Idempotence-Key на каждый POST и повторяет запрос с тем же ключом
+    при сетевых ошибках, 5xx и 429 — повтор не создаст второй платёж;
+  • 202 («запрос с этим ключом ещё обрабатывается») — ждёт retry_after из ответа
+    и повторяет с тем же ключом, как делал SDK;
+  • возвращает JSON-ответ API как dict (поля — как в документации ЮKassa).
+"""
+
+import asyncio
+import logging
+import uuid
+from typing import Any
+
+import aiohttp
+
+from bot.config import YUKASSA_SHOP_ID, YUKASSA_SECRET_KEY, YUKASSA_TIMEOUT_SEC
+
+logger = logging.getLogger(__name__)
+
+_API_URL = "https://api.yookassa.ru"
+_RETRIES = 3                 # повторов сверх первой попытки
+_RETRY_BASE_SEC = 0.5
+
+
+class YukassaError(Exception):
+    """ЮKassa ответила ошибкой (4xx, или 5xx/202 после всех повторов)."""
+
+    def __init__(self, status: int, body: dict[str, Any] | str) -> None:
+        self.status = status
+        self.body = body
+        detail = body.get("description") if isinstance(body, dict) else body
+        super().__init__(f"YooKassa API error {status}: {detail}")
+
+
+class YukassaClient:
+    def __init__(self) -> None:
+        self._session: aiohttp.ClientSession | None = None
+
+    # ── Сессия ────────────────────────────────────────────────────────────────
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                base_url=_API_URL,
+                auth=aiohttp.BasicAuth(YUKASSA_SHOP_ID, YUKASSA_SECRET_KEY),
+                timeout=aiohttp.ClientTimeout(total=YUKASSA_TIMEOUT_SEC),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    # ── Запрос с повторами ────────────────────────────────────────────────────
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        json: dict[str, Any] | None = None,
+        idempotency_key: str | None = None,
+    ) -> dict[str, Any]:
+        headers = {"Idempotence-Key": idempotency_key} if idempotency_key else None
+        session = self._get_session()
+
+        for attempt in range(_RETRIES + 1):
+            delay = _RETRY_BASE_SEC * 2 ** attempt
+            try:
+                async with session.request(method, path, json=json, headers=headers) as resp:
+                    if resp.ok and resp.status != 202:
+                        return await resp.json()
+                    try:
+                        body = await resp.json(content_type=None)
+                    except ValueError:
+                        body = await resp.text()
+                    retryable = resp.status in (202, 429) or resp.status >= 500
+                    if not retryable or attempt == _RETRIES:
+                        raise YukassaError(resp.status, body)
+                    if resp.status == 202 and isinstance(body, dict) and body.get("retry_after"):
+                        delay = int(body["retry_after"]) / 1000  # в миллисекундах
+                    if resp.status == 429 and resp.headers.get("Retry-After", "").isdigit():
+                        delay = int(resp.headers["Retry-After"])
+                    logger.warning(
+                        "YooKassa %s %s returned %d, retry %d/%d in %.1fs",
+                        method, path, resp.status, attempt + 1, _RETRIES, delay,
+                    )
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+                if attempt == _RETRIES:
+                    raise
+                logger.warning(
+                    "YooKassa %s %s failed (%s), retry %d/%d in %.1fs",
+                    method, path, exc.__class__.__name__, attempt + 1, _RETRIES, delay,
+                )
+            await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    # ── Платежи ───────────────────────────────────────────────────────────────
+
+    async def create_payment(
+        self, payload: dict[str, Any], idempotency_key: str | None = None
+    ) -> dict[str, Any]:
+        """POST /v3/payments. Ключ идемпотентности по умолчанию — новый UUID."""
+        return await self._request(
+            "POST", "/v3/payments", json=payload,
+            idempotency_key=idempotency_key or str(uuid.uuid4()),
+        )
+
+    async def get_payment(self, payment_id: str) -> dict[str, Any]:
+        """GET /v3/payments/{id} — актуальный статус платежа."""
+        return await self._request("GET", f"/v3/payments/{payment_id}")
+
+
+# Глобальный экземпляр — используется во всём проекте
+yukassa = YukassaClient()
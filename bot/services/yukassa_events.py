@@ -0,0 +1,138 @@
+"""
+services/yukassa_events.py — фоновый обработчик уведомлений ЮKassa.
+
+Вебхук сохраняет событие в yukassa_events и сразу отвечает 200 — медленная панель
+или Telegram больше не задерживают ответ ЮKassa и не вызывают повторных доставок.
+Воркер (каркас — services/queue_worker.py, как у services/outbox.py):
+  • просыпается по NOTIFY yukassa_events (и раз в YK_EVENTS_POLL_SEC);
+  • обрабатывает событие идемпотентно: подписку выдаёт process_succeeded_payment,
+    который по одному платежу срабатывает ровно один раз;
+  • при ошибке повторяет с экспоненциальной задержкой, после YK_EVENTS_MAX_ATTEMPTS —
+    помечает событие dead и пишет ERROR в лог.
+"""
+
+import logging
+
+from aiogram import Bot
+
+from bot.config import YK_EVENTS_CONCURRENCY, YK_EVENTS_MAX_ATTEMPTS, YK_EVENTS_POLL_SEC
+from bot.database.payments import get_payment_by_yukassa_id, update_payment_status
+from bot.database.subscriptions import get_active_subscription
+from bot.database.yukassa_events import (
+    YUKASSA_EVENTS_CHANNEL,
+    claim_yukassa_events,
+    complete_yukassa_event,
+    fail_yukassa_event,
+)
+from bot.services.payment import process_succeeded_payment, save_card
+from bot.services.payment_events import publish_payment_status
+from bot.services.queue_worker import QueueWorker
+from bot.services.tg_sender import Priority, send_priority
+
+logger = logging.getLogger(__name__)
+
+_BATCH = 50
+_LEASE_SEC = 120
+
+_bot: Bot | None = None
+
+
+# ── Обработка событий ─────────────────────────────────────────────────────────
+
+async def _on_canceled(obj: dict) -> None:
+    payment = await get_payment_by_yukassa_id(obj["id"])
+    if payment and payment["status"] == "pending":
+        await update_payment_status(obj["id"], "canceled")
+        await publish_payment_status(obj["id"], "canceled")
+
+
+async def _on_succeeded(obj: dict) -> None:
+    payment_id = obj["id"]
+    payment = await get_payment_by_yukassa_id(payment_id)
+    if not payment:
+        logger.warning("Unknown payment from YK webhook: %s", payment_id)
+        return
+
+    # ЮКасса для СБП может прислать saved=True только в вебхуке,
+    # даже если при ручной проверке было saved=False.
+    pm = obj.get("payment_method") or {}
+    method_id = pm.get("id") if pm.get("saved") else None
+
+    if payment["granted_at"] is not None:
+        # Подписка уже выдана через «Проверить оплату» — но вебхук может принести
+        # актуальный payment_method_id, которого ещё не было при ручной проверке.
+        if method_id:
+            sub = await get_active_subscription(payment["user_id"])
+            if sub and not sub.get("yukassa_payment_method_id"):
+                await save_card(payment["user_id"], sub["id"], method_id)
+                logger.info(
+                    "YK event: saved payment_method_id %s for user %s (late save)",
+                    method_id, payment["user_id"],
+                )
+        await publish_payment_status(payment_id, "succeeded")
+        return
+
+    # Подписка ещё не выдана (в т.ч. если прошлая выдача упала на середине).
+    # None — платёж параллельно обработала «Проверить оплату» (или другая реплика)
+    url = await process_succeeded_payment(payment_id, payment_method_id=method_id)
+    # Разбудить «Проверить оплату», если пользователь сейчас её ждёт
+    await publish_payment_status(payment_id, "succeeded")
+
+    if url is not None:
+        try:
+            with send_priority(Priority.TRANSACTIONAL):
+                await _bot.send_message(
+                    payment["user_id"],
+                    "✅ <b>Оплата подтверждена!</b>\n\nПодписка активирована. Открой /menu чтобы получить ссылку.",
+                )
+        except Exception as exc:
+            # Подписка уже выдана — повтор события ничего не даст
+            logger.warning("YK event: failed to notify user %s: %s", payment["user_id"], exc)
+
+
+async def _apply(event: dict) -> None:
+    obj = event["payload"].get("object") or {}
+    if event["event_type"] == "payment.succeeded":
+        await _on_succeeded(obj)
+    elif event["event_type"] == "payment.canceled":
+        await _on_canceled(obj)
+
+
+# ── Воркер ────────────────────────────────────────────────────────────────────
+
+async def _complete(event: dict) -> None:
+    await complete_yukassa_event(event["id"])
+
+
+async def _fail(event: dict, error: str, retry_in_sec: int | None) -> None:
+    await fail_yukassa_event(event["id"], error, retry_in_sec)
+
+
+_worker = QueueWorker(
+    name="YK events",
+    channel=YUKASSA_EVENTS_CHANNEL,
+    poll_sec=YK_EVENTS_POLL_SEC,
+    claim=lambda: claim_yukassa_events(_BATCH, _LEASE_SEC),
+    handle=_apply,
+    complete=_complete,
+    fail=_fail,
+    describe=lambda event: f"{event['event_type']} {event['payment_id']}",
+    concurrency=YK_EVENTS_CONCURRENCY,
+    max_attempts=YK_EVENTS_MAX_ATTEMPTS,
+)
+
+
+async def drain_once() -> int:
+    """Обрабатывает одну пачку событий. Возвращает количество взятых событий."""
+    return await _worker.drain_once()
+
+
+async def start_yukassa_worker(bot: Bot) -> None:
+    """Запускает воркер. Вызывается при старте после create_pool()."""
+    global _bot
+    _bot = bot
+    await _worker.start()
+
+
+async def stop_yukassa_worker() -> None:
+    await _worker.stop()
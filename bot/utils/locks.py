@@ -0,0 +1,92 @@
+"""
+utils/locks.py — распределённые блокировки на Redis.
+
+Замена in-memory множеств вида _in_progress: блокировка видна всем репликам бота
+и переживает рестарт процесса (истекает сама через ttl).
+
+  • SET key token NX PX ttl — захват; token уникален для владельца;
+  • снятие — Lua-скрипт: удаляем ключ только если в нём всё ещё наш token,
+    иначе можно снять чужую блокировку, захваченную после истечения нашей.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from typing import AsyncIterator
+
+from bot.utils.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_RETRY_SEC = 0.1
+
+
+class LockBusy(RuntimeError):
+    """Блокировку держит кто-то другой, и за отведённое время она не освободилась."""
+
+
+async def acquire_lock(name: str, ttl_sec: float, wait_sec: float = 0) -> str | None:
+    """
+    Захватывает блокировку name на ttl_sec. Ждёт её освобождения до wait_sec.
+    Возвращает token владельца или None, если блокировка занята.
+    """
+    key = f"lock:{name}"
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait_sec
+    while True:
+        if await get_redis().set(key, token, nx=True, px=int(ttl_sec * 1000)):
+            return token
+        if time.monotonic() >= deadline:
+            return None
+        await asyncio.sleep(_RETRY_SEC)
+
+
+async def release_lock(name: str, token: str) -> None:
+    """Снимает блокировку, если она всё ещё принадлежит token."""
+    try:
+        await get_redis().eval(_RELEASE_SCRIPT, 1, f"lock:{name}", token)
+    except Exception as exc:
+        # Не критично: блокировка истечёт сама через ttl
+        logger.warning("Lock release failed for '%s': %s", name, exc)
+
+
+async def acquire_lease(name: str, ttl_sec: float) -> bool:
+    """
+    Аренда без снятия: True только у первого, кто пришёл за ttl_sec.
+    Используется, чтобы периодическую задачу за период выполнила одна реплика.
+    """
+    return await acquire_lock(name, ttl_sec) is not None
+
+
+@asynccontextmanager
+async def redis_lock(name: str, ttl_sec: float, wait_sec: float = 0) -> AsyncIterator[None]:
+    """async with redis_lock(...) — бросает LockBusy, если захватить не удалось."""
+    token = await acquire_lock(name, ttl_sec, wait_sec)
+    if token is None:
+        raise LockBusy(name)
+    try:
+        yield
+    finally:
+        await release_lock(name, token)
+
+
+def user_lock(user_id: int, wait_sec: float = 30) -> AbstractAsyncContextManager[None]:
+    """
+    Блокировка изменения подписки пользователя (оплата, вебхук, начисление админом).
+    Сериализует create_paid_subscription между репликами.
+    """
+    return redis_lock(f"user:{user_id}", ttl_sec=120, wait_sec=wait_sec)
+
+
+def ui_lock(user_id: int, action: str) -> AbstractAsyncContextManager[None]:
+    """Защита от двойных нажатий: не ждёт, второе нажатие сразу получает LockBusy."""
+    return redis_lock(f"ui:{action}:{user_id}", ttl_sec=60)
@@ -0,0 +1,22 @@
+"""
+utils/redis.py — общий клиент Redis для кода вне хендлеров (воркеры, вебхуки, сервисы).
+
+Хендлеры по-прежнему получают redis через data["redis"]; здесь — тот же экземпляр,
+устанавливается один раз в build_app().
+"""
+
+from redis.asyncio import Redis
+
+_redis: Redis | None = None
+
+
+def set_redis(redis: Redis) -> None:
+    global _redis
+    _redis = redis
+
+
+def get_redis() -> Redis:
+    """Возвращает клиент, гарантируя что он установлен."""
+    if _redis is None:
+        raise RuntimeError("Redis is not initialized. Call set_redis() first.")
+    return _redis
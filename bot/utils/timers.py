@@ -0,0 +1,66 @@
+"""
+utils/timers.py — отложенные события на Redis ZSET.
+
+Таймер — элемент sorted set: member = "{kind}:{id}", score = unix-время срабатывания.
+ZADD того же member переносит таймер (продление подписки просто сдвигает её события).
+Срабатывание забирается атомарно Lua-скриптом (ZRANGEBYSCORE + ZREM) — одно событие
+достаётся ровно одной реплике.
+
+Жизненные события подписки (обработчик — services/timers.py):
+  • renew  — за 24 ч до expires_at: попытка автопродления;
+  • remind — за 24 ч до expires_at: напоминание, если автопродление невозможно;
+  • expire — в expires_at: уведомление об окончании.
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from bot.utils.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+SUB_TIMERS_KEY = "timers:subs"
+
+_POP_SCRIPT = """
+local items = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #items > 0 then
+    redis.call('zrem', KEYS[1], unpack(items))
+end
+return items
+"""
+
+
+async def schedule_timers(key: str, timers: dict[str, float]) -> None:
+    """Ставит или переносит таймеры: {member: unix-время срабатывания}."""
+    await get_redis().zadd(key, timers)
+
+
+async def pop_due_timers(key: str, limit: int, now: float | None = None) -> list[str]:
+    """Забирает до limit наступивших таймеров (атомарно, без повторной выдачи)."""
+    due = now if now is not None else time.time()
+    items = await get_redis().eval(_POP_SCRIPT, 1, key, due, limit)
+    return [item.decode() for item in items]
+
+
+# ── Жизненные события подписки ────────────────────────────────────────────────
+
+def _ts(moment: datetime) -> float:
+    """expires_at в БД хранится как naive UTC."""
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+async def schedule_subscription_timers(subscription_id: int, expires_at: datetime) -> None:
+    """
+    Ставит события подписки под новый expires_at. Ошибки не пробрасываются:
+    изменение подписки уже в БД, а пропущенное событие подберёт ежечасный проход планировщика.
+    """
+    day_before = _ts(expires_at - timedelta(hours=24))
+    try:
+        await schedule_timers(SUB_TIMERS_KEY, {
+            f"renew:{subscription_id}": day_before,
+            f"remind:{subscription_id}": day_before,
+            f"expire:{subscription_id}": _ts(expires_at),
+        })
+    except Exception as exc:
+        logger.warning("Timers not scheduled for sub %s: %s", subscription_id, exc)
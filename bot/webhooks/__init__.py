@@ -1,4 +1,11 @@
 from bot.webhooks.yukassa import register_yukassa_webhook
+from bot.webhooks.pasarguard import register_pasarguard_webhook
 from bot.webhooks.redirect import register_redirect_routes
+from bot.webhooks.subscription import register_subscription_proxy
 
-__all__ = ["register_yukassa_webhook", "register_redirect_routes"]
+__all__ = [
+    "register_yukassa_webhook",
+    "register_pasarguard_webhook",
+    "register_redirect_routes",
+    "register_subscription_proxy",
+]
@@ -0,0 +1,131 @@
+"""
+webhooks/pasarguard.py — приём уведомлений PasarGuard о пользователях.
+
+Панель присылает POST со списком событий (user_created, user_updated, user_deleted,
+user_expired, user_limited, user_disabled, user_enabled, data_usage_reset …)
+и заголовком x-webhook-secret. Адрес содержит id панели: {PATH}/{panel_id}.
+
+По каждому событию:
+  • обновляется снимок пользователя в Redis (services/panel_cache.py) — воркер
+    panel_outbox берёт данные оттуда и не делает GET перед каждым изменением;
+  • subscription_url в БД обновляется, если панель выдала новую ссылку (revoke в панели);
+  • кэш содержимого подписки (services/sub_cache.py) сбрасывается;
+  • пользователя с оплаченной подпиской удалили в панели — ставится задача в panel_outbox,
+    воркер создаст его заново;
+  • расхождение срока только логируется: источник истины — БД (там оплата),
+    исправляет сверка (services/reconcile.py).
+"""
+
+import hmac
+import logging
+import time
+from datetime import timezone
+
+from aiohttp import web
+
+from bot.config import (
+    PASARGUARD_WEBHOOK_PATH,
+    PASARGUARD_WEBHOOK_SECRET,
+    RECONCILE_TOLERANCE_SEC,
+)
+from bot.database.outbox import request_panel_sync
+from bot.database.subscriptions import get_subscription_by_panel_user, set_subscription_url
+from bot.services.panel_cache import drop_user_snapshot, save_user_snapshot
+from bot.services.pasarguard import PasarGuardClient, panels, _parse_expire
+from bot.services.sub_cache import invalidate_sub_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _is_alive(sub: dict) -> bool:
+    expires_ts = sub["expires_at"].replace(tzinfo=timezone.utc).timestamp()
+    return sub["is_active"] and expires_ts > time.time()
+
+
+async def _handle_event(client: PasarGuardClient, event: dict) -> None:
+    action = event.get("action")
+    user = event.get("user") or {}
+    username = event.get("username") or user.get("username")
+    if not username:
+        return
+
+    sub = await get_subscription_by_panel_user(client.panel_id, username)
+
+    await invalidate_sub_cache(
+        client.panel_id,
+        sub.get("subscription_url") if sub else None,
+        client.subscription_url_from(user) if user.get("subscription_url") else None,
+    )
+
+    if action == "user_deleted":
+        await drop_user_snapshot(client.panel_id, username)
+        if sub and _is_alive(sub):
+            logger.warning(
+                "PasarGuard webhook: '%s' deleted on '%s' but paid in DB — restoring",
+                username, client.panel_id,
+            )
+            await request_panel_sync(sub["id"], username)
+        return
+
+    if not user:
+        return
+    await save_user_snapshot(client.panel_id, user)
+    if sub is None:
+        return
+
+    if user.get("subscription_url"):
+        url = client.subscription_url_from(user)
+        if url != sub.get("subscription_url"):
+            await set_subscription_url(sub["id"], url)
+            logger.info("PasarGuard webhook: subscription_url of '%s' changed", username)
+
+    if action in ("user_expired", "user_limited", "user_disabled") and _is_alive(sub):
+        logger.warning(
+            "PasarGuard webhook: '%s' is %s on '%s' while paid in DB",
+            username, action, client.panel_id,
+        )
+    elif user.get("expire") and _is_alive(sub):
+        db_ts = sub["expires_at"].replace(tzinfo=timezone.utc).timestamp()
+        if abs(_parse_expire(user["expire"]) - db_ts) > RECONCILE_TOLERANCE_SEC:
+            logger.warning(
+                "PasarGuard webhook: expire of '%s' changed in panel (%s), DB has %d",
+                username, user["expire"], db_ts,
+            )
+
+
+async def pasarguard_webhook_handler(request: web.Request) -> web.Response:
+    """Принимает пачку событий от панели request.match_info['panel_id']."""
+    secret = request.headers.get("x-webhook-secret", "")
+    if not hmac.compare_digest(secret, PASARGUARD_WEBHOOK_SECRET):
+        return web.Response(status=403)
+
+    try:
+        client = panels.get(request.match_info["panel_id"])
+    except ValueError:
+        return web.Response(status=404, text="Unknown panel")
+
+    try:
+        body = await request.json()
+    except Exception:
+        return web.Response(status=400, text="Invalid JSON")
+
+    events = body if isinstance(body, list) else [body]
+    for event in events:
+        try:
+            await _handle_event(client, event)
+        except Exception as exc:
+            # Одно сломанное событие не должно вызывать повтор всей пачки
+            logger.error(
+                "PasarGuard webhook: failed to handle %s for '%s': %s",
+                event.get("action"), event.get("username"), exc,
+            )
+
+    return web.Response(status=200)
+
+
+def register_pasarguard_webhook(app: web.Application) -> None:
+    """Регистрирует маршрут уведомлений PasarGuard (если задан секрет)."""
+    if not PASARGUARD_WEBHOOK_SECRET:
+        logger.info("PASARGUARD_WEBHOOK_SECRET is empty — PasarGuard webhook disabled")
+        return
+    app.router.add_post(f"{PASARGUARD_WEBHOOK_PATH}/{{panel_id}}", pasarguard_webhook_handler)
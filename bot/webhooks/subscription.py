@@ -0,0 +1,70 @@
+"""
+webhooks/subscription.py — кэширующий прокси ссылок подписки.
+
+GET {SUB_PROXY_PATH}/{panel_id}/{token}
+    Отдаёт содержимое подписки из кэша (services/sub_cache.py), при промахе —
+    из PasarGuard. Поддерживает ETag / If-None-Match: клиент, у которого конфиг
+    не изменился, получает 304 без тела.
+"""
+
+import logging
+import re
+
+from aiohttp import web
+from multidict import CIMultiDict
+
+from bot.config import SUB_PROXY_ENABLED, SUB_PROXY_PATH
+from bot.services.pasarguard import panels
+from bot.services.sub_cache import get_subscription_content
+
+logger = logging.getLogger(__name__)
+
+_UA_CLASS_RE = re.compile(r"[a-z0-9][a-z0-9.\-]{0,31}")
+
+
+def _client_class(request: web.Request) -> str:
+    """Класс клиента для ключа кэша: имя приложения из User-Agent без версии (streisand, clash.meta …)."""
+    match = _UA_CLASS_RE.match(request.headers.get("User-Agent", "").lower())
+    field = match.group(0) if match else "generic"
+    if request.query_string:
+        field += "?" + request.query_string
+    return field
+
+
+async def subscription_proxy(request: web.Request) -> web.Response:
+    panel_id = request.match_info["panel_id"]
+    token = request.match_info["token"]
+    try:
+        panels.get(panel_id)
+    except ValueError:
+        return web.Response(status=404)
+
+    try:
+        entry, hit = await get_subscription_content(
+            panel_id, token, _client_class(request),
+            request.headers.get("User-Agent", ""), request.query_string,
+        )
+    except Exception as exc:
+        logger.error("Subscription proxy: panel '%s' unavailable: %s", panel_id, exc)
+        return web.Response(status=502)
+
+    headers = CIMultiDict(entry["headers"])
+    if entry["status"] != 200:
+        return web.Response(status=entry["status"], body=entry["body"], headers=headers)
+
+    headers["ETag"] = entry["etag"]
+    headers["Cache-Control"] = "no-cache"
+    headers["X-Cache"] = "HIT" if hit else "MISS"
+
+    if_none_match = request.headers.get("If-None-Match", "")
+    if entry["etag"] in (tag.strip() for tag in if_none_match.split(",")):
+        headers.pop("Content-Type", None)
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=entry["body"], headers=headers)
+
+
+def register_subscription_proxy(app: web.Application) -> None:
+    """Регистрирует прокси ссылок подписки (если включён SUB_PROXY_ENABLED)."""
+    if not SUB_PROXY_ENABLED:
+        return
+    app.router.add_get(f"{SUB_PROXY_PATH}/{{panel_id}}/{{token:.+}}", subscription_proxy)
@@ -0,0 +1,25 @@
+"""
+tests/conftest.py — окружение для тестов без Postgres, Redis и Telegram.
+
+bot/config.py читает обязательные переменные при импорте — задаём заглушки
+до первого импорта bot.*. Внешние сервисы тесты подменяют через monkeypatch.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+for _name, _value in {
+    "BOT_TOKEN": "123:test",
+    "ADMIN_IDS": "1",
+    "WEBHOOK_HOST": "https://example.test",
+    "PG_DSN": "postgres://test@localhost/test",
+    "DB_DELETION_PASSWORD": "test",
+    "YUKASSA_SHOP_ID": "1",
+    "YUKASSA_SECRET_KEY": "test",
+    "PASARGUARD_URL": "http://127.0.0.1:8500",
+    "PASARGUARD_USERNAME": "admin",
+    "PASARGUARD_PASSWORD": "admin",
+}.items():
+    os.environ.setdefault(_name, _value)
@@ -0,0 +1,141 @@
+"""
+tests/test_broadcasts.py — контрольные точки рассылки и её завершение.
+
+SQL проверяется по привязке параметров: какая колонка получает какой аргумент
+(без Postgres). Исполнитель рассылки гоняется по задаче в памяти.
+"""
+
+import asyncio
+import re
+
+import pytest
+
+from bot.database import broadcasts as db_broadcasts
+from bot.services import broadcasts
+
+_ASSIGN = re.compile(r"(\w+)\s*=\s*(?:\w+\s*\+\s*)?\$(\d+)\b")
+
+
+class _RecordingConn:
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, tuple]] = []
+
+    async def fetchval(self, query: str, *args):
+        self.calls.append((query, args))
+        return "running"
+
+    async def fetchrow(self, query: str, *args):
+        self.calls.append((query, args))
+        return None
+
+
+class _Acquire:
+    def __init__(self, conn: _RecordingConn) -> None:
+        self._conn = conn
+
+    async def __aenter__(self) -> _RecordingConn:
+        return self._conn
+
+    async def __aexit__(self, *exc) -> None:
+        return None
+
+
+class _Pool:
+    def __init__(self, conn: _RecordingConn) -> None:
+        self._conn = conn
+
+    def acquire(self) -> _Acquire:
+        return _Acquire(self._conn)
+
+
+def _bound(query: str, args: tuple) -> dict[str, object]:
+    """Колонка → значение аргумента, который в неё попадает; все $n должны быть использованы."""
+    used = {int(n) for n in re.findall(r"\$(\d+)", query)}
+    assert used == set(range(1, len(args) + 1)), f"placeholders {sorted(used)} for {len(args)} args"
+    return {col: args[int(n) - 1] for col, n in _ASSIGN.findall(query)}
+
+
+def test_save_progress_binds_each_column(monkeypatch) -> None:
+    conn = _RecordingConn()
+    monkeypatch.setattr(db_broadcasts, "get_pool", lambda: _Pool(conn))
+
+    asyncio.run(db_broadcasts.save_broadcast_progress(7, "tok", 1500, 40, 2, 300))
+
+    (query, args), = conn.calls
+    assert _bound(query, args) == {
+        "last_user_id": 1500, "sent": 40, "failed": 2, "id": 7, "claim_token": "tok",
+    }
+
+
+def test_lease_queries_bind_token(monkeypatch) -> None:
+    conn = _RecordingConn()
+    monkeypatch.setattr(db_broadcasts, "get_pool", lambda: _Pool(conn))
+
+    asyncio.run(db_broadcasts.renew_broadcast_lease(7, "tok", 300))
+    asyncio.run(db_broadcasts.finish_broadcast(7, "tok"))
+
+    for query, args in conn.calls:
+        bound = _bound(query, args)
+        assert bound["id"] == 7 and bound["claim_token"] == "tok"
+
+
+# ── Исполнитель ───────────────────────────────────────────────────────────────
+
+class _FakeJobs:
+    def __init__(self, recipients: list[int]) -> None:
+        self.recipients = recipients
+        self.job = {
+            "id": 1, "audience": "all", "text": "hi", "status": "running", "claim_token": "tok",
+            "last_user_id": 0, "sent": 0, "failed": 0, "total": len(recipients),
+            "chat_id": None, "message_id": None,
+        }
+        self.checkpoints: list[int] = []
+
+    async def get_broadcast_recipients(self, audience: str, after: int, limit: int) -> list[int]:
+        return [uid for uid in self.recipients if uid > after][:limit]
+
+    async def save_broadcast_progress(self, job_id, token, last, sent, failed, lease_sec):
+        assert token == self.job["claim_token"]
+        self.job.update(
+            last_user_id=last, sent=self.job["sent"] + sent, failed=self.job["failed"] + failed
+        )
+        self.checkpoints.append(last)
+        return self.job["status"]
+
+    async def renew_broadcast_lease(self, job_id, token, lease_sec):
+        return self.job["status"]
+
+    async def finish_broadcast(self, job_id, token):
+        assert token == self.job["claim_token"]
+        self.job["status"] = "done"
+        return dict(self.job)
+
+
+class _FakeBot:
+    def __init__(self) -> None:
+        self.sent: list[int] = []
+
+    async def send_message(self, chat_id: int, text: str) -> None:
+        self.sent.append(chat_id)
+
+
+@pytest.fixture
+def jobs(monkeypatch) -> _FakeJobs:
+    fake = _FakeJobs(recipients=list(range(1, 8)))
+    for name in (
+        "get_broadcast_recipients", "save_broadcast_progress",
+        "renew_broadcast_lease", "finish_broadcast",
+    ):
+        monkeypatch.setattr(broadcasts, name, getattr(fake, name))
+    monkeypatch.setattr(broadcasts, "BROADCAST_PAGE", 3)
+    monkeypatch.setattr(broadcasts, "_bot", _FakeBot())
+    return fake
+
+
+def test_job_checkpoints_advance_and_finish(jobs: _FakeJobs) -> None:
+    asyncio.run(broadcasts._run_job(dict(jobs.job)))
+
+    assert jobs.checkpoints == [3, 6, 7]
+    assert broadcasts._bot.sent == list(range(1, 8))
+    assert jobs.job["status"] == "done"
+    assert (jobs.job["sent"], jobs.job["failed"]) == (7, 0)
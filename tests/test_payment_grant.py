@@ -0,0 +1,124 @@
+"""
+tests/test_payment_grant.py — повторная обработка успешного платежа не выдаёт подписку дважды.
+
+БД заменена словарями: подмены create/extend/reactivate_subscription отмечают платёж
+через grant_payment так же, как mark_payment_granted в транзакции.
+"""
+
+import asyncio
+import contextlib
+
+import pytest
+
+from bot.config import GIFT_DAYS, PLAN_DAYS
+from bot.database.payments import PaymentAlreadyGranted
+from bot.services import payment, subscription
+
+
+class _FakeDb:
+    def __init__(self) -> None:
+        self.payments = {"yk-1": {"user_id": 42, "granted_at": None}}
+        self.subs: dict[int, dict] = {}
+
+    def mark_granted(self, yk_id: str | None, sub_id: int) -> None:
+        if yk_id is None:
+            return
+        if self.payments[yk_id]["granted_at"] is not None:
+            raise PaymentAlreadyGranted(yk_id)
+        self.payments[yk_id]["granted_at"] = "now"
+
+    # ── database/payments.py ──
+
+    async def get_ungranted_payment(self, yk_id: str) -> dict | None:
+        row = self.payments.get(yk_id)
+        return dict(row) if row and row["granted_at"] is None else None
+
+    # ── database/subscriptions.py ──
+
+    async def get_active_subscription(self, user_id: int) -> dict | None:
+        return next((dict(s) for s in self.subs.values() if s["user_id"] == user_id), None)
+
+    async def get_any_subscription(self, user_id: int) -> dict | None:
+        return await self.get_active_subscription(user_id)
+
+    async def create_subscription(self, *, user_id, days=None, grant_payment=None, **kwargs) -> int:
+        sub_id = len(self.subs) + 1
+        self.subs[sub_id] = {
+            "id": sub_id, "user_id": user_id, "days": days or PLAN_DAYS,
+            "subscription_url": kwargs.get("subscription_url"), "panel_id": kwargs.get("panel_id"),
+        }
+        self.mark_granted(grant_payment, sub_id)
+        return sub_id
+
+    async def extend_subscription(self, sub_id, days=None, grant_payment=None) -> None:
+        self.mark_granted(grant_payment, sub_id)
+        self.subs[sub_id]["days"] += days or PLAN_DAYS
+
+    async def reactivate_subscription(self, sub_id, payment_method_id=None, days=None, grant_payment=None):
+        await self.extend_subscription(sub_id, days, grant_payment)
+
+
+class _FakePanel:
+    async def provision_user(self, username: str, days: int) -> tuple[str, dict]:
+        return f"https://panel.test/sub/{username}", {}
+
+
+class _FakePanels:
+    def assign(self, user_id: int) -> str:
+        return "main"
+
+    def get(self, panel_id: str) -> _FakePanel:
+        return _FakePanel()
+
+
+@pytest.fixture
+def db(monkeypatch) -> _FakeDb:
+    fake = _FakeDb()
+    monkeypatch.setattr(payment, "get_ungranted_payment", fake.get_ungranted_payment)
+    monkeypatch.setattr(payment, "user_lock", lambda user_id: contextlib.nullcontext())
+    monkeypatch.setattr(payment, "drop_payment_link", lambda user_id: asyncio.sleep(0))
+    for name in (
+        "get_active_subscription", "get_any_subscription",
+        "create_subscription", "extend_subscription", "reactivate_subscription",
+    ):
+        monkeypatch.setattr(subscription, name, getattr(fake, name))
+    monkeypatch.setattr(subscription, "panels", _FakePanels())
+    monkeypatch.setattr(subscription, "public_subscription_url", lambda panel_id, url: url)
+    return fake
+
+
+def test_first_purchase_granted_once(db: _FakeDb) -> None:
+    async def scenario() -> tuple[str | None, str | None]:
+        first = await payment.process_succeeded_payment("yk-1")
+        replay = await payment.process_succeeded_payment("yk-1")
+        return first, replay
+
+    first, replay = asyncio.run(scenario())
+
+    assert first == "https://panel.test/sub/tg_42"
+    assert replay is None
+    assert db.payments["yk-1"]["granted_at"] is not None
+    assert [s["days"] for s in db.subs.values()] == [PLAN_DAYS]
+
+
+def test_concurrent_replay_rolls_back(db: _FakeDb, monkeypatch) -> None:
+    """Обработчик, не увидевший отметку до выдачи, получает PaymentAlreadyGranted и ничего не продлевает."""
+    asyncio.run(payment.process_succeeded_payment("yk-1"))
+    db.payments["yk-1"]["granted_at"] = None
+    stale = db.get_ungranted_payment
+
+    async def granted_elsewhere(yk_id: str) -> dict | None:
+        row = await stale(yk_id)
+        db.payments[yk_id]["granted_at"] = "other replica"
+        return row
+
+    monkeypatch.setattr(payment, "get_ungranted_payment", granted_elsewhere)
+    assert asyncio.run(payment.process_succeeded_payment("yk-1")) is None
+    assert [s["days"] for s in db.subs.values()] == [PLAN_DAYS]
+
+
+def test_first_gift_creates_subscription(db: _FakeDb) -> None:
+    url = asyncio.run(subscription.create_gift_subscription(7))
+
+    assert url == "https://panel.test/sub/tg_7"
+    assert [s["days"] for s in db.subs.values()] == [GIFT_DAYS]
@@ -0,0 +1,55 @@
+"""
+tests/test_queue_worker.py — LISTEN на собственном соединении, закрываемом в stop().
+"""
+
+import asyncio
+
+from bot.services import queue_worker
+
+
+class _FakeListenConn:
+    def __init__(self) -> None:
+        self.listeners: dict[str, object] = {}
+        self.closed = False
+
+    async def add_listener(self, channel: str, callback) -> None:
+        self.listeners[channel] = callback
+
+    async def close(self, timeout: float | None = None) -> None:
+        self.closed = True
+
+    def terminate(self) -> None:
+        self.closed = True
+
+
+def test_listen_connection_is_dedicated_and_closed(monkeypatch) -> None:
+    conn = _FakeListenConn()
+    handled: list[int] = []
+    queue = [[{"id": 1}], []]
+
+    async def connect_listener() -> _FakeListenConn:
+        return conn
+
+    def get_pool():
+        raise AssertionError("LISTEN must not take a pooled connection")
+
+    async def claim() -> list[dict]:
+        return queue.pop(0) if queue else []
+
+    async def handle(item: dict) -> None:
+        handled.append(item["id"])
+
+    monkeypatch.setattr(queue_worker, "connect_listener", connect_listener)
+    monkeypatch.setattr(queue_worker, "get_pool", get_pool, raising=False)
+
+    async def scenario() -> None:
+        worker = queue_worker.QueueWorker("Test", "test_channel", 60, claim, handle)
+        await worker.start()
+        await asyncio.sleep(0.05)
+        assert "test_channel" in conn.listeners
+        await worker.stop()
+
+    asyncio.run(scenario())
+
+    assert handled == [1]
+    assert conn.closed
@@ -0,0 +1,60 @@
+"""
+tests/test_reconcile.py — исправление missing_in_panel сохраняет ссылку пересозданного пользователя.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from bot.services import reconcile
+
+
+class _FakePanel:
+    panel_id = "main"
+
+    def __init__(self, fail: bool = False) -> None:
+        self._fail = fail
+
+    async def create_user(self, username: str, days: int, expire_ts: int | None = None) -> dict:
+        if self._fail:
+            raise RuntimeError("panel down")
+        return {"username": username, "subscription_url": f"/sub/{username}-new-token"}
+
+    def subscription_url_from(self, data: dict) -> str:
+        return f"https://panel.test{data['subscription_url']}"
+
+
+def _run_missing(monkeypatch, panel: _FakePanel) -> tuple[reconcile.ReconcileReport, dict, list]:
+    saved: dict[int, str] = {}
+    invalidated: list[str] = []
+
+    async def set_subscription_url(subscription_id: int, url: str) -> None:
+        saved[subscription_id] = url
+
+    async def invalidate_sub_cache(panel_id: str, url: str | None) -> None:
+        invalidated.append(url)
+
+    monkeypatch.setattr(reconcile, "set_subscription_url", set_subscription_url)
+    monkeypatch.setattr(reconcile, "invalidate_sub_cache", invalidate_sub_cache)
+    sub = {
+        "id": 3, "panel_username": "tg_42", "is_active": True,
+        "expires_at": datetime.utcnow() + timedelta(days=10),
+        "subscription_url": "https://panel.test/sub/tg_42-old-token",
+    }
+    report = reconcile.ReconcileReport()
+    asyncio.run(reconcile._missing(panel, sub, report, fix=True))
+    return report, saved, invalidated
+
+
+def test_recreated_user_gets_new_url(monkeypatch) -> None:
+    report, saved, invalidated = _run_missing(monkeypatch, _FakePanel())
+
+    assert (report.missing_in_panel, report.fixed, report.fix_errors) == (1, 1, 0)
+    assert saved == {3: "https://panel.test/sub/tg_42-new-token"}
+    assert invalidated == ["https://panel.test/sub/tg_42-old-token"]
+
+
+def test_failed_create_keeps_url(monkeypatch) -> None:
+    report, saved, _ = _run_missing(monkeypatch, _FakePanel(fail=True))
+
+    assert (report.fixed, report.fix_errors) == (0, 1)
+    assert saved == {}
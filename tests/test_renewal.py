@@ -0,0 +1,60 @@
+"""
+tests/test_renewal.py — автопродление отключает подписку только при отказе банка.
+"""
+
+import asyncio
+
+import pytest
+
+from bot.services import renewal
+from bot.services.yukassa import YukassaError
+
+_SUB = {"id": 5, "user_id": 42, "yukassa_payment_method_id": "pm-1"}
+
+
+@pytest.fixture
+def deactivated(monkeypatch) -> list[int]:
+    calls: list[int] = []
+
+    async def deactivate_subscription(subscription_id: int) -> None:
+        calls.append(subscription_id)
+
+    monkeypatch.setattr(renewal, "deactivate_subscription", deactivate_subscription)
+    return calls
+
+
+def _charge_with(monkeypatch, outcome) -> tuple[bool, renewal.RenewalStats]:
+    async def charge_auto_renew(sub, bot):
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(renewal, "charge_auto_renew", charge_auto_renew)
+    stats = renewal.RenewalStats()
+    ok = asyncio.run(renewal._charge(dict(_SUB), None, stats))
+    return ok, stats
+
+
+@pytest.mark.parametrize("status", [400, 401, 403, 404, 429, 500])
+def test_api_error_is_retried_not_declined(monkeypatch, deactivated, status) -> None:
+    ok, stats = _charge_with(monkeypatch, YukassaError(status, {"description": "error"}))
+
+    assert ok is False
+    assert (stats.errors, stats.declined) == (1, 0)
+    assert deactivated == []
+
+
+def test_canceled_payment_deactivates(monkeypatch, deactivated) -> None:
+    ok, stats = _charge_with(monkeypatch, "canceled")
+
+    assert ok is True
+    assert stats.declined == 1
+    assert deactivated == [_SUB["id"]]
+
+
+def test_pending_payment_keeps_subscription(monkeypatch, deactivated) -> None:
+    ok, stats = _charge_with(monkeypatch, "pending")
+
+    assert ok is True
+    assert stats.pending == 1
+    assert deactivated == []
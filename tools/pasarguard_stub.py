@@ -0,0 +1,360 @@
+"""
+tools/pasarguard_stub.py — локальная замена PasarGuard для тестов и бенчмарков.
+
+Реализует используемые ботом и админкой эндпоинты, хранит пользователей в памяти
+и умеет имитировать медленную и нестабильную панель.
+
+    POST   /api/admin/token           — выдаёт токен (истекает через --token-ttl)
+    GET    /api/users                 — список (offset, limit, sort=username|-username)
+    POST   /api/user                  — создание (дубликат → --conflict-status, невалидное → 422)
+    GET    /api/user/{username}       — 200 / 404
+    PUT    /api/user/{username}       — изменение (невалидное → 422)
+    DELETE /api/user/{username}       — 200 / 404
+    GET    /api/groups                — группы (--groups) с total_users по текущим пользователям
+    GET    /sub/{token}               — содержимое подписки (без авторизации, формат по User-Agent)
+    GET    /_stub/stats               — счётчики запросов по маршрутам и кодам ответа
+    POST   /_stub/reset               — очистить пользователей и счётчики
+
+Распределения задержки (--latency, --latency-write для POST/PUT/DELETE):
+    fixed:50            — всегда 50 мс
+    uniform:20,200      — равномерно 20–200 мс
+    normal:80,20        — нормальное (среднее, σ), не меньше 0
+    lognormal:60,0.5    — логнормальное (медиана мс, σ) — похоже на реальный хвост
+    exp:100             — экспоненциальное со средним 100 мс
+
+Запуск:
+    python tools/pasarguard_stub.py --port 8500 --latency lognormal:60,0.6 --error-rate 0.02
+    PASARGUARD_URL=http://127.0.0.1:8500 python -m bot.main
+"""
+
+import argparse
+import asyncio
+import base64
+import math
+import random
+import re
+import secrets
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+_USERNAME_RE = re.compile(r"^[a-zA-Z0-9_@.\-]{3,32}$")
+_WRITE_METHODS = ("POST", "PUT", "DELETE")
+
+
+# ── Задержки и сбои ───────────────────────────────────────────────────────────
+
+def parse_latency(spec: str):
+    """Превращает строку вида 'lognormal:60,0.5' в функцию rng → секунды."""
+    kind, _, raw = spec.partition(":")
+    args = [float(x) for x in raw.split(",") if x] if raw else []
+
+    if kind == "fixed":
+        return lambda rng: args[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1]) / 1000
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1])) / 1000
+    if kind == "lognormal":
+        mu = math.log(args[0])
+        return lambda rng: rng.lognormvariate(mu, args[1]) / 1000
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / args[0]) / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class Faults:
+    def __init__(self, opts: argparse.Namespace) -> None:
+        self.rng = random.Random(opts.seed)
+        self.latency = parse_latency(opts.latency)
+        self.latency_write = parse_latency(opts.latency_write) if opts.latency_write else self.latency
+        self.error_rate = opts.error_rate
+        self.hang_rate = opts.hang_rate
+        self.hang_sec = opts.hang_sec
+        self.auth_fail_rate = opts.auth_fail_rate
+
+    def delay(self, method: str) -> float:
+        dist = self.latency_write if method in _WRITE_METHODS else self.latency
+        return dist(self.rng)
+
+
+# ── Хранилище ─────────────────────────────────────────────────────────────────
+
+class Store:
+    def __init__(self, token_ttl: int, group_ids: list[int]) -> None:
+        self.users: dict[str, dict] = {}
+        self.group_ids = group_ids
+        self.tokens: dict[str, float] = {}
+        self.token_ttl = token_ttl
+        self.stats: Counter = Counter()
+
+    def issue_token(self) -> str:
+        token = secrets.token_urlsafe(24)
+        self.tokens[token] = time.time() + self.token_ttl
+        return token
+
+    def token_valid(self, header: str) -> bool:
+        if not header.startswith("Bearer "):
+            return False
+        expires = self.tokens.get(header[7:])
+        return expires is not None and expires > time.time()
+
+    def view(self, user: dict) -> dict:
+        data = dict(user)
+        if data["status"] == "active" and data["expire"] and data["expire"] < time.time():
+            data["status"] = "expired"
+        return data
+
+
+def _validate(payload: dict, creating: bool) -> list[dict]:
+    """Минимальная валидация в духе FastAPI: список ошибок для 422."""
+    errors = []
+    if creating:
+        name = payload.get("username")
+        if not isinstance(name, str) or not _USERNAME_RE.match(name):
+            errors.append({"loc": ["body", "username"], "msg": "invalid username"})
+    expire = payload.get("expire")
+    if expire is not None and not isinstance(expire, (int, float)):
+        errors.append({"loc": ["body", "expire"], "msg": "expire must be a unix timestamp"})
+    limit = payload.get("data_limit")
+    if limit is not None and (not isinstance(limit, int) or limit < 0):
+        errors.append({"loc": ["body", "data_limit"], "msg": "data_limit must be >= 0"})
+    status = payload.get("status")
+    if status is not None and status not in ("active", "disabled", "on_hold"):
+        errors.append({"loc": ["body", "status"], "msg": "invalid status"})
+    return errors
+
+
+# ── Middleware: задержка, сбои, авторизация, статистика ───────────────────────
+
+@web.middleware
+async def stub_middleware(request: web.Request, handler):
+    app = request.app
+    faults: Faults = app["faults"]
+    store: Store = app["store"]
+    route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+
+    if route.startswith("/_stub"):
+        return await handler(request)
+
+    await asyncio.sleep(faults.delay(request.method))
+
+    if faults.hang_rate and faults.rng.random() < faults.hang_rate:
+        await asyncio.sleep(faults.hang_sec)
+
+    if faults.error_rate and faults.rng.random() < faults.error_rate:
+        status = faults.rng.choice((500, 502, 503))
+        resp = web.json_response({"detail": "injected failure"}, status=status)
+    elif route != "/api/admin/token" and not route.startswith("/sub/") and (
+        not store.token_valid(request.headers.get("Authorization", ""))
+        or (faults.auth_fail_rate and faults.rng.random() < faults.auth_fail_rate)
+    ):
+        resp = web.json_response({"detail": "Could not validate credentials"}, status=401)
+    else:
+        resp = await handler(request)
+
+    store.stats[f"{request.method} {route} {resp.status}"] += 1
+    return resp
+
+
+# ── Эндпоинты ─────────────────────────────────────────────────────────────────
+
+async def token(request: web.Request) -> web.Response:
+    form = await request.post()
+    opts = request.app["opts"]
+    if form.get("username") != opts.admin_user or form.get("password") != opts.admin_pass:
+        return web.json_response({"detail": "Incorrect username or password"}, status=401)
+    return web.json_response(
+        {"access_token": request.app["store"].issue_token(), "token_type": "bearer"}
+    )
+
+
+async def list_users(request: web.Request) -> web.Response:
+    store: Store = request.app["store"]
+    offset = int(request.query.get("offset", 0))
+    limit = int(request.query.get("limit", 100))
+    sort = request.query.get("sort", "username")
+    names = sorted(store.users, reverse=sort.startswith("-"))
+    page = [store.view(store.users[n]) for n in names[offset:offset + limit]]
+    return web.json_response({"users": page, "total": len(names)})
+
+
+async def create_user(request: web.Request) -> web.Response:
+    store: Store = request.app["store"]
+    payload = await request.json()
+    errors = _validate(payload, creating=True)
+    if errors:
+        return web.json_response({"detail": errors}, status=422)
+
+    username = payload["username"]
+    if username in store.users:
+        return web.json_response(
+            {"detail": "User already exists"}, status=request.app["opts"].conflict_status
+        )
+
+    now = datetime.now(tz=timezone.utc).isoformat()
+    user = {
+        "username": username,
+        "status": payload.get("status") or "active",
+        "expire": payload.get("expire"),
+        "data_limit": payload.get("data_limit", 0),
+        "data_limit_reset_strategy": payload.get("data_limit_reset_strategy", "no_reset"),
+        "proxies": payload.get("proxies") or {},
+        "inbounds": payload.get("inbounds") or {},
+        "group_ids": payload.get("group_ids") or [],
+        "used_traffic": 0,
+        "lifetime_used_traffic": 0,
+        "created_at": now,
+        "online_at": None,
+        "note": payload.get("note"),
+        "links": [],
+        "subscription_url": f"/sub/{secrets.token_urlsafe(16)}",
+    }
+    store.users[username] = user
+    return web.json_response(store.view(user))
+
+
+async def get_user(request: web.Request) -> web.Response:
+    store: Store = request.app["store"]
+    user = store.users.get(request.match_info["username"])
+    if user is None:
+        return web.json_response({"detail": "User not found"}, status=404)
+    return web.json_response(store.view(user))
+
+
+async def modify_user(request: web.Request) -> web.Response:
+    store: Store = request.app["store"]
+    user = store.users.get(request.match_info["username"])
+    if user is None:
+        return web.json_response({"detail": "User not found"}, status=404)
+    payload = await request.json()
+    errors = _validate(payload, creating=False)
+    if errors:
+        return web.json_response({"detail": errors}, status=422)
+    for key in ("status", "expire", "data_limit", "data_limit_reset_strategy",
+                "proxies", "inbounds", "group_ids", "note"):
+        if key in payload:
+            user[key] = payload[key]
+    return web.json_response(store.view(user))
+
+
+async def delete_user(request: web.Request) -> web.Response:
+    store: Store = request.app["store"]
+    if store.users.pop(request.match_info["username"], None) is None:
+        return web.json_response({"detail": "User not found"}, status=404)
+    return web.json_response({})
+
+
+async def list_groups(request: web.Request) -> web.Response:
+    store: Store = request.app["store"]
+    load = Counter(g for user in store.users.values() for g in user.get("group_ids") or [])
+    groups = [
+        {"id": g, "name": f"group-{g}", "is_disabled": False, "total_users": load[g]}
+        for g in store.group_ids
+    ]
+    return web.json_response({"groups": groups, "total": len(groups)})
+
+
+async def subscription(request: web.Request) -> web.Response:
+    store: Store = request.app["store"]
+    path = f"/sub/{request.match_info['token']}"
+    user = next((u for u in store.users.values() if u["subscription_url"] == path), None)
+    if user is None:
+        return web.json_response({"detail": "Not Found"}, status=404)
+    data = store.view(user)
+    ua = request.headers.get("User-Agent", "")
+    links = [f"vless://{data['username']}@node-{g}.example:443#{ua[:16]}" for g in data["group_ids"]]
+    headers = {
+        "Subscription-Userinfo": (
+            f"upload=0; download={data['used_traffic']}; "
+            f"total={data['data_limit'] or 0}; expire={data['expire'] or 0}"
+        ),
+        "Profile-Update-Interval": "12",
+        "Content-Type": "text/plain; charset=utf-8",
+    }
+    return web.Response(body=base64.b64encode("\n".join(links).encode()), headers=headers)
+
+
+async def stub_stats(request: web.Request) -> web.Response:
+    store: Store = request.app["store"]
+    return web.json_response({"users": len(store.users), "requests": dict(store.stats)})
+
+
+async def stub_reset(request: web.Request) -> web.Response:
+    store: Store = request.app["store"]
+    store.users.clear()
+    store.stats.clear()
+    return web.json_response({"ok": True})
+
+
+# ── Сборка приложения ─────────────────────────────────────────────────────────
+
+def _preload(store: Store, count: int, rng: random.Random) -> None:
+    """Создаёт count пользователей, раскиданных по группам неравномерно (первая — самая загруженная)."""
+    weights = [2 ** -i for i in range(len(store.group_ids))]
+    now = int(time.time())
+    for i in range(count):
+        name = f"tg_{100000 + i}"
+        store.users[name] = {
+            "username": name, "status": "active",
+            "expire": now + rng.randint(-30, 60) * 86400,
+            "data_limit": 0, "data_limit_reset_strategy": "no_reset",
+            "proxies": {"vless": {}}, "inbounds": {"vless": ["vless-tcp"]},
+            "group_ids": rng.choices(store.group_ids, weights),
+            "used_traffic": 0, "lifetime_used_traffic": 0,
+            "created_at": None, "online_at": None, "note": None, "links": [],
+            "subscription_url": f"/sub/{secrets.token_urlsafe(16)}",
+        }
+
+
+def build_app(opts: argparse.Namespace) -> web.Application:
+    app = web.Application(middlewares=[stub_middleware])
+    app["opts"] = opts
+    app["faults"] = Faults(opts)
+    app["store"] = Store(opts.token_ttl, [int(g) for g in opts.groups.split(",")])
+    if opts.preload:
+        _preload(app["store"], opts.preload, app["faults"].rng)
+
+    app.router.add_post("/api/admin/token", token)
+    app.router.add_get("/api/users", list_users)
+    app.router.add_post("/api/user", create_user)
+    app.router.add_get("/api/user/{username}", get_user)
+    app.router.add_put("/api/user/{username}", modify_user)
+    app.router.add_delete("/api/user/{username}", delete_user)
+    app.router.add_get("/api/groups", list_groups)
+    app.router.add_get("/sub/{token}", subscription)
+    app.router.add_get("/_stub/stats", stub_stats)
+    app.router.add_post("/_stub/reset", stub_reset)
+    return app
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="In-memory PasarGuard stand-in")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8500)
+    p.add_argument("--admin-user", default="admin")
+    p.add_argument("--admin-pass", default="admin")
+    p.add_argument("--latency", default="fixed:0", help="распределение задержки для чтения")
+    p.add_argument("--latency-write", default=None, help="распределение для POST/PUT/DELETE")
+    p.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500/502/503")
+    p.add_argument("--hang-rate", type=float, default=0.0, help="доля «зависших» запросов")
+    p.add_argument("--hang-sec", type=float, default=60.0)
+    p.add_argument("--auth-fail-rate", type=float, default=0.0, help="доля случайных 401")
+    p.add_argument("--token-ttl", type=int, default=3600, help="время жизни токена, сек")
+    p.add_argument("--conflict-status", type=int, default=409, choices=(400, 409, 422),
+                   help="код ответа на создание существующего пользователя")
+    p.add_argument("--preload", type=int, default=0, help="создать N пользователей tg_*")
+    p.add_argument("--groups", default="1", help="id групп через запятую, напр. 1,2,3")
+    p.add_argument("--seed", type=int, default=None)
+    return p.parse_args(argv)
+
+
+def main() -> None:
+    opts = parse_args()
+    web.run_app(build_app(opts), host=opts.host, port=opts.port)
+
+
+if __name__ == "__main__":
+    main()